@@ -0,0 +1,175 @@
+import asyncio
+import io
+import json
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from benchmarking import TRACKER_TOKEN, benchmark_database, create_trip
+from django.db import connection
+from django.core.asgi import get_asgi_application
+from django.core.wsgi import get_wsgi_application
+from django.utils import timezone
+
+# Both applications are driven in-process with the same requests, so the
+# comparison is between the two Django handlers rather than two servers.
+WSGI_THREADS = 16  # e.g. gunicorn --threads 16
+IDLE_CLIENTS = 100
+WAIT_SECONDS = 2
+
+
+def report_body(trip, index):
+    return json.dumps([{'trip': trip.id, 'latitude': -26.1 + index / 1000, 'longitude': 28.1,
+                        'timestamp': timezone.now().isoformat()}]).encode()
+
+
+def wsgi_request(application, method, url, body=b''):
+    parts = urlsplit(url)
+    environ = {
+        'REQUEST_METHOD': method, 'PATH_INFO': parts.path, 'QUERY_STRING': parts.query,
+        'SERVER_NAME': 'testserver', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+        'CONTENT_TYPE': 'application/json', 'CONTENT_LENGTH': str(len(body)),
+        'HTTP_AUTHORIZATION': f'Bearer {TRACKER_TOKEN}',
+        'wsgi.input': io.BytesIO(body), 'wsgi.url_scheme': 'http', 'wsgi.errors': io.StringIO(),
+        'wsgi.multithread': True, 'wsgi.multiprocess': False, 'wsgi.run_once': False,
+    }
+    status = []
+    result = application(environ, lambda response_status, headers: status.append(response_status))
+    content = b''.join(result)
+    result.close()
+    return int(status[0].split()[0]), content
+
+
+async def asgi_request(application, method, url, body=b''):
+    parts = urlsplit(url)
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': method,
+        'scheme': 'http', 'path': parts.path, 'raw_path': parts.path.encode(),
+        'query_string': parts.query.encode(), 'root_path': '',
+        'headers': [(b'host', b'testserver'), (b'content-type', b'application/json'),
+                    (b'content-length', str(len(body)).encode()),
+                    (b'authorization', f'Bearer {TRACKER_TOKEN}'.encode())],
+        'client': ('127.0.0.1', 50000), 'server': ('testserver', 80),
+    }
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    disconnected = asyncio.Event()
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        await disconnected.wait()
+        return {'type': 'http.disconnect'}
+
+    response = {'content': b''}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            response['status'] = message['status']
+        elif message['type'] == 'http.response.body':
+            response['content'] += message.get('body', b'')
+
+    await application(scope, receive, send)
+    disconnected.set()
+    return response['status'], response['content']
+
+
+class ThreadWatcher:
+    def __init__(self):
+        self.peak = threading.active_count()
+        self.running = True
+        self.thread = threading.Thread(target=self.watch, daemon=True)
+        self.thread.start()
+
+    def watch(self):
+        while self.running:
+            self.peak = max(self.peak, threading.active_count())
+            time.sleep(0.01)
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+        return self.peak
+
+
+def print_results(started, waits, probe_latency, watcher):
+    delivered = [latency for changed, latency in waits if changed]
+    print(f"   report accepted after:          {probe_latency * 1000:8.0f} ms")
+    print(f"   dispatchers that saw it:        {len(delivered):8d} of {len(waits)}")
+    if delivered:
+        print(f"   delivery after report:          {min(delivered) * 1000:8.0f} ms first, "
+              f"{statistics.median(delivered) * 1000:.0f} ms median, {max(delivered) * 1000:.0f} ms last")
+    print(f"   wall time for all clients:      {time.perf_counter() - started:8.2f} s")
+    print(f"   peak threads:                   {watcher.stop():8d}")
+
+
+def run_wsgi(trip, revision):
+    application = get_wsgi_application()
+    url = f'/api/live-positions/?since={revision}&wait={WAIT_SECONDS}'
+    waits = []
+    report_sent = {}
+    watcher = ThreadWatcher()
+    started = time.perf_counter()
+
+    def long_poll():
+        status, content = wsgi_request(application, 'GET', url)
+        assert status == 200, content[:300]
+        waits.append((bool(json.loads(content)['positions']), time.perf_counter() - report_sent['at']))
+
+    with ThreadPoolExecutor(max_workers=WSGI_THREADS) as pool:
+        futures = [pool.submit(long_poll) for _ in range(IDLE_CLIENTS)]
+        time.sleep(0.5)
+        report_sent['at'] = time.perf_counter()
+        # Queued behind the long polls like any other request
+        probe = pool.submit(wsgi_request, application, 'POST', '/api/trips/gps-points/', report_body(trip, 1))
+        status, content = probe.result()
+        probe_latency = time.perf_counter() - report_sent['at']
+        assert status == 201, content[:300]
+        for future in futures:
+            future.result()
+    print_results(started, waits, probe_latency, watcher)
+
+
+def run_asgi(trip, revision):
+    application = get_asgi_application()
+    url = f'/api/live-positions/?since={revision}&wait={WAIT_SECONDS}'
+    waits = []
+    report_sent = {}
+    watcher = ThreadWatcher()
+    started = time.perf_counter()
+
+    async def long_poll():
+        status, content = await asgi_request(application, 'GET', url)
+        assert status == 200, content[:300]
+        waits.append((bool(json.loads(content)['positions']), time.perf_counter() - report_sent['at']))
+
+    async def main():
+        polls = [asyncio.create_task(long_poll()) for _ in range(IDLE_CLIENTS)]
+        await asyncio.sleep(0.5)
+        report_sent['at'] = time.perf_counter()
+        status, content = await asgi_request(application, 'POST', '/api/trips/gps-points/', report_body(trip, 2))
+        assert status == 201, content[:300]
+        probe_latency = time.perf_counter() - report_sent['at']
+        await asyncio.gather(*polls)
+        return probe_latency
+
+    probe_latency = asyncio.run(main())
+    print_results(started, waits, probe_latency, watcher)
+
+
+# Requests run on many threads at once, which SQLite's in-memory test
+# database cannot serve; use a throwaway file instead.
+with benchmark_database(
+    f"WSGI vs ASGI: {IDLE_CLIENTS} long-polling dispatchers (wait={WAIT_SECONDS}s) and one tracker report", file=True,
+):
+    trip = create_trip(job_fields={'status': 'in_progress'})
+    connection.close()
+
+    print(f"\n1. WSGI handler, {WSGI_THREADS} worker threads:")
+    status, content = wsgi_request(get_wsgi_application(), 'GET', '/api/live-positions/')
+    run_wsgi(trip, json.loads(content)['revision'])
+
+    print("\n2. ASGI handler, one event loop:")
+    status, content = wsgi_request(get_wsgi_application(), 'GET', '/api/live-positions/')
+    run_asgi(trip, json.loads(content)['revision'])
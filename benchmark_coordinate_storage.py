@@ -0,0 +1,112 @@
+import json
+import random
+from datetime import timedelta
+from decimal import Decimal
+
+from benchmarking import benchmark_database, create_trip, median_ms
+import numpy as np
+from django.db import connection, models
+from django.db.models import FloatField
+from django.db.models.functions import Cast
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+from trips.models import Trip, GPSRoutePoint
+from trips.routes import route_rows
+from trips.serializers import GPSRoutePointSerializer
+from trips.trail import EpochSeconds, load_trails
+
+POINT_COUNT = 100000
+RUNS = 5
+
+
+class DecimalGPSRoutePoint(models.Model):
+    # GPSRoutePoint as it was stored before migration 0013
+    trip = models.ForeignKey(Trip, on_delete=models.CASCADE, related_name='+')
+    latitude = models.DecimalField(max_digits=9, decimal_places=6)
+    longitude = models.DecimalField(max_digits=9, decimal_places=6)
+    timestamp = models.DateTimeField()
+    speed = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True)
+    device_seq = models.PositiveIntegerField(null=True, blank=True)
+
+    class Meta:
+        app_label = 'trips'
+        db_table = 'benchmark_decimal_gpsroutepoint'
+        ordering = ['timestamp']
+        indexes = [models.Index(fields=['trip', 'timestamp'], name='benchmark_decimal_trip_time')]
+
+
+class DecimalGPSRoutePointSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DecimalGPSRoutePoint
+        fields = ['id', 'latitude', 'longitude', 'timestamp', 'speed']
+
+
+def create_points(trip):
+    lat, lng = -26.2041, 28.0473
+    captured = timezone.now() - timedelta(seconds=POINT_COUNT)
+    decimal_points, integer_points = [], []
+    for i in range(POINT_COUNT):
+        lat += random.uniform(-0.0002, 0.0002)
+        lng += random.uniform(-0.0002, 0.0002)
+        values = {
+            'trip': trip, 'latitude': Decimal(f'{lat:.6f}'), 'longitude': Decimal(f'{lng:.6f}'),
+            'timestamp': captured + timedelta(seconds=i), 'speed': Decimal(f'{random.uniform(0, 120):.2f}'),
+        }
+        decimal_points.append(DecimalGPSRoutePoint(**values))
+        integer_points.append(GPSRoutePoint(**values))
+    DecimalGPSRoutePoint.objects.bulk_create(decimal_points, batch_size=5000)
+    GPSRoutePoint.objects.bulk_create(integer_points, batch_size=5000)
+
+
+def without_ids(payload):
+    # Both tables hold the same points, so the responses differ only in ids
+    return [{key: value for key, value in point.items() if key != 'id'} for point in json.loads(payload)]
+
+
+def compare(name, before, after):
+    before_result, before_ms = median_ms(before, RUNS)
+    after_result, after_ms = median_ms(after, RUNS)
+    print(f"   {name:38s} {before_ms:8.1f} ms  {after_ms:8.1f} ms  ({before_ms / after_ms:4.1f}x)")
+    return before_result, after_result
+
+
+with benchmark_database(f"COORDINATE STORAGE: Decimal vs integer columns ({POINT_COUNT:,} points)", serialize=False):
+    with connection.schema_editor() as editor:
+        editor.create_model(DecimalGPSRoutePoint)
+    trip = create_trip()
+    create_points(trip)
+    decimal_points = DecimalGPSRoutePoint.objects.filter(trip=trip)
+    integer_points = GPSRoutePoint.objects.filter(trip=trip)
+
+    print(f"\n   {'':38s} {'Decimal':>11s}  {'integer':>11s}")
+    compare(
+        "read coordinate tuples",
+        lambda: list(decimal_points.all().values_list('latitude', 'longitude', 'timestamp', 'speed')),
+        lambda: list(integer_points.all().values_list('latitude_e6', 'longitude_e6', 'timestamp', 'speed_e2')),
+    )
+    compare(
+        "read model instances",
+        lambda: list(decimal_points.all()),
+        lambda: list(integer_points.all()),
+    )
+    old_json, new_json = compare(
+        "read + serialize (gps-route JSON)",
+        lambda: JSONRenderer().render(DecimalGPSRoutePointSerializer(decimal_points.all(), many=True).data),
+        lambda: JSONRenderer().render(GPSRoutePointSerializer(integer_points.all(), many=True).data),
+    )
+    compare(
+        "float rows (polyline/delta/simplify)",
+        lambda: list(decimal_points.all().values_list(
+            Cast('latitude', FloatField()), Cast('longitude', FloatField()), 'timestamp', Cast('speed', FloatField()),
+        )),
+        lambda: route_rows(trip),
+    )
+    compare(
+        "trail arrays (GPS distance)",
+        lambda: np.array(list(decimal_points.all().order_by('timestamp', 'id').values_list(
+            Cast('latitude', FloatField()), Cast('longitude', FloatField()), EpochSeconds('timestamp'),
+        )), dtype=np.float64),
+        lambda: load_trails(integer_points.all()),
+    )
+    print(f"\n   Same gps-route JSON apart from ids: {without_ids(old_json) == without_ids(new_json)}")
@@ -0,0 +1,103 @@
+import random
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from benchmarking import benchmark_database, create_drivers, median_ms, new_job, new_trip
+from django.conf import settings
+from django.utils import timezone
+from geopy.distance import geodesic
+from rest_framework.test import APIClient
+from trips.models import Job, Trip, LivePosition
+from trips.dispatch import SUGGESTION_LIMIT, Candidates, suggest_drivers
+
+DRIVERS = 500
+PENDING_JOBS = 1000
+TRIPS_PER_DRIVER = 20  # past trips, each leaving a last known position
+QUEUED_JOBS = 400
+PAIRWISE_SAMPLE = 20  # jobs scored with the pairwise loop, then scaled up
+RUNS = 10
+# Gauteng, roughly
+SOUTH, WEST, NORTH, EAST = -26.6, 27.6, -25.6, 28.6
+
+
+def random_position():
+    return random.uniform(SOUTH, NORTH), random.uniform(WEST, EAST)
+
+
+def seed():
+    drivers, vehicles = create_drivers(DRIVERS, 'dispatch')
+    now = timezone.now()
+
+    def job(number, status, driver=None, vehicle=None):
+        lat, lng = random_position()
+        return new_job(
+            number, driver, vehicle, status=status, scheduled_start=now,
+            job_location_lat=Decimal(f'{lat:.6f}'), job_location_lng=Decimal(f'{lng:.6f}'),
+            expected_duration=random.choice([30, 60, 90, 120]),
+        )
+
+    done = Job.objects.bulk_create([
+        job(f'DONE-{n}-{i}', 'completed', driver, vehicle)
+        for n in range(TRIPS_PER_DRIVER) for i, (driver, vehicle) in enumerate(zip(drivers, vehicles))
+    ], batch_size=2000)
+    Job.objects.bulk_create([
+        job(f'QUEUED-{i}', 'assigned', drivers[i % DRIVERS], vehicles[i % DRIVERS]) for i in range(QUEUED_JOBS)
+    ])
+    Job.objects.bulk_create([job(f'PENDING-{i}', 'pending') for i in range(PENDING_JOBS)])
+
+    trips = Trip.objects.bulk_create([
+        new_trip(done_job, trip_number=f'DISPATCH-{n:07d}', status='completed')
+        for n, done_job in enumerate(done)
+    ], batch_size=2000)
+    positions = []
+    for n, trip in enumerate(trips):
+        lat, lng = random_position()
+        positions.append(LivePosition(
+            trip=trip, driver_id=trip.driver_id, vehicle_id=trip.vehicle_id, latitude_e6=round(lat * 1e6),
+            longitude_e6=round(lng * 1e6), timestamp=now - timedelta(minutes=len(trips) - n), is_active=False, revision=n + 1,
+        ))
+    LivePosition.objects.bulk_create(positions, batch_size=2000)
+
+
+def pairwise(jobs):
+    # Every job against every driver with a geodesic call per pair
+    candidates = Candidates()
+    ranked = []
+    for job in jobs.filter(job_location_lat__isnull=False).order_by('scheduled_start', 'id'):
+        site = (float(job.job_location_lat), float(job.job_location_lng))
+        scores = []
+        for index, (lat, lng) in enumerate(zip(candidates.latitudes, candidates.longitudes)):
+            km = geodesic(site, (lat, lng)).km
+            scores.append((km * 60 / settings.DISPATCH_SPEED_KMH + candidates.queued_minutes[index], index))
+        ranked.append(sorted(scores)[:SUGGESTION_LIMIT])
+    return ranked
+
+
+def run_ms(function):
+    _, median = median_ms(function, RUNS)
+    return median
+
+
+with benchmark_database(f"DISPATCH SUGGESTIONS ({PENDING_JOBS} pending jobs x {DRIVERS} drivers)"):
+    random.seed(1)
+    seed()
+    pending = Job.objects.filter(status='pending')
+    client = APIClient()
+
+    sample = pending.order_by('scheduled_start', 'id')[:PAIRWISE_SAMPLE]
+    started = time.perf_counter()
+    pairwise(Job.objects.filter(id__in=list(sample.values_list('id', flat=True))))
+    pairwise_ms = (time.perf_counter() - started) * 1000 * PENDING_JOBS / PAIRWISE_SAMPLE
+
+    candidates_ms = run_ms(Candidates)
+    engine_ms = run_ms(lambda: suggest_drivers(pending))
+    api_ms = run_ms(lambda: client.get('/api/jobs/dispatch-suggestions/'))
+    jobs = client.get('/api/jobs/dispatch-suggestions/').json()['jobs']
+    assert len(jobs) == PENDING_JOBS and all(len(job['suggestions']) == SUGGESTION_LIMIT for job in jobs)
+
+    print(f"\nMedian of {RUNS} runs:")
+    print(f"   pairwise geodesic loop (scaled from {PAIRWISE_SAMPLE} jobs) {pairwise_ms:10.1f} ms")
+    print(f"   available drivers and workload              {candidates_ms:10.1f} ms")
+    print(f"   suggest_drivers                             {engine_ms:10.1f} ms  ({pairwise_ms / engine_ms:.0f}x)")
+    print(f"   GET /api/jobs/dispatch-suggestions/         {api_ms:10.1f} ms")
@@ -0,0 +1,88 @@
+import random
+import statistics
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from benchmarking import benchmark_database, create_drivers, new_job, new_trip
+from django.test import override_settings
+from django.utils import timezone
+from trips.models import Job, Trip, GPSRoutePoint, TripEvent
+from trips.geofences import detect_geofence_events, geofence_grid
+from trips.ingestion import ingest_fleet_points
+
+VEHICLES = 500
+ROUNDS = 40
+POINTS_PER_REPORT = 4  # each vehicle's points per fleet batch, 2000 in all
+LOOP_STEPS = 240  # 20 minutes of 5-second reports
+# Gauteng, roughly
+SOUTH, WEST, NORTH, EAST = -26.6, 27.6, -25.6, 28.6
+
+
+def create_fixtures():
+    drivers, vehicles = create_drivers(VEHICLES, 'fence')
+    sites = [(random.uniform(SOUTH, NORTH), random.uniform(WEST, EAST)) for _ in range(VEHICLES)]
+    jobs = Job.objects.bulk_create([
+        new_job(f'FENCE-JOB-{i}', driver, vehicle, status='in_progress',
+                job_location_lat=Decimal(f'{lat:.6f}'), job_location_lng=Decimal(f'{lng:.6f}'))
+        for i, (driver, vehicle, (lat, lng)) in enumerate(zip(drivers, vehicles, sites))
+    ])
+    Trip.objects.bulk_create([new_trip(job, trip_number=f'FENCE-{i:05d}') for i, job in enumerate(jobs)])
+    trip_ids = list(Trip.objects.order_by('id').values_list('id', flat=True))
+    return dict(zip(trip_ids, sites))
+
+
+def drive(sites, rounds):
+    # Fleet batches in which every vehicle loops out to 2 km from its job
+    # site and back every LOOP_STEPS reports, each starting at a different
+    # point of the loop, so arrivals and departures keep firing
+    started = timezone.now() - timedelta(days=1)
+    seq = 0
+    batches = []
+    for r in range(rounds):
+        points = []
+        for n, (trip_id, (lat, lng)) in enumerate(sites.items()):
+            for i in range(POINTS_PER_REPORT):
+                step = r * POINTS_PER_REPORT + i
+                phase = (step + n) % LOOP_STEPS
+                offset = 0.02 * abs(2 * phase - LOOP_STEPS) / LOOP_STEPS + random.uniform(-0.0002, 0.0002)
+                points.append({
+                    'trip': trip_id, 'latitude': round(lat + offset, 6), 'longitude': round(lng, 6),
+                    'timestamp': (started + timedelta(seconds=5 * step)).isoformat(), 'device_seq': seq,
+                })
+                seq += 1
+        batches.append(points)
+    return batches
+
+
+def run(batches):
+    # Each batch is stored without detection, then the stored points are
+    # run through it, as _bulk_insert would
+    ingest_ms, detect_ms = [], []
+    for batch in batches:
+        started = time.perf_counter()
+        ingest_fleet_points(batch)
+        ingest_ms.append((time.perf_counter() - started) * 1000)
+        points = list(GPSRoutePoint.objects.filter(
+            device_seq__gte=batch[0]['device_seq'], device_seq__lte=batch[-1]['device_seq'],
+        ))
+        started = time.perf_counter()
+        detect_geofence_events(points)
+        detect_ms.append((time.perf_counter() - started) * 1000)
+    return ingest_ms, detect_ms
+
+
+with benchmark_database(f"GEOFENCE EVENTS ({VEHICLES} started trips, {VEHICLES * POINTS_PER_REPORT} points per batch)"):
+    random.seed(1)
+    sites = create_fixtures()
+    batches = drive(sites, ROUNDS)
+
+    print(f"\nMedian over {ROUNDS} fleet batches:")
+    with override_settings(GEOFENCE_EVENTS=False):
+        ingest_ms, detect_ms = run(batches)
+    print(f"   ingestion without detection  {statistics.median(ingest_ms):8.2f} ms")
+    print(f"   geofence detection           {statistics.median(detect_ms):8.2f} ms  "
+          f"({statistics.median(detect_ms) / statistics.median(ingest_ms):.0%}, first batch {detect_ms[0]:.2f} ms)")
+    print(f"\n   Events recorded: {TripEvent.objects.filter(event_type='arrival').count()} arrivals, "
+          f"{TripEvent.objects.filter(event_type='departure').count()} departures")
+    print(f"   Grid cache: {geofence_grid.cache_info()}")
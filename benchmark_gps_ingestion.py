@@ -0,0 +1,84 @@
+import random
+import time
+from datetime import timedelta
+
+from benchmarking import TRACKER_TOKEN, benchmark_database, create_trip
+from django.utils import timezone
+from rest_framework.test import APIClient
+from trips.models import GPSRoutePoint
+
+BATCH_SIZES = [1000, 10000, 100000]
+SINGLE_INSERT_SAMPLE = 1000
+
+
+next_seq = 0
+
+
+def make_points(count, trip_id=None):
+    global next_seq
+    lat, lng = -26.2041, 28.0473
+    captured = timezone.now() - timedelta(seconds=count)
+    points = []
+    for i in range(count):
+        lat += random.uniform(-0.0005, 0.0005)
+        lng += random.uniform(-0.0005, 0.0005)
+        point = {
+            'latitude': round(lat, 6),
+            'longitude': round(lng, 6),
+            'speed': round(random.uniform(0, 120), 2),
+            'timestamp': (captured + timedelta(seconds=i)).isoformat(),
+            'device_seq': next_seq,
+        }
+        next_seq += 1
+        if trip_id is not None:
+            point['trip'] = trip_id
+        points.append(point)
+    return points
+
+
+def report(label, count, elapsed):
+    print(f"   {label:<34} {count:>7} points  {elapsed:8.3f} s  {count / elapsed:>12,.0f} points/s")
+
+
+with benchmark_database("GPS INGESTION THROUGHPUT BENCHMARK"):
+    trip = create_trip()
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f'Bearer {TRACKER_TOKEN}')
+
+    print("\n1. BASELINE (one INSERT per point):")
+    points = make_points(SINGLE_INSERT_SAMPLE)
+    started = time.perf_counter()
+    for point in points:
+        point.pop('device_seq')
+        GPSRoutePoint.objects.create(trip=trip, **point)
+    report("GPSRoutePoint.objects.create", SINGLE_INSERT_SAMPLE, time.perf_counter() - started)
+
+    print("\n2. POST /api/trips/<id>/gps-points/:")
+    for size in BATCH_SIZES:
+        payload = {'points': make_points(size)}
+        started = time.perf_counter()
+        response = client.post(f'/api/trips/{trip.id}/gps-points/', payload, format='json')
+        elapsed = time.perf_counter() - started
+        assert response.status_code == 201, response.content[:500]
+        report(f"batch of {size}", size, elapsed)
+
+    print("\n3. POST /api/trips/gps-points/ (fleet batch):")
+    for size in BATCH_SIZES:
+        payload = {'points': make_points(size, trip_id=trip.id)}
+        started = time.perf_counter()
+        response = client.post('/api/trips/gps-points/', payload, format='json')
+        elapsed = time.perf_counter() - started
+        assert response.status_code == 201, response.content[:500]
+        report(f"batch of {size}", size, elapsed)
+
+    print("\n4. RETRY OF AN ALREADY STORED BATCH (dedupe on device_seq):")
+    for size in BATCH_SIZES:
+        payload = {'points': make_points(size)}
+        client.post(f'/api/trips/{trip.id}/gps-points/', payload, format='json')
+        started = time.perf_counter()
+        response = client.post(f'/api/trips/{trip.id}/gps-points/', payload, format='json')
+        elapsed = time.perf_counter() - started
+        assert response.status_code == 201 and response.json()['created'] == 0, response.content[:500]
+        report(f"retry of {size}", size, elapsed)
+
+    print(f"\n   Total points stored: {GPSRoutePoint.objects.filter(trip=trip).count()}")
@@ -0,0 +1,113 @@
+import statistics
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from benchmarking import benchmark_database, create_drivers, median_ms, new_job, new_trip
+from django.db import connection
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+from trips.models import Job, Trip, GPSRoutePoint
+from trips.ingestion import ingest_fleet_points
+from trips.live import position_feed, poll_positions
+
+VEHICLES = 500
+HISTORY_POINTS = 720  # one hour of 5-second reports per vehicle
+ROUNDS = 3
+DISPATCHERS = 20
+
+
+def create_fixtures():
+    drivers, vehicles = create_drivers(VEHICLES, 'live')
+    now = timezone.now()
+    jobs = Job.objects.bulk_create([
+        new_job(f'LIVE-JOB-{i}', driver, vehicle, scheduled_start=now, status='in_progress')
+        for i, (driver, vehicle) in enumerate(zip(drivers, vehicles))
+    ])
+    Trip.objects.bulk_create([new_trip(job, trip_number=f'LIVE-{i:05d}') for i, job in enumerate(jobs)])
+    trip_ids = list(Trip.objects.order_by('id').values_list('id', flat=True))
+
+    started = now - timedelta(seconds=5 * HISTORY_POINTS)
+    points = [
+        GPSRoutePoint(trip_id=trip_id, latitude=Decimal('-26.2') + Decimal(i) / 100000,
+                      longitude=Decimal('28.0') + Decimal(n) / 1000, timestamp=started + timedelta(seconds=5 * i))
+        for n, trip_id in enumerate(trip_ids)
+        for i in range(HISTORY_POINTS)
+    ]
+    GPSRoutePoint.objects.bulk_create(points, batch_size=5000)
+    return trip_ids
+
+
+def latest_points_by_scan():
+    # Newest point of every active trip, found in GPSRoutePoint itself
+    newest = GPSRoutePoint.objects.filter(trip=OuterRef('trip')).order_by('-timestamp').values('id')[:1]
+    return list(
+        GPSRoutePoint.objects.filter(trip__status='started', id=Subquery(newest))
+        .values_list('trip_id', 'latitude_e6', 'longitude_e6', 'timestamp')
+    )
+
+
+def report(trip_id, index):
+    return [{'trip': trip_id, 'latitude': -26.1 + index / 100000, 'longitude': 28.1,
+             'timestamp': (timezone.now()).isoformat()}]
+
+
+# Dispatchers read while trackers write, which SQLite's in-memory test
+# database cannot do across threads; use a throwaway file instead.
+with benchmark_database(f"LIVE POSITIONS ({VEHICLES} vehicles, {VEHICLES * HISTORY_POINTS:,} stored GPS points)",
+                        file=True):
+    trip_ids = create_fixtures()
+
+    print("\n1. Ingestion, one report per vehicle as trackers send them:")
+    for round_number in range(ROUNDS):
+        timings = []
+        started = time.perf_counter()
+        for trip_id in trip_ids:
+            request_started = time.perf_counter()
+            ingest_fleet_points(report(trip_id, round_number))
+            timings.append((time.perf_counter() - request_started) * 1000)
+        elapsed = time.perf_counter() - started
+        print(f"   round {round_number + 1}: {elapsed:.2f} s for {VEHICLES} reports "
+              f"(median {statistics.median(timings):.2f} ms each; budget 5 s)")
+
+    print("\n2. Current position of every active trip:")
+    rows, scan_ms = median_ms(latest_points_by_scan, 5)
+    print(f"   newest point per trip from GPSRoutePoint: {scan_ms:7.1f} ms ({len(rows)} trips)")
+    feed, live_ms = median_ms(position_feed, 5)
+    print(f"   live position table snapshot:             {live_ms:7.1f} ms ({len(feed['positions'])} trips)")
+    revision = feed['revision']
+    delta, delta_ms = median_ms(lambda: position_feed(revision), 5)
+    print(f"   delta with nothing changed:               {delta_ms:7.1f} ms ({len(delta['positions'])} trips)")
+
+    print(f"\n3. Fan-out to {DISPATCHERS} long-polling dispatchers:")
+    latencies = []
+    lock = threading.Lock()
+    for round_number in range(ROUNDS):
+        revision = position_feed()['revision']
+        ready = threading.Barrier(DISPATCHERS + 1)
+        sent_at = {}
+
+        def dispatcher():
+            ready.wait()
+            feed = poll_positions(revision, 10)
+            received = time.perf_counter()
+            with lock:
+                latencies.append((received - sent_at['time']) * 1000 if feed['positions'] else None)
+            connection.close()
+
+        threads = [threading.Thread(target=dispatcher) for _ in range(DISPATCHERS)]
+        for thread in threads:
+            thread.start()
+        ready.wait()
+        time.sleep(0.5)  # let every dispatcher settle into waiting
+        sent_at['time'] = time.perf_counter()
+        ingest_fleet_points(report(trip_ids[round_number], ROUNDS + round_number))
+        for thread in threads:
+            thread.join()
+
+    delivered = [latency for latency in latencies if latency is not None]
+    print(f"   deliveries: {len(delivered)} of {len(latencies)}")
+    if delivered:
+        print(f"   latency from ingest to dispatcher: median {statistics.median(delivered):.0f} ms, "
+              f"max {max(delivered):.0f} ms")
@@ -0,0 +1,104 @@
+import argparse
+import random
+from datetime import timedelta
+
+from benchmarking import benchmark_database, create_drivers, median_ms, new_job, new_trip
+from django.apps import apps
+from django.db import connection
+from django.db.migrations.loader import MigrationLoader
+from django.utils import timezone
+from trips.geo import cell_of
+from trips.models import Job, Trip, TripEvent, GPSRoutePoint
+
+parser = argparse.ArgumentParser(description="Report query plans and latencies before/after the hot path indexes")
+parser.add_argument('--drivers', type=int, default=300)
+parser.add_argument('--trips', type=int, default=30000)
+parser.add_argument('--gps-points', type=int, default=500000)
+parser.add_argument('--route-points', type=int, default=36000, help="Points on the trip whose route is read")
+parser.add_argument('--repeat', type=int, default=20)
+args = parser.parse_args()
+
+INDEX_MIGRATION = '0004_hot_path_indexes'
+
+
+def seed():
+    now = timezone.now()
+    drivers, vehicles = create_drivers(args.drivers, 'driver')
+    jobs = Job.objects.bulk_create([
+        new_job(f'JOB{i}', drivers[i % args.drivers], vehicles[i % args.drivers], scheduled_start=now,
+                status=random.choice(['assigned', 'completed', 'completed', 'completed']))
+        for i in range(args.trips)
+    ], batch_size=2000)
+    trips = Trip.objects.bulk_create([
+        new_trip(job, trip_number=f'TRIP-{i + 1:07d}',
+                 status='started' if i >= args.trips - args.drivers else 'completed')
+        for i, job in enumerate(jobs)
+    ], batch_size=2000)
+    Trip.objects.update(start_time=now)
+
+    route_trip = trips[-1]
+    with connection.cursor() as cursor:
+        table = GPSRoutePoint._meta.db_table
+        sql = f'INSERT INTO {table} (trip_id, latitude_e6, longitude_e6, cell, timestamp, speed_e2) VALUES (%s, %s, %s, %s, %s, %s)'
+        started = now - timedelta(days=30)
+        cell = cell_of(-26204100, 28047300)
+        batch = []
+        for i in range(args.gps_points):
+            trip_id = route_trip.id if i < args.route_points else trips[i % len(trips)].id
+            batch.append((trip_id, -26204100, 28047300, cell, started + timedelta(seconds=i), 6000))
+            if len(batch) == 10000:
+                cursor.executemany(sql, batch)
+                batch = []
+        if batch:
+            cursor.executemany(sql, batch)
+    TripEvent.objects.bulk_create([
+        TripEvent(trip=trips[i % len(trips)], event_type='other', description='Event') for i in range(args.trips)
+    ], batch_size=2000)
+    print(f"   Seeded {args.drivers} drivers, {args.trips} trips/jobs, {args.gps_points} GPS points "
+          f"({args.route_points} on one trip)")
+    return drivers[len(drivers) // 2], route_trip
+
+
+def hot_path_indexes():
+    # The schema has moved on since these indexes were added, so rather than
+    # migrating back they are dropped and recreated on the current schema
+    migration = MigrationLoader(connection).get_migration('trips', INDEX_MIGRATION)
+    return [(apps.get_model('trips', operation.model_name), operation.index) for operation in migration.operations]
+
+
+def hot_queries(driver, trip):
+    return [
+        ("active trip (driver, status=started)",
+         lambda: Trip.objects.filter(driver=driver, status='started')),
+        ("recent completed trips for driver",
+         lambda: Trip.objects.filter(driver=driver, status='completed')[:5]),
+        ("assigned jobs (assigned_driver, status)",
+         lambda: Job.objects.filter(assigned_driver=driver, status='assigned')),
+        ("trip events ordered by timestamp",
+         lambda: trip.events.all()),
+        ("GPS route ordered by timestamp",
+         lambda: trip.gps_points.values_list('latitude_e6', 'longitude_e6', 'timestamp')),
+    ]
+
+
+def measure(label, driver, trip):
+    print(f"\n{label}:")
+    for name, query in hot_queries(driver, trip):
+        _, median = median_ms(lambda: list(query()), args.repeat)
+        plan = query().explain().replace('\n', '\n' + ' ' * 8)
+        print(f"   {name:<42} median {median:8.2f} ms")
+        print(f"        {plan}")
+
+
+with benchmark_database("HOT QUERY PLANS AND LATENCIES"):
+    print("\n1. SEEDING:")
+    driver, trip = seed()
+    indexes = hot_path_indexes()
+    with connection.schema_editor() as editor:
+        for model, index in indexes:
+            editor.remove_index(model, index)
+    measure(f"2. BEFORE ({INDEX_MIGRATION})", driver, trip)
+    with connection.schema_editor() as editor:
+        for model, index in indexes:
+            editor.add_index(model, index)
+    measure(f"3. AFTER ({INDEX_MIGRATION})", driver, trip)
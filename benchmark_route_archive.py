@@ -0,0 +1,96 @@
+import random
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from benchmarking import benchmark_database, create_drivers, median_ms, new_job, new_trip
+from django.db import connection
+from django.test import Client
+from django.utils import timezone
+from trips.models import GPSRoutePoint, ArchivedRoute
+from trips.route_archive import archive_route
+from trips.routes import route_rows
+
+TRIPS = 20
+POINTS_PER_TRIP = 7200  # ten hours at one fix every five seconds
+RUNS = 5
+
+
+def create_trips():
+    (driver,), (vehicle,) = create_drivers(1)
+    trips = []
+    for n in range(TRIPS):
+        job = new_job(f'BENCH-JOB-{n}', driver, vehicle, status='completed')
+        job.save()
+        trip = new_trip(job, status='completed')
+        trip.save()
+        lat, lng = -26.2041, 28.0473
+        captured = timezone.now() - timedelta(days=1)
+        points = []
+        for i in range(POINTS_PER_TRIP):
+            lat += random.uniform(-0.0003, 0.0003)
+            lng += random.uniform(-0.0003, 0.0003)
+            points.append(GPSRoutePoint(
+                trip=trip, latitude=Decimal(f'{lat:.6f}'), longitude=Decimal(f'{lng:.6f}'),
+                timestamp=captured + timedelta(seconds=5 * i), speed=Decimal(f'{random.uniform(0, 120):.2f}'),
+                device_seq=i,
+            ))
+        GPSRoutePoint.objects.bulk_create(points, batch_size=2000)
+        trips.append(trip)
+    return trips
+
+
+def stored_bytes():
+    # Whole database after a VACUUM on SQLite; both tables on PostgreSQL
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('VACUUM')
+            cursor.execute('PRAGMA page_count')
+            pages, = cursor.fetchone()
+            cursor.execute('PRAGMA page_size')
+            return pages * cursor.fetchone()[0]
+        cursor.execute('VACUUM FULL')
+        cursor.execute("SELECT pg_total_relation_size(%s) + pg_total_relation_size(%s)",
+                       [GPSRoutePoint._meta.db_table, ArchivedRoute._meta.db_table])
+        return cursor.fetchone()[0]
+
+
+def read_ms(function):
+    _, median = median_ms(function, RUNS)
+    return median
+
+
+def read_timings(trip):
+    client = Client()
+    return {
+        'route_rows()': read_ms(lambda: route_rows(trip)),
+        'GET gps-route (JSON)': read_ms(lambda: client.get(f'/api/trips/{trip.id}/gps-route/')),
+        'GET gps-route (delta)': read_ms(lambda: client.get(f'/api/trips/{trip.id}/gps-route/?format=delta')),
+    }
+
+
+# VACUUM needs a real file to measure
+with benchmark_database(f"ROUTE ARCHIVE ({TRIPS} completed trips x {POINTS_PER_TRIP:,} points)", file=True):
+    trips = create_trips()
+    baseline_bytes = stored_bytes()
+    rows_before = read_timings(trips[0])
+
+    started = time.perf_counter()
+    for trip in trips:
+        archive_route(trip.id)
+    archive_seconds = time.perf_counter() - started
+    archived_bytes = stored_bytes()
+    rows_after = read_timings(trips[0])
+    blob_bytes = sum(len(data) for data in ArchivedRoute.objects.values_list('data', flat=True))
+
+    total_points = TRIPS * POINTS_PER_TRIP
+    print(f"\n1. Storage ({total_points:,} points):")
+    print(f"   database with point rows:     {baseline_bytes / 1e6:8.2f} MB")
+    print(f"   database with archived blobs: {archived_bytes / 1e6:8.2f} MB")
+    print(f"   blob payload:                 {blob_bytes / 1e6:8.2f} MB ({blob_bytes / total_points:.2f} bytes/point)")
+    print(f"   archiving took {archive_seconds:.2f} s ({total_points / archive_seconds:,.0f} points/s)")
+
+    print(f"\n2. Whole-route reads of one trip ({POINTS_PER_TRIP:,} points), median of {RUNS}:")
+    for name in rows_before:
+        print(f"   {name:24s} rows {rows_before[name]:8.1f} ms   archived {rows_after[name]:8.1f} ms "
+              f"({rows_before[name] / rows_after[name]:.1f}x)")
@@ -0,0 +1,80 @@
+import math
+import random
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from benchmarking import benchmark_database, create_trip
+from django.utils import timezone
+from rest_framework.test import APIClient
+from trips.models import GPSRoutePoint
+from trips.simplify import simplify_route, tolerance_for_zoom
+
+POINT_COUNT = 50000
+ZOOM_LEVELS = [10, 12, 14, 15, 16]
+TARGET_VERTICES = 2000
+TARGET_MS = 50
+
+
+def make_route(count):
+    # 1 Hz trail of a vehicle driving ~15 m/s along gently curving roads,
+    # with occasional junction turns and ~2 m of GPS jitter.
+    lat, lng = -26.2041, 28.0473
+    heading = random.uniform(0, 2 * math.pi)
+    started = timezone.now() - timedelta(seconds=count)
+    points = []
+    for i in range(count):
+        if random.random() < 0.002:
+            heading += random.choice([-1, 1]) * math.pi / 2
+        heading += random.gauss(0, 0.01)
+        step = 15 + random.gauss(0, 1)
+        lat += step * math.cos(heading) / 111320
+        lng += step * math.sin(heading) / (111320 * math.cos(math.radians(lat)))
+        jitter_lat = random.gauss(0, 2) / 111320
+        jitter_lng = random.gauss(0, 2) / 111320
+        points.append(GPSRoutePoint(
+            latitude=Decimal(f'{lat + jitter_lat:.6f}'),
+            longitude=Decimal(f'{lng + jitter_lng:.6f}'),
+            timestamp=started + timedelta(seconds=i),
+            speed=Decimal(f'{step * 3.6:.2f}'),
+            device_seq=i,
+        ))
+    return points
+
+
+with benchmark_database("ROUTE SIMPLIFICATION BENCHMARK"):
+    trip = create_trip(status='completed')
+    points = make_route(POINT_COUNT)
+    for point in points:
+        point.trip = trip
+    GPSRoutePoint.objects.bulk_create(points, batch_size=2000)
+    latitudes = [float(p.latitude) for p in points]
+    longitudes = [float(p.longitude) for p in points]
+    mean_lat = sum(latitudes) / len(latitudes)
+
+    print(f"\n1. ALGORITHM ONLY ({POINT_COUNT} points, vectorized Douglas-Peucker):")
+    for zoom in ZOOM_LEVELS:
+        tolerance = tolerance_for_zoom(zoom, mean_lat)
+        started = time.perf_counter()
+        kept = simplify_route(latitudes, longitudes, tolerance)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        ok = "✓" if len(kept) < TARGET_VERTICES and elapsed_ms < TARGET_MS else " "
+        print(f"   {ok} zoom {zoom:>2} (tolerance {tolerance:6.1f} m): {len(kept):>6} vertices in {elapsed_ms:6.1f} ms")
+
+    print("\n2. GET /api/trips/<id>/gps-route/?format=polyline&zoom=<z>:")
+    client = APIClient()
+    for zoom in ZOOM_LEVELS:
+        url = f'/api/trips/{trip.id}/gps-route/?format=polyline&zoom={zoom}'
+        started = time.perf_counter()
+        response = client.get(url)
+        cold_ms = (time.perf_counter() - started) * 1000
+        started = time.perf_counter()
+        client.get(url)
+        cached_ms = (time.perf_counter() - started) * 1000
+        assert response.status_code == 200, response.content[:500]
+        print(f"   zoom {zoom:>2}: {len(response.content):>8} bytes  cold {cold_ms:7.1f} ms  cached {cached_ms:6.1f} ms")
+
+    started = time.perf_counter()
+    response = client.get(f'/api/trips/{trip.id}/gps-route/')
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    print(f"\n   Full-resolution JSON: {len(response.content)} bytes in {elapsed_ms:.1f} ms")
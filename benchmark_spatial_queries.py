@@ -0,0 +1,104 @@
+import random
+from datetime import timedelta
+from decimal import Decimal
+
+from benchmarking import benchmark_database, create_drivers, median_ms, new_job, new_trip
+from django.utils import timezone
+from trips.models import Job, Trip, GPSRoutePoint, LivePosition
+from trips.live import nearest_positions
+from trips.spatial import Area, filter_area, filter_box, trips_in
+
+VEHICLES = 500
+JOBS = 20000
+POINTS_PER_TRIP = 1000
+RUNS = 20
+# Gauteng, roughly
+SOUTH, WEST, NORTH, EAST = -26.6, 27.6, -25.6, 28.6
+DEPOT = (-26.2041, 28.0473)
+
+
+def random_position():
+    return random.uniform(SOUTH, NORTH), random.uniform(WEST, EAST)
+
+
+def seed():
+    drivers, vehicles = create_drivers(VEHICLES, 'driver')
+    jobs = []
+    for i in range(JOBS):
+        lat, lng = random_position()
+        jobs.append(new_job(
+            f'JOB{i}', drivers[i % VEHICLES], vehicles[i % VEHICLES],
+            job_location_lat=Decimal(f'{lat:.6f}'), job_location_lng=Decimal(f'{lng:.6f}'),
+        ))
+    jobs = Job.objects.bulk_create(jobs, batch_size=2000)
+    trips = Trip.objects.bulk_create([new_trip(jobs[i], trip_number=f'TRIP-{i + 1:07d}') for i in range(VEHICLES)])
+
+    started = timezone.now() - timedelta(hours=3)
+    positions = []
+    for trip in trips:
+        lat, lng = random_position()
+        points = []
+        for i in range(POINTS_PER_TRIP):
+            lat += random.uniform(-0.0005, 0.0005)
+            lng += random.uniform(-0.0005, 0.0005)
+            points.append(GPSRoutePoint(
+                trip=trip, latitude=Decimal(f'{lat:.6f}'), longitude=Decimal(f'{lng:.6f}'),
+                timestamp=started + timedelta(seconds=10 * i),
+            ))
+        GPSRoutePoint.objects.bulk_create(points, batch_size=2000)
+        last = points[-1]
+        positions.append(LivePosition(
+            trip=trip, driver_id=trip.driver_id, vehicle_id=trip.vehicle_id, latitude_e6=last.latitude_e6,
+            longitude_e6=last.longitude_e6, timestamp=last.timestamp, revision=1,
+        ))
+    LivePosition.objects.bulk_create(positions)
+
+
+def box_scan(queryset, area, latitude, longitude, scale=1):
+    # The same box without the cell ranges, so no index can help
+    south, west, north, east = area.bounds_e6()
+    if scale == 1:
+        south, west, north, east = (Decimal(value).scaleb(-6) for value in (south, west, north, east))
+    return queryset.filter(**{
+        f'{latitude}__gte': south, f'{latitude}__lte': north, f'{longitude}__gte': west, f'{longitude}__lte': east,
+    })
+
+
+def compare(name, scan, indexed):
+    scan_result, scan_ms = median_ms(scan, RUNS)
+    indexed_result, indexed_ms = median_ms(indexed, RUNS)
+    assert scan_result == indexed_result, name
+    print(f"   {name:36s} scan {scan_ms:8.2f} ms   cells {indexed_ms:8.2f} ms  ({scan_ms / indexed_ms:5.1f}x)")
+
+
+with benchmark_database(f"SPATIAL QUERIES ({VEHICLES} vehicles, {JOBS:,} jobs, {VEHICLES * POINTS_PER_TRIP:,} GPS points)"):
+    random.seed(1)
+    seed()
+    depot_box = Area.around(*DEPOT, 2)
+    print(f"\nMedian of {RUNS} runs, table scan vs cell index:")
+    compare(
+        "jobs in a 4 km box",
+        lambda: sorted(box_scan(Job.objects.order_by(), depot_box, 'job_location_lat', 'job_location_lng').values_list('id', flat=True)),
+        lambda: sorted(filter_box(Job.objects.order_by(), 'location_cell', depot_box).values_list('id', flat=True)),
+    )
+    compare(
+        "jobs within 2 km",
+        lambda: sorted(
+            job_id for job_id, lat, lng in box_scan(Job.objects.order_by(), depot_box, 'job_location_lat', 'job_location_lng')
+            .values_list('id', 'job_location_lat', 'job_location_lng')
+            if depot_box.contains(float(lat), float(lng))
+        ),
+        lambda: sorted(filter_area(Job.objects.order_by(), 'location_cell', depot_box).values_list('id', flat=True)),
+    )
+    compare(
+        "trips through a 4 km box",
+        lambda: sorted(set(box_scan(GPSRoutePoint.objects.order_by(), depot_box, 'latitude_e6', 'longitude_e6', scale=0)
+                           .values_list('trip_id', flat=True))),
+        lambda: sorted(trips_in(Area(depot_box.south, depot_box.west, depot_box.north, depot_box.east))
+                       .values_list('id', flat=True)),
+    )
+
+    print("\nNearest active vehicles:")
+    for limit in (1, 10, 50):
+        found, ms = median_ms(lambda: nearest_positions(*DEPOT, limit=limit), RUNS)
+        print(f"   {limit:3d} nearest: {ms:6.2f} ms (furthest {found[-1]['distance_km']:.2f} km)")
@@ -0,0 +1,64 @@
+import random
+import statistics
+from datetime import timedelta
+from decimal import Decimal
+
+from benchmarking import benchmark_database, create_trip, timed_ms
+from geopy.distance import geodesic
+from django.utils import timezone
+from trips.models import GPSRoutePoint
+from trips.trail import gps_trail_distance, load_trails, trail_lengths
+
+POINT_COUNT = 36000  # ten hours at one fix per second
+GLITCH_COUNT = 20
+RUNS = 10
+
+
+def create_points(trip):
+    lat, lng = -26.2041, 28.0473
+    captured = timezone.now() - timedelta(seconds=POINT_COUNT)
+    coordinates = []
+    for _ in range(POINT_COUNT):
+        lat += random.uniform(-0.0002, 0.0002)
+        lng += random.uniform(-0.0002, 0.0002)
+        coordinates.append((round(lat, 6), round(lng, 6)))
+    expected = sum(geodesic(a, b).km for a, b in zip(coordinates, coordinates[1:]))
+
+    # Single-fix jumps of tens of kilometres, as a receiver produces after losing lock
+    for index in random.sample(range(1, POINT_COUNT - 1), GLITCH_COUNT):
+        lat, lng = coordinates[index]
+        coordinates[index] = (round(lat + 0.3, 6), round(lng - 0.3, 6))
+
+    GPSRoutePoint.objects.bulk_create([
+        GPSRoutePoint(trip=trip, latitude=Decimal(str(lat)), longitude=Decimal(str(lng)),
+                      timestamp=captured + timedelta(seconds=i), speed=Decimal('40'))
+        for i, (lat, lng) in enumerate(coordinates)
+    ], batch_size=2000)
+    return expected
+
+
+def best_of(function):
+    result, timings = timed_ms(function, RUNS)
+    return result, min(timings), statistics.median(timings)
+
+
+with benchmark_database(f"GPS TRAIL ANALYSIS ({POINT_COUNT:,} points, {GLITCH_COUNT} glitches)"):
+    trip = create_trip()
+    expected = create_points(trip)
+    trail = load_trails(trip.gps_points.all())
+
+    print("\n1. Loading the trail:")
+    _, best, median = best_of(lambda: load_trails(trip.gps_points.all()))
+    print(f"   best {best:.1f} ms, median {median:.1f} ms")
+
+    print("\n2. Measuring the loaded trail:")
+    (_, totals), best, median = best_of(lambda: trail_lengths(*trail))
+    print(f"   best {best:.2f} ms, median {median:.2f} ms")
+
+    print("\n3. gps_trail_distance() end to end (as run at trip completion):")
+    distance, best, median = best_of(lambda: gps_trail_distance(trip.gps_points.all()))
+    print(f"   best {best:.1f} ms, median {median:.1f} ms")
+
+    print(f"\n   trail distance:              {distance:.3f} km")
+    print(f"   geodesic sum without glitches: {expected:.3f} km")
+    print(f"   difference:                  {abs(distance - expected) / expected * 100:.3f}%")
@@ -0,0 +1,94 @@
+import random
+import statistics
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from benchmarking import benchmark_database, create_drivers, new_job, new_trip, timed_ms
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+from trips.models import Trip, GPSRoutePoint, DailyTripRollup
+from trips.rollups import record_completed_trip
+from trips.worker import run_pending
+
+POINTS_PER_TRIP = 36000
+TRIPS = 5
+
+
+def start_trip(driver, vehicle, index):
+    job = new_job(f'BENCH-JOB-{index}', driver, vehicle, status='in_progress',
+                  job_location_lat=Decimal('-26.1076'), job_location_lng=Decimal('28.0567'))
+    job.save()
+    trip = new_trip(job, start_location_lat=Decimal('-26.2041'), start_location_lng=Decimal('28.0473'))
+    trip.save()
+    lat, lng = -26.2041, 28.0473
+    captured = timezone.now() - timedelta(seconds=POINTS_PER_TRIP)
+    points = []
+    for i in range(POINTS_PER_TRIP):
+        lat += random.uniform(-0.0002, 0.0002)
+        lng += random.uniform(-0.0002, 0.0002)
+        points.append(GPSRoutePoint(trip=trip, latitude=Decimal(f"{lat:.6f}"), longitude=Decimal(f"{lng:.6f}"),
+                                    timestamp=captured + timedelta(seconds=i), speed=Decimal('40')))
+    GPSRoutePoint.objects.bulk_create(points, batch_size=2000)
+    return trip
+
+
+def end_inline(trip):
+    # What end_trip did before the task queue
+    trip.end_odometer = Decimal('1250')
+    trip.end_fuel_level = Decimal('30')
+    trip.end_location_lat = Decimal('-26.1500')
+    trip.end_location_lng = Decimal('28.1000')
+    trip.end_time = timezone.now()
+    trip.status = 'completed'
+    trip.save()
+    trip.calculate_metrics()
+    record_completed_trip(trip)
+    trip.job.status = 'completed'
+    trip.job.save()
+    trip.vehicle.current_odometer = trip.end_odometer
+    trip.vehicle.save()
+
+
+def end_through_view(client, trip):
+    response = client.post(reverse('end_trip', args=[trip.id]), {
+        'end_odometer': '1250', 'end_fuel_level': '30', 'end_lat': '-26.1500', 'end_lng': '28.1000',
+    })
+    assert response.status_code == 302, response.status_code
+
+
+def timed(function, trips):
+    # Times function(trip) once for each trip
+    pending = iter(trips)
+    _, timings = timed_ms(lambda: function(next(pending)), len(trips))
+    return f"median {statistics.median(timings):.1f} ms, max {max(timings):.1f} ms"
+
+
+with benchmark_database(f"TRIP COMPLETION LATENCY ({TRIPS} trips x {POINTS_PER_TRIP:,} GPS points)"):
+    # A driver has one started trip at a time, so every trip gets its own
+    drivers, vehicles = create_drivers(2 * TRIPS)
+
+    print("\n1. Metrics calculated inside the request (previous end_trip):")
+    trips = [start_trip(drivers[i], vehicles[i], i) for i in range(TRIPS)]
+    print(f"   {timed(end_inline, trips)}")
+
+    print("\n2. end_trip view with background finalization:")
+    trips = [start_trip(drivers[i], vehicles[i], i) for i in range(TRIPS, 2 * TRIPS)]
+    clients = {}
+    for trip in trips:
+        clients[trip.id] = Client()
+        clients[trip.id].force_login(trip.driver.user)
+        clients[trip.id].get(reverse('end_trip', args=[trip.id]))  # warm up URL resolution and the session
+    # The view is called through the test client, so this includes the session, form parsing and redirect
+    print(f"   request: {timed(lambda trip: end_through_view(clients[trip.id], trip), trips)}")
+    statuses = Trip.objects.filter(id__in=[trip.id for trip in trips]).values_list('metrics_status', flat=True)
+    print(f"   metrics status after the response: {sorted(set(statuses))}")
+
+    started = time.perf_counter()
+    ran = run_pending()
+    elapsed = (time.perf_counter() - started) * 1000
+    print(f"   worker: {ran} tasks in {elapsed:.0f} ms ({elapsed / max(ran, 1):.0f} ms per trip)")
+    statuses = Trip.objects.filter(id__in=[trip.id for trip in trips]).values_list('metrics_status', flat=True)
+    print(f"   metrics status after the worker: {sorted(set(statuses))}")
+    print(f"   trips in rollups: {sum(DailyTripRollup.objects.values_list('trip_count', flat=True))} of {2 * TRIPS}")
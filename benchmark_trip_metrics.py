@@ -0,0 +1,79 @@
+import random
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from benchmarking import benchmark_database, create_drivers, new_job, new_trip
+from django.utils import timezone
+from trips.models import Job, Trip
+from trips.metrics import recompute_trip_metrics
+
+TRIP_COUNT = 200000
+PER_TRIP_SAMPLE = 2000
+
+
+def coordinate(base, spread):
+    return Decimal(f"{base + random.uniform(-spread, spread):.6f}")
+
+
+def create_trips():
+    (driver,), (vehicle,) = create_drivers(1)
+    jobs = Job.objects.bulk_create([
+        new_job(f'BENCH-JOB-{i}', driver, vehicle,
+                job_location_lat=coordinate(-26.2, 0.3), job_location_lng=coordinate(28.0, 0.3))
+        for i in range(100)
+    ])
+
+    now = timezone.now()
+    trips = []
+    for i in range(TRIP_COUNT):
+        start_time = now - timedelta(minutes=random.randint(60, 60 * 24 * 365))
+        start_odometer = Decimal(random.randint(1000, 200000))
+        trips.append(new_trip(
+            random.choice(jobs), trip_number=f'BENCH-{i:07d}',
+            start_time=start_time, end_time=start_time + timedelta(seconds=random.randint(300, 20000)),
+            start_odometer=start_odometer, end_odometer=start_odometer + Decimal(f"{random.uniform(1, 150):.2f}"),
+            start_fuel_level=Decimal('60'), end_fuel_level=Decimal('50'), status='completed',
+            start_location_lat=coordinate(-26.2, 0.3), start_location_lng=coordinate(28.0, 0.3),
+            end_location_lat=coordinate(-26.2, 0.3), end_location_lng=coordinate(28.0, 0.3),
+        ))
+    Trip.objects.bulk_create(trips, batch_size=5000)
+
+
+def snapshot():
+    return {
+        row[0]: row[1:]
+        for row in Trip.objects.values_list('id', 'distance_travelled', 'duration_minutes', 'route_compliance', 'is_after_hours')
+    }
+
+
+with benchmark_database(f"TRIP METRIC RECOMPUTATION ({TRIP_COUNT:,} trips)"):
+    create_trips()
+
+    print(f"\n1. Trip.calculate_metrics() one at a time ({PER_TRIP_SAMPLE:,} trip sample):")
+    sample = list(Trip.objects.select_related('job').order_by('?')[:PER_TRIP_SAMPLE])
+    started = time.perf_counter()
+    for trip in sample:
+        trip.calculate_metrics()
+    elapsed = time.perf_counter() - started
+    per_trip_rate = PER_TRIP_SAMPLE / elapsed
+    print(f"   {per_trip_rate:,.0f} trips/s -> {2_000_000 / per_trip_rate / 60:,.1f} min for 2M trips")
+    expected = {trip.id: (trip.distance_travelled, trip.duration_minutes, trip.route_compliance, trip.is_after_hours)
+                for trip in Trip.objects.filter(id__in=[trip.id for trip in sample])}
+
+    print("\n2. recompute_trip_metrics() over every trip:")
+    Trip.objects.update(distance_travelled=None, duration_minutes=None, route_compliance=None, is_after_hours=False)
+    started = time.perf_counter()
+    updated = sum(count for _, count in recompute_trip_metrics())
+    elapsed = time.perf_counter() - started
+    batch_rate = TRIP_COUNT / elapsed
+    print(f"   {batch_rate:,.0f} trips/s ({updated:,} updated in {elapsed:.2f} s) -> "
+          f"{2_000_000 / batch_rate / 60:,.1f} min for 2M trips")
+
+    current = snapshot()
+    mismatches = [trip_id for trip_id, values in expected.items() if current[trip_id] != values]
+    print(f"   matches calculate_metrics(): {not mismatches} ({len(mismatches)} of {len(expected)} differ)")
+
+    started = time.perf_counter()
+    updated = sum(count for _, count in recompute_trip_metrics())
+    print(f"\n3. Re-running with nothing to change: {updated} updated in {time.perf_counter() - started:.2f} s")
@@ -0,0 +1,71 @@
+import threading
+import time
+
+from benchmarking import benchmark_database, create_drivers, new_job, new_trip
+from django.conf import settings
+from django.db import IntegrityError, OperationalError, connection
+from trips.models import Trip, trip_numbers
+
+THREADS = 16
+TRIPS_PER_THREAD = 100
+
+
+def legacy_trip_number():
+    last_trip = Trip.objects.order_by('-id').first()
+    if last_trip and last_trip.trip_number:
+        return f"TRIP-{int(last_trip.trip_number.split('-')[1]) + 1:05d}"
+    return "TRIP-00001"
+
+
+def start_trips(job, legacy):
+    created = collisions = 0
+    lock_retries = 0
+    started = time.perf_counter()
+
+    def worker():
+        nonlocal created, collisions, lock_retries
+        for _ in range(TRIPS_PER_THREAD):
+            while True:
+                # Completed, as a driver may only have one started trip
+                trip = new_trip(job, status='completed')
+                try:
+                    if legacy:
+                        trip.trip_number = legacy_trip_number()
+                    trip.save()
+                    created += 1
+                    break
+                except IntegrityError:
+                    collisions += 1
+                except OperationalError:
+                    lock_retries += 1
+        connection.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    numbers = list(Trip.objects.values_list('trip_number', flat=True))
+    print(f"   trips created:         {created}")
+    print(f"   duplicate-key retries: {collisions}")
+    print(f"   lock retries:          {lock_retries}")
+    print(f"   unique trip numbers:   {len(set(numbers)) == len(numbers)}")
+    print(f"   throughput:            {created / elapsed:,.0f} trips/s ({elapsed:.2f} s)")
+    Trip.objects.all().delete()
+
+
+# SQLite's in-memory test database cannot hold concurrent writers, so use a
+# throwaway file where lock waits behave like a real deployment.
+with benchmark_database(f"TRIP NUMBER ALLOCATION ({THREADS} threads x {TRIPS_PER_THREAD} trips)", file=True):
+    (driver,), (vehicle,) = create_drivers(1)
+    job = new_job('BENCH-JOB', driver, vehicle)
+    job.save()
+
+    print("\n1. LEGACY (read last trip number, then insert):")
+    start_trips(job, legacy=True)
+
+    print(f"\n2. SEQUENCE TABLE (block size {settings.TRIP_NUMBER_BLOCK_SIZE}):")
+    trip_numbers.reset()
+    start_trips(job, legacy=False)
@@ -0,0 +1,108 @@
+import os
+import statistics
+import tempfile
+import time
+import django
+from contextlib import contextmanager
+from decimal import Decimal
+
+# Setup, fixtures and timing shared by the benchmark_*.py scripts. Importing
+# this module sets Django up, so models can be imported straight after it.
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'fleet_management.settings')
+django.setup()
+
+from django.conf import settings
+from django.db import connection
+from django.contrib.auth.models import User
+from django.utils import timezone
+from trips.models import Driver, Vehicle, Job, Trip
+
+# Benchmarks post GPS points with this token, as a tracker would
+TRACKER_TOKEN = 'benchmark-tracker'
+settings.GPS_INGEST_TOKENS = [TRACKER_TOKEN]
+
+
+def banner(title):
+    print("=" * 70)
+    print(title)
+    print("=" * 70)
+
+
+@contextmanager
+def benchmark_database(title, file=False, **options):
+    # Runs the block against a throwaway test database between the title
+    # and the completion banner. `file` keeps SQLite's database in a file,
+    # which benchmarks need when several connections use it at once or
+    # when they measure its size.
+    banner(title)
+    if file and connection.vendor == 'sqlite':
+        connection.settings_dict['TEST']['NAME'] = os.path.join(tempfile.mkdtemp(), 'benchmark.sqlite3')
+    old_db_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, **options)
+    try:
+        yield
+    finally:
+        connection.close()
+        connection.creation.destroy_test_db(old_db_name, verbosity=0)
+    print()
+    banner("BENCHMARK COMPLETED")
+
+
+def timed_ms(function, runs):
+    # The last result of calling `function` `runs` times, and each call's
+    # duration in milliseconds
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = function()
+        timings.append((time.perf_counter() - started) * 1000)
+    return result, timings
+
+
+def median_ms(function, runs):
+    result, timings = timed_ms(function, runs)
+    return result, statistics.median(timings)
+
+
+def create_drivers(count, prefix='bench'):
+    # `count` drivers and as many vehicles, the nth vehicle for the nth driver
+    users = User.objects.bulk_create([
+        User(username=f'{prefix}{i}', first_name=prefix.title(), last_name=str(i)) for i in range(count)
+    ])
+    drivers = Driver.objects.bulk_create([
+        Driver(user=user, phone='000', license_number=f'{prefix.upper()}-{i}') for i, user in enumerate(users)
+    ])
+    vehicles = Vehicle.objects.bulk_create([
+        Vehicle(name=f'{prefix.title()} {i}', registration_number=f'{prefix.upper()}-{i}', vehicle_type='van',
+                fuel_capacity=Decimal('80'), current_odometer=Decimal('1000'))
+        for i in range(count)
+    ])
+    return drivers, vehicles
+
+
+def new_job(job_number, driver, vehicle, **fields):
+    # An unsaved job; fields the benchmark does not care about get defaults
+    return Job(**{
+        'job_number': job_number, 'customer_name': 'Bench', 'customer_phone': '000', 'job_location': 'Bench',
+        'description': 'Benchmark', 'expected_duration': 60, 'scheduled_start': timezone.now(),
+        'assigned_driver': driver, 'assigned_vehicle': vehicle, **fields,
+    })
+
+
+def new_trip(job, **fields):
+    # An unsaved trip for the job's driver and vehicle. bulk_create() skips
+    # Trip.save(), so pass a trip_number when bulk creating.
+    return Trip(**{
+        'job': job, 'driver': job.assigned_driver, 'vehicle': job.assigned_vehicle,
+        'start_odometer': Decimal('1000'), 'start_fuel_level': Decimal('50'), **fields,
+    })
+
+
+def create_trip(job_fields=None, **fields):
+    # A saved trip with a driver, vehicle and job of its own
+    (driver,), (vehicle,) = create_drivers(1)
+    job = new_job('BENCH-JOB', driver, vehicle, **(job_fields or {}))
+    job.save()
+    trip = new_trip(job, **fields)
+    trip.save()
+    return trip
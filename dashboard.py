@@ -11,51 +11,87 @@ st.set_page_config(page_title="Fleet Management Dashboard", layout="wide")
 
 API_BASE_URL = "http://0.0.0.0:5000/api"
 
+@st.cache_resource
+def validated_responses():
+    # (url, params) -> (ETag, data), kept across reruns so each poll can ask
+    # the API whether anything changed instead of downloading it again
+    return {}
+
+
 @st.cache_data(ttl=30)
-def fetch_data(endpoint):
+def fetch_data(endpoint, params=None):
+    url = f"{API_BASE_URL}/{endpoint}/"
+    key = (url, tuple(sorted((params or {}).items())))
+    stored = validated_responses().get(key)
+    headers = {'If-None-Match': stored[0]} if stored else {}
     try:
-        response = requests.get(f"{API_BASE_URL}/{endpoint}/", timeout=5)
+        response = requests.get(url, params=params, headers=headers, timeout=5)
+        if response.status_code == 304 and stored:
+            return stored[1]
         if response.status_code == 200:
-            return response.json()
+            data = response.json()
+            if 'ETag' in response.headers:
+                validated_responses()[key] = (response.headers['ETag'], data)
+            return data
         return []
     except:
         return []
 
+
+def decode_polyline(encoded, precision=5):
+    # The API's gps-route?format=polyline output (Google's encoded polyline
+    # algorithm), decoded here so the dashboard needs only the HTTP API
+    factor = 10 ** precision
+    coordinates = []
+    index = lat = lng = 0
+    while index < len(encoded):
+        deltas = []
+        for _ in range(2):
+            shift = result = 0
+            while True:
+                byte = ord(encoded[index]) - 63
+                index += 1
+                result |= (byte & 0x1f) << shift
+                shift += 5
+                if byte < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lng += deltas[1]
+        coordinates.append((lat / factor, lng / factor))
+    return coordinates
+
 st.title("Fleet Management Analytics Dashboard")
 
-tab1, tab2, tab3, tab4 = st.tabs(["Overview", "Trips", "Performance", "Map View"])
+tab1, tab2, tab3, tab4, tab5 = st.tabs(["Overview", "Trips", "Performance", "Map View", "Live Positions"])
+
+summary = fetch_data("analytics/summary") or {}
+recent_page = fetch_data("trips", {'page_size': 100})
+trips_data = recent_page.get('results', []) if isinstance(recent_page, dict) else []
 
 with tab1:
     st.header("Overview")
     
     col1, col2, col3, col4 = st.columns(4)
     
-    trips_data = fetch_data("trips")
-    jobs_data = fetch_data("jobs")
-    drivers_data = fetch_data("drivers")
-    vehicles_data = fetch_data("vehicles")
-    
     with col1:
-        st.metric("Total Trips", len(trips_data))
+        st.metric("Total Trips", summary.get('trip_count', 0))
     
     with col2:
-        active_trips = [t for t in trips_data if t['status'] == 'started']
-        st.metric("Active Trips", len(active_trips))
+        st.metric("Active Trips", summary.get('active_trips', 0))
     
     with col3:
-        pending_jobs = [j for j in jobs_data if j['status'] == 'pending']
-        st.metric("Pending Jobs", len(pending_jobs))
+        st.metric("Pending Jobs", summary.get('pending_jobs', 0))
     
     with col4:
-        active_drivers = [d for d in drivers_data if d['is_active']]
-        st.metric("Active Drivers", len(active_drivers))
+        st.metric("Active Drivers", summary.get('active_drivers', 0))
     
     if trips_data:
         df_trips = pd.DataFrame(trips_data)
         df_trips['start_time'] = pd.to_datetime(df_trips['start_time'])
         
         st.subheader("Recent Trips")
-        recent_trips = df_trips.sort_values('start_time', ascending=False).head(10)
+        recent_trips = df_trips.head(10)
         
         display_cols = ['trip_number', 'driver_name', 'vehicle_name', 'start_time', 
                         'distance_travelled', 'duration_minutes', 'status']
@@ -65,39 +101,33 @@ with tab1:
 with tab2:
     st.header("Trip Details")
     
-    if trips_data:
-        df_trips = pd.DataFrame(trips_data)
-        df_trips['start_time'] = pd.to_datetime(df_trips['start_time'])
-        
+    if summary.get('trip_count'):
         col1, col2 = st.columns(2)
         
         with col1:
-            completed_trips = df_trips[df_trips['status'] == 'completed']
-            if not completed_trips.empty and 'distance_travelled' in completed_trips.columns:
-                completed_trips['distance_travelled'] = pd.to_numeric(
-                    completed_trips['distance_travelled'], errors='coerce'
-                )
-                avg_distance = completed_trips['distance_travelled'].mean()
-                st.metric("Average Distance per Trip", f"{avg_distance:.1f} km" if pd.notna(avg_distance) else "N/A")
+            avg_distance = summary.get('average_distance')
+            st.metric("Average Distance per Trip", f"{avg_distance:.1f} km" if avg_distance is not None else "N/A")
         
         with col2:
-            if not completed_trips.empty and 'duration_minutes' in completed_trips.columns:
-                completed_trips['duration_minutes'] = pd.to_numeric(
-                    completed_trips['duration_minutes'], errors='coerce'
-                )
-                avg_duration = completed_trips['duration_minutes'].mean()
-                st.metric("Average Trip Duration", f"{avg_duration:.0f} min" if pd.notna(avg_duration) else "N/A")
+            avg_duration = summary.get('average_duration_minutes')
+            st.metric("Average Trip Duration", f"{avg_duration:.0f} min" if avg_duration is not None else "N/A")
         
-        st.subheader("Trips Over Time")
-        df_trips['date'] = df_trips['start_time'].dt.date
-        trips_by_date = df_trips.groupby('date').size().reset_index(name='count')
-        fig = px.line(trips_by_date, x='date', y='count', title='Daily Trip Count')
-        st.plotly_chart(fig, use_container_width=True)
+        daily_data = fetch_data("analytics/daily")
+        if daily_data:
+            st.subheader("Trips Over Time")
+            trips_by_date = pd.DataFrame(daily_data)
+            fig = px.line(trips_by_date, x='date', y='trip_count', title='Daily Trip Count')
+            st.plotly_chart(fig, use_container_width=True)
         
-        if 'distance_travelled' in df_trips.columns:
+        completed_page = fetch_data("trips", {'status': 'completed', 'page_size': 1000})
+        completed_trips = pd.DataFrame(completed_page.get('results', []) if isinstance(completed_page, dict) else [])
+        if not completed_trips.empty:
             st.subheader("Distance Distribution")
+            completed_trips['distance_travelled'] = pd.to_numeric(
+                completed_trips['distance_travelled'], errors='coerce'
+            )
             fig = px.histogram(completed_trips, x='distance_travelled', 
-                             title='Trip Distance Distribution', nbins=20)
+                             title='Trip Distance Distribution (last 1000 completed trips)', nbins=20)
             st.plotly_chart(fig, use_container_width=True)
     else:
         st.info("No trip data available yet.")
@@ -105,52 +135,39 @@ with tab2:
 with tab3:
     st.header("Driver Performance")
     
-    if trips_data:
-        df_trips = pd.DataFrame(trips_data)
+    driver_data = fetch_data("analytics/drivers")
+    if driver_data:
+        driver_stats = pd.DataFrame(driver_data)[
+            ['driver_name', 'trip_count', 'total_distance', 'total_duration_minutes', 'total_fuel_consumed']
+        ]
+        driver_stats.columns = ['Driver', 'Total Trips', 'Total Distance (km)', 
+                               'Total Duration (min)', 'Total Fuel (L)']
         
-        if 'driver_name' in df_trips.columns:
-            driver_stats = df_trips.groupby('driver_name').agg({
-                'trip_number': 'count',
-                'distance_travelled': lambda x: pd.to_numeric(x, errors='coerce').sum(),
-                'duration_minutes': lambda x: pd.to_numeric(x, errors='coerce').sum(),
-                'fuel_consumed': lambda x: pd.to_numeric(x, errors='coerce').sum()
-            }).reset_index()
-            
-            driver_stats.columns = ['Driver', 'Total Trips', 'Total Distance (km)', 
-                                   'Total Duration (min)', 'Total Fuel (L)']
-            
-            st.subheader("Driver Statistics")
-            st.dataframe(driver_stats, use_container_width=True)
-            
-            col1, col2 = st.columns(2)
-            
-            with col1:
-                fig = px.bar(driver_stats, x='Driver', y='Total Trips', 
-                           title='Trips per Driver')
-                st.plotly_chart(fig, use_container_width=True)
-            
-            with col2:
-                fig = px.bar(driver_stats, x='Driver', y='Total Distance (km)', 
-                           title='Distance per Driver')
-                st.plotly_chart(fig, use_container_width=True)
+        st.subheader("Driver Statistics")
+        st.dataframe(driver_stats, use_container_width=True)
+        
+        col1, col2 = st.columns(2)
         
-        completed = df_trips[df_trips['status'] == 'completed']
-        if not completed.empty:
+        with col1:
+            fig = px.bar(driver_stats, x='Driver', y='Total Trips', 
+                       title='Trips per Driver')
+            st.plotly_chart(fig, use_container_width=True)
+        
+        with col2:
+            fig = px.bar(driver_stats, x='Driver', y='Total Distance (km)', 
+                       title='Distance per Driver')
+            st.plotly_chart(fig, use_container_width=True)
+        
+        if summary.get('completed_trips'):
             st.subheader("Route Compliance")
-            if 'route_compliance' in completed.columns:
-                completed['route_compliance'] = pd.to_numeric(
-                    completed['route_compliance'], errors='coerce'
-                )
-                avg_compliance = completed['route_compliance'].mean()
-                st.metric("Average Route Compliance", 
-                         f"{avg_compliance:.1f}%" if pd.notna(avg_compliance) else "N/A")
+            avg_compliance = summary.get('average_route_compliance')
+            st.metric("Average Route Compliance", 
+                     f"{avg_compliance:.1f}%" if avg_compliance is not None else "N/A")
             
             st.subheader("After-Hours Usage")
-            if 'is_after_hours' in completed.columns:
-                after_hours_count = completed['is_after_hours'].sum()
-                total_count = len(completed)
-                st.metric("After-Hours Trips", 
-                         f"{after_hours_count} ({after_hours_count/total_count*100:.1f}%)" if total_count > 0 else "0")
+            after_hours_count = summary['after_hours_trips']
+            st.metric("After-Hours Trips", 
+                     f"{after_hours_count} ({summary['after_hours_ratio'] * 100:.1f}%)")
     else:
         st.info("No performance data available yet.")
 
@@ -209,10 +226,9 @@ with tab4:
                     ).add_to(m)
                 
                 try:
-                    gps_points = fetch_data(f"trips/{trip_id}/gps-route")
-                    if gps_points:
-                        coordinates = [[float(p['latitude']), float(p['longitude'])] 
-                                     for p in gps_points]
+                    route = fetch_data(f"trips/{trip_id}/gps-route", {'format': 'polyline', 'zoom': 14})
+                    if route and route.get('polyline'):
+                        coordinates = decode_polyline(route['polyline'])
                         folium.PolyLine(
                             coordinates,
                             color='red',
@@ -229,6 +245,34 @@ with tab4:
     else:
         st.info("No trips available to display on map.")
 
+with tab5:
+    st.header("Live Vehicle Positions")
+    
+    try:
+        live = requests.get(f"{API_BASE_URL}/live-positions/", timeout=5).json()
+        positions = live.get('positions', [])
+    except:
+        positions = []
+    
+    if positions:
+        vehicles = {v['id']: v['name'] for v in (fetch_data("vehicles") or {}).get('results', [])}
+        m = folium.Map(
+            location=[sum(p['latitude'] for p in positions) / len(positions),
+                      sum(p['longitude'] for p in positions) / len(positions)],
+            zoom_start=10
+        )
+        for position in positions:
+            folium.Marker(
+                [position['latitude'], position['longitude']],
+                popup=f"{vehicles.get(position['vehicle'], position['vehicle'])} - {position['speed'] or 0:.0f} km/h",
+                icon=folium.Icon(color='blue', icon='road')
+            ).add_to(m)
+        st.write(f"**{len(positions)}** vehicles on active trips")
+        st_folium(m, width=700, height=500)
+        st.caption("Dispatch screens can follow changes as they happen from /api/live-positions/stream/")
+    else:
+        st.info("No vehicles are on an active trip.")
+
 st.sidebar.header("About")
 st.sidebar.info(
     "This dashboard displays real-time fleet management data including "
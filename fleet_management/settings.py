@@ -89,6 +89,53 @@ LOGIN_URL = '/login/'
 LOGIN_REDIRECT_URL = '/'
 LOGOUT_REDIRECT_URL = '/login/'
 
+# Cache for API responses, driver dashboards and simplified routes. Local
+# memory by default; point CACHE_URL at file:///path/to/dir or
+# redis://host:6379/0 (needs the redis package) to share it between the web
+# processes and the background worker.
+CACHE_URL = os.environ.get('CACHE_URL', '')
+if CACHE_URL.startswith(('redis://', 'rediss://')):
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': CACHE_URL}}
+elif CACHE_URL.startswith('file://'):
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': CACHE_URL[len('file://'):]}}
+else:
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+# Trackers posting GPS points authenticate with `Authorization: Bearer
+# <token>`, using one of these comma-separated tokens; with none set the
+# GPS point endpoints refuse every request
+GPS_INGEST_TOKENS = [token.strip() for token in os.environ.get('GPS_INGEST_TOKENS', '').split(',') if token.strip()]
+
+# Trip numbers are reserved from the database this many at a time per process
+TRIP_NUMBER_BLOCK_SIZE = int(os.environ.get('TRIP_NUMBER_BLOCK_SIZE', 10))
+
+# Trips whose odometer distance is further than this from the GPS trail are flagged
+DISTANCE_DISCREPANCY_PERCENT = float(os.environ.get('DISTANCE_DISCREPANCY_PERCENT', 15))
+
+# GPS point storage, maintained by `manage.py manage_gps_storage`: points
+# older than GPS_DOWNSAMPLE_AFTER_DAYS are thinned to one per trip every
+# GPS_DOWNSAMPLE_SECONDS, and months older than GPS_RETENTION_MONTHS dropped
+GPS_DOWNSAMPLE_AFTER_DAYS = int(os.environ.get('GPS_DOWNSAMPLE_AFTER_DAYS', 30))
+GPS_DOWNSAMPLE_SECONDS = int(os.environ.get('GPS_DOWNSAMPLE_SECONDS', 60))
+GPS_RETENTION_MONTHS = int(os.environ.get('GPS_RETENTION_MONTHS', 12))
+GPS_PARTITIONS_AHEAD = int(os.environ.get('GPS_PARTITIONS_AHEAD', 2))
+
+# Pack a trip's GPS points into one compressed route blob once it has been
+# finalized; `manage.py archive_trip_routes` archives the trips completed
+# before this was turned on
+ARCHIVE_COMPLETED_ROUTES = os.environ.get('ARCHIVE_COMPLETED_ROUTES', '').lower() in ('1', 'true', 'yes')
+
+# Arrival and departure events are recorded as GPS points arrive: arrival
+# when a started trip comes within GEOFENCE_ENTER_METRES of its job location,
+# departure when it then goes beyond GEOFENCE_EXIT_METRES
+GEOFENCE_EVENTS = os.environ.get('GEOFENCE_EVENTS', '1').lower() in ('1', 'true', 'yes')
+GEOFENCE_ENTER_METRES = int(os.environ.get('GEOFENCE_ENTER_METRES', 100))
+GEOFENCE_EXIT_METRES = int(os.environ.get('GEOFENCE_EXIT_METRES', 200))
+
+# Average speed, as the crow flies, used to estimate how soon a driver could
+# reach a pending job when suggesting drivers for it
+DISPATCH_SPEED_KMH = float(os.environ.get('DISPATCH_SPEED_KMH', 40))
+
 REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 100,
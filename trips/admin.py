@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Driver, Vehicle, Job, Trip, TripEvent, GPSRoutePoint
+from .models import Driver, Vehicle, Job, Trip, TripEvent, GPSRoutePoint, GPSPartition, ArchivedRoute, DailyTripRollup, BackgroundTask
 
 @admin.register(Driver)
 class DriverAdmin(admin.ModelAdmin):
@@ -25,11 +25,11 @@ class JobAdmin(admin.ModelAdmin):
 
 @admin.register(Trip)
 class TripAdmin(admin.ModelAdmin):
-    list_display = ['trip_number', 'driver', 'vehicle', 'start_time', 'distance_travelled', 'status']
-    list_filter = ['status', 'start_time', 'is_after_hours']
+    list_display = ['trip_number', 'driver', 'vehicle', 'start_time', 'distance_travelled', 'status', 'metrics_status']
+    list_filter = ['status', 'metrics_status', 'start_time', 'is_after_hours']
     search_fields = ['trip_number', 'driver__user__first_name', 'driver__user__last_name']
     date_hierarchy = 'start_time'
-    readonly_fields = ['trip_number', 'distance_travelled', 'duration_minutes', 'route_compliance']
+    readonly_fields = ['trip_number', 'distance_travelled', 'gps_distance', 'duration_minutes', 'route_compliance']
 
 
 @admin.register(TripEvent)
@@ -42,7 +42,35 @@ class TripEventAdmin(admin.ModelAdmin):
 
 @admin.register(GPSRoutePoint)
 class GPSRoutePointAdmin(admin.ModelAdmin):
-    list_display = ['trip', 'latitude', 'longitude', 'timestamp', 'speed']
+    list_display = ['trip', 'latitude', 'longitude', 'timestamp', 'speed', 'device_seq']
     list_filter = ['timestamp']
     search_fields = ['trip__trip_number']
     date_hierarchy = 'timestamp'
+
+
+@admin.register(GPSPartition)
+class GPSPartitionAdmin(admin.ModelAdmin):
+    list_display = ['month', 'downsampled_through', 'dropped_at', 'dropped_points', 'archive']
+    readonly_fields = ['month', 'downsampled_through', 'dropped_at', 'dropped_points', 'archive']
+
+
+@admin.register(ArchivedRoute)
+class ArchivedRouteAdmin(admin.ModelAdmin):
+    list_display = ['trip', 'point_count', 'archived_at']
+    exclude = ['data']
+    readonly_fields = ['trip', 'point_count', 'archived_at']
+
+
+@admin.register(DailyTripRollup)
+class DailyTripRollupAdmin(admin.ModelAdmin):
+    list_display = ['date', 'driver', 'vehicle', 'trip_count', 'total_distance', 'total_fuel_consumed', 'after_hours_trips']
+    list_filter = ['date']
+    list_select_related = ['driver__user', 'vehicle']
+    date_hierarchy = 'date'
+
+
+@admin.register(BackgroundTask)
+class BackgroundTaskAdmin(admin.ModelAdmin):
+    list_display = ['id', 'name', 'status', 'attempts', 'run_after', 'locked_by', 'finished_at']
+    list_filter = ['status', 'name']
+    readonly_fields = ['created_at', 'finished_at', 'last_error']
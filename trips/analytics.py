@@ -0,0 +1,165 @@
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from .filters import trip_filter_lookups
+from .models import DailyTripRollup, Driver, Job, Trip
+from .rollups import UNROLLED_METRICS_STATUSES
+
+COMPLETED = Q(status='completed')
+# Trips the rollups do not count: open ones, and completed ones whose
+# metrics the worker has not finalized
+UNROLLED = ~COMPLETED | Q(metrics_status__in=UNROLLED_METRICS_STATUSES)
+ROLLUP_LOOKUPS = {'driver_id', 'vehicle_id', 'start_time__gte', 'start_time__lt'}
+
+GROUPINGS = {
+    'summary': [],
+    'drivers': ['driver__user__first_name', 'driver__user__last_name', 'driver_id'],
+    'vehicles': ['vehicle__name', 'vehicle_id', 'vehicle__registration_number'],
+    'daily': ['date'],
+}
+
+
+def _trip_metrics():
+    return {
+        'trip_count': Count('id'),
+        'completed_trips': Count('id', filter=COMPLETED),
+        'total_distance': Sum('distance_travelled', filter=COMPLETED),
+        'total_duration_minutes': Sum('duration_minutes', filter=COMPLETED),
+        'total_fuel_consumed': Sum(F('start_fuel_level') - F('end_fuel_level'), filter=COMPLETED),
+        'after_hours_trips': Count('id', filter=COMPLETED & Q(is_after_hours=True)),
+        'compliance_sum': Sum('route_compliance', filter=COMPLETED),
+        'compliance_count': Count('route_compliance', filter=COMPLETED),
+    }
+
+
+def _rollup_metrics():
+    return {
+        'completed_trips': Sum('trip_count'),
+        'total_distance': Sum('total_distance'),
+        'total_duration_minutes': Sum('total_duration_minutes'),
+        'total_fuel_consumed': Sum('total_fuel_consumed'),
+        'after_hours_trips': Sum('after_hours_trips'),
+        'compliance_sum': Sum('compliance_sum'),
+        'compliance_count': Sum('compliance_count'),
+    }
+
+
+def _number(value):
+    return None if value is None else round(float(value), 2)
+
+
+def _finish(row):
+    completed = row['completed_trips'] or 0
+    compliance_count = row.pop('compliance_count') or 0
+    compliance_sum = row.pop('compliance_sum')
+    row['completed_trips'] = completed
+    row['after_hours_trips'] = row['after_hours_trips'] or 0
+    row['total_duration_minutes'] = row['total_duration_minutes'] or 0
+    row['total_distance'] = _number(row['total_distance'])
+    row['total_fuel_consumed'] = _number(row['total_fuel_consumed'])
+    row['average_distance'] = _number(row['total_distance'] / completed) if completed and row['total_distance'] is not None else None
+    row['average_duration_minutes'] = _number(row['total_duration_minutes'] / completed) if completed else None
+    row['average_route_compliance'] = _number(compliance_sum / compliance_count) if compliance_count else None
+    row['after_hours_ratio'] = round(row['after_hours_trips'] / completed, 4) if completed else None
+    return row
+
+
+def _rollup_date_range(lookups):
+    # Rollups are per local day, so they can only answer time filters that
+    # fall exactly on local midnight.
+    dates = {}
+    for lookup, field in (('start_time__gte', 'date__gte'), ('start_time__lt', 'date__lt')):
+        if lookup in lookups:
+            moment = timezone.localtime(lookups[lookup])
+            if moment.time() != moment.time().min:
+                return None
+            dates[field] = moment.date()
+    return dates
+
+
+def _grouped(queryset, grouping, metrics):
+    if grouping:
+        return list(queryset.values(*grouping).annotate(**metrics).order_by(*grouping))
+    return [queryset.aggregate(**metrics)]
+
+
+def _from_rollups(lookups, grouping):
+    dates = _rollup_date_range(lookups)
+    if dates is None:
+        return None
+    rollups = DailyTripRollup.objects.filter(
+        **{key: value for key, value in lookups.items() if key in ('driver_id', 'vehicle_id')}, **dates
+    ).order_by()
+    rows = _grouped(rollups, grouping, _rollup_metrics())
+
+    # The rest are counted from the trips themselves; the partial index keeps
+    # this cheap because only a few are open or unfinalized at a time.
+    live_trips = Trip.objects.filter(UNROLLED, **lookups).order_by()
+    if 'date' in grouping:
+        live_trips = live_trips.annotate(date=TruncDate('start_time'))
+    by_key = {tuple(row[field] for field in grouping): row for row in rows}
+    for row in rows:
+        row['trip_count'] = row['completed_trips'] or 0
+    for live in _grouped(live_trips, grouping, _trip_metrics()):
+        key = tuple(live[field] for field in grouping)
+        if key not in by_key:
+            by_key[key] = dict(zip(grouping, key), trip_count=0, **{field: None for field in _rollup_metrics()})
+            rows.append(by_key[key])
+        row = by_key[key]
+        row['trip_count'] += live['trip_count']
+        for field in _rollup_metrics():
+            if live[field] is not None:
+                row[field] = live[field] if row[field] is None else row[field] + live[field]
+
+    if grouping:
+        rows = [row for row in rows if row['trip_count']]
+        rows.sort(key=lambda row: tuple(row[field] for field in grouping))
+    return rows
+
+
+def _from_trips(lookups, grouping):
+    trips = Trip.objects.filter(**lookups).order_by()
+    if 'date' in grouping:
+        trips = trips.annotate(date=TruncDate('start_time'))
+    return _grouped(trips, grouping, _trip_metrics())
+
+
+def _rows(lookups, grouping):
+    rows = None
+    if set(lookups) <= ROLLUP_LOOKUPS:
+        rows = _from_rollups(lookups, grouping)
+    if rows is None:
+        rows = _from_trips(lookups, grouping)
+    return [_finish(row) for row in rows]
+
+
+def fleet_summary(params):
+    lookups = trip_filter_lookups(params)
+    summary = _rows(lookups, GROUPINGS['summary'])[0]
+    summary['active_trips'] = Trip.objects.filter(**lookups).filter(status='started').count()
+    summary['pending_jobs'] = Job.objects.filter(status='pending').count()
+    summary['active_drivers'] = Driver.objects.filter(is_active=True).count()
+    return summary
+
+
+def driver_rollup(params):
+    results = []
+    for row in _rows(trip_filter_lookups(params), GROUPINGS['drivers']):
+        first_name = row.pop('driver__user__first_name')
+        last_name = row.pop('driver__user__last_name')
+        row['driver_name'] = f"{first_name} {last_name}".strip()
+        results.append(row)
+    return results
+
+
+def vehicle_rollup(params):
+    results = []
+    for row in _rows(trip_filter_lookups(params), GROUPINGS['vehicles']):
+        row['vehicle_name'] = row.pop('vehicle__name')
+        row['registration_number'] = row.pop('vehicle__registration_number')
+        results.append(row)
+    return results
+
+
+def daily_rollup(params):
+    return _rows(trip_filter_lookups(params), GROUPINGS['daily'])
@@ -0,0 +1,75 @@
+import hashlib
+import json
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+API_CACHE_TIMEOUT = 60 * 5
+
+
+def _version_key(model):
+    return f'api_cache_version:{model._meta.label_lower}'
+
+
+def invalidate_api_cache(*models):
+    # Bumping a model's version retires every cached response built from it;
+    # the old entries are never read again and simply expire.
+    def bump():
+        for model in models:
+            key = _version_key(model)
+            try:
+                cache.incr(key)
+            except ValueError:
+                cache.set(key, 1, None)
+    transaction.on_commit(bump)
+
+
+class CachedResponseMixin:
+    # Models whose changes invalidate the cached list and detail responses
+    cache_models = ()
+    cache_timeout = API_CACHE_TIMEOUT
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+    def _cache_key(self, request):
+        # The versions are read before the database so a response built from
+        # data that changes meanwhile is stored under the old version.
+        version_keys = [_version_key(model) for model in self.cache_models]
+        versions = cache.get_many(version_keys)
+        url = request.build_absolute_uri()
+        fingerprint = hashlib.md5(
+            f"{url}|{','.join(str(versions.get(key, 0)) for key in version_keys)}".encode()
+        ).hexdigest()
+        return f'api_response:{self.basename}:{self.action}:{fingerprint}'
+
+    def cached_response(self, view, request, *args, **kwargs):
+        key = self._cache_key(request)
+        entry = cache.get(key)
+        if entry is None:
+            response = view(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            body = json.dumps(response.data, cls=JSONEncoder, sort_keys=True)
+            entry = (response.data, hashlib.md5(body.encode()).hexdigest())
+            cache.set(key, entry, self.cache_timeout)
+
+        data, digest = entry
+        etag = f'"{digest}-{request.accepted_renderer.format}"'
+        if_none_match = parse_etags(request.headers.get('If-None-Match', ''))
+        if etag in if_none_match or '*' in if_none_match:
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(data)
+        response['ETag'] = etag
+        # Clients may keep the response but must revalidate it every time
+        patch_cache_control(response, no_cache=True)
+        patch_vary_headers(response, ['Accept'])
+        return response
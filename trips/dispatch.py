@@ -0,0 +1,135 @@
+import numpy as np
+from django.conf import settings
+from django.db.models import Count, OuterRef, Subquery, Sum
+from .encoding import MICRODEGREES
+from .geo import haversine_km
+from .models import Driver, Job, LivePosition, Trip
+from .spatial import Area, filter_box, microdegrees
+
+# Jobs in these states count towards their driver's workload
+WORKLOAD_STATUSES = ['assigned', 'in_progress']
+SUGGESTION_LIMIT = 3
+MAX_SUGGESTION_LIMIT = 20
+# Drivers further than this from a job are not suggested for it
+DISPATCH_MAX_KM = 500
+# Jobs are scored this many at a time, which bounds the distance matrix
+JOB_CHUNK_SIZE = 2000
+
+
+class Candidates:
+    # The drivers who can be suggested, as parallel arrays: each active
+    # driver with a last known position, paired with the vehicle they last
+    # reported from unless another driver has since started a trip with it.
+    # Given an area, only drivers last seen inside it are loaded.
+    def __init__(self, area=None):
+        latest = LivePosition.objects.filter(driver=OuterRef('pk')).order_by('-timestamp', '-trip_id').values('trip_id')[:1]
+        positions = LivePosition.objects.filter(
+            trip_id__in=Driver.objects.filter(is_active=True).annotate(latest=Subquery(latest)).values('latest'),
+        )
+        if area is not None:
+            positions = filter_box(positions, 'cell', area)
+        rows = positions.values_list(
+            'driver_id', 'driver__user__first_name', 'driver__user__last_name',
+            'vehicle_id', 'vehicle__registration_number', 'latitude_e6', 'longitude_e6',
+        )
+        in_use = dict(Trip.objects.filter(status='started').values_list('vehicle_id', 'driver_id'))
+        rows = [row for row in rows if in_use.get(row[3], row[0]) == row[0]]
+
+        workload = {
+            driver_id: (jobs, minutes) for driver_id, jobs, minutes in
+            Job.objects.filter(status__in=WORKLOAD_STATUSES, assigned_driver__isnull=False).order_by()
+            .values_list('assigned_driver').annotate(Count('id'), Sum('expected_duration'))
+        }
+        self.drivers = [
+            {'driver': row[0], 'driver_name': f'{row[1]} {row[2]}'.strip(), 'vehicle': row[3], 'vehicle_registration': row[4]}
+            for row in rows
+        ]
+        self.latitudes = np.array([row[5] for row in rows], dtype=np.float64) / MICRODEGREES
+        self.longitudes = np.array([row[6] for row in rows], dtype=np.float64) / MICRODEGREES
+        loads = [workload.get(row[0], (0, 0)) for row in rows]
+        self.queued_jobs = np.array([jobs for jobs, _ in loads], dtype=np.int64)
+        self.queued_minutes = np.array([minutes for _, minutes in loads], dtype=np.float64)
+
+    def __len__(self):
+        return len(self.drivers)
+
+
+def _job(job, suggestions):
+    return {
+        'job': job[0], 'job_number': job[1], 'scheduled_start': job[2], 'expected_duration': job[3],
+        'suggestions': suggestions,
+    }
+
+
+def _suggestions(candidates, order, distances, travel, start, expected_duration):
+    suggestions = []
+    for index in order:
+        if not np.isfinite(start[index]):
+            break
+        suggestions.append(dict(
+            candidates.drivers[index],
+            distance_km=round(float(distances[index]), 3),
+            travel_minutes=round(float(travel[index])),
+            queued_jobs=int(candidates.queued_jobs[index]),
+            queued_minutes=int(candidates.queued_minutes[index]),
+            estimated_start_minutes=round(float(start[index])),
+            estimated_finish_minutes=round(float(start[index])) + expected_duration,
+        ))
+    return suggestions
+
+
+def _reach(jobs):
+    # The box holding every point within DISPATCH_MAX_KM of a job. A circle's
+    # longitude span is widest at its most poleward latitude, so circles
+    # around the corners of the jobs' box cover those around the rest.
+    latitudes = [job[4] / MICRODEGREES for job in jobs]
+    longitudes = [job[5] / MICRODEGREES for job in jobs]
+    corners = [
+        Area.around(latitude, longitude, DISPATCH_MAX_KM)
+        for latitude in (min(latitudes), max(latitudes)) for longitude in (min(longitudes), max(longitudes))
+    ]
+    return Area(
+        min(corner.south for corner in corners), min(corner.west for corner in corners),
+        max(corner.north for corner in corners), max(corner.east for corner in corners),
+    )
+
+
+def suggest_drivers(jobs, limit=SUGGESTION_LIMIT):
+    # The best `limit` drivers for each job of `jobs` that has a location,
+    # soonest scheduled first. Drivers are ranked by how soon they could be
+    # on site: the minutes of work already assigned to them plus the drive
+    # from their last known position, at DISPATCH_SPEED_KMH in a straight
+    # line. Each job is ranked on its own, so one driver can top several.
+    jobs = list(
+        jobs.filter(job_location_lat__isnull=False, job_location_lng__isnull=False)
+        .order_by('scheduled_start', 'id')
+        .values_list(
+            'id', 'job_number', 'scheduled_start', 'expected_duration',
+            microdegrees('job_location_lat'), microdegrees('job_location_lng'),
+        )
+    )
+    if not jobs:
+        return []
+    candidates = Candidates(_reach(jobs))
+    if not candidates:
+        return [_job(job, []) for job in jobs]
+    limit = min(limit, len(candidates))
+
+    results = []
+    for offset in range(0, len(jobs), JOB_CHUNK_SIZE):
+        chunk = jobs[offset:offset + JOB_CHUNK_SIZE]
+        latitudes = np.array([job[4] for job in chunk], dtype=np.float64) / MICRODEGREES
+        longitudes = np.array([job[5] for job in chunk], dtype=np.float64) / MICRODEGREES
+        # One row per job, one column per driver
+        distances = haversine_km(latitudes[:, None], longitudes[:, None], candidates.latitudes, candidates.longitudes)
+        travel = distances * (60 / settings.DISPATCH_SPEED_KMH)
+        start = travel + candidates.queued_minutes
+        start[distances > DISPATCH_MAX_KM] = np.inf
+
+        best = np.argpartition(start, limit - 1, axis=1)[:, :limit]
+        best = np.take_along_axis(best, np.argsort(np.take_along_axis(start, best, axis=1), axis=1, kind='stable'), axis=1)
+        for row, job in enumerate(chunk):
+            suggestions = _suggestions(candidates, best[row].tolist(), distances[row], travel[row], start[row], job[3])
+            results.append(_job(job, suggestions))
+    return results
+
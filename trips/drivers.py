@@ -0,0 +1,66 @@
+from functools import wraps
+from django.contrib import messages
+from django.contrib.auth.decorators import login_required
+from django.core.cache import cache
+from django.db import transaction
+from django.shortcuts import redirect
+from .models import Driver, Job, Trip
+
+DRIVER_SESSION_KEY = '_driver_id'
+DASHBOARD_CACHE_TIMEOUT = 30
+RECENT_TRIPS = 5
+
+
+def current_driver_id(request):
+    # The driver behind a login never changes, so it is looked up once and
+    # kept in the session next to the authenticated user's id.
+    if not hasattr(request, '_driver_id'):
+        cached = request.session.get(DRIVER_SESSION_KEY)
+        if cached and cached[0] == request.user.pk:
+            driver_id = cached[1]
+        else:
+            driver_id = Driver.objects.filter(user_id=request.user.pk).order_by().values_list('id', flat=True).first()
+            if driver_id is not None:
+                request.session[DRIVER_SESSION_KEY] = [request.user.pk, driver_id]
+        request._driver_id = driver_id
+    return request._driver_id
+
+
+def driver_required(view):
+    # Passes the logged-in user's driver id to the view as its first argument
+    @login_required
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        driver_id = current_driver_id(request)
+        if driver_id is None:
+            messages.error(request, "You are not registered as a driver.")
+            return redirect('/admin/')
+        return view(request, driver_id, *args, **kwargs)
+    return wrapper
+
+
+def _dashboard_key(driver_id):
+    return f'driver_dashboard:{driver_id}'
+
+
+def dashboard_context(driver_id):
+    key = _dashboard_key(driver_id)
+    context = cache.get(key)
+    if context is None:
+        trips = Trip.objects.filter(driver_id=driver_id).select_related('job')
+        context = {
+            'assigned_jobs': list(
+                Job.objects.filter(assigned_driver_id=driver_id, status='assigned').select_related('assigned_vehicle')
+            ),
+            'active_trip': trips.filter(status='started').first(),
+            'completed_trips': list(trips.filter(status='completed')[:RECENT_TRIPS]),
+        }
+        cache.set(key, context, DASHBOARD_CACHE_TIMEOUT)
+    return context
+
+
+def invalidate_dashboard(*driver_ids):
+    # Deleted after commit so a concurrent request cannot cache the old state
+    keys = [_dashboard_key(driver_id) for driver_id in driver_ids if driver_id is not None]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
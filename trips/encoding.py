@@ -0,0 +1,175 @@
+import struct
+import sys
+import zlib
+import numpy as np
+from array import array
+from decimal import Decimal
+
+POLYLINE_PRECISION = 5
+
+ROUTE_DELTA_MAGIC = b'FRD1'
+ROUTE_DELTA_HEADER = struct.Struct('<4sIq')
+MICRODEGREES = 1000000
+MISSING_SPEED = -1
+
+ROUTE_ARCHIVE_MAGIC = b'FRA1'
+ROUTE_ARCHIVE_HEADER = struct.Struct('<4sI')
+# (dtype, stored as differences) for id, latitude and longitude in
+# microdegrees, timestamp in epoch microseconds, speed in hundredths and
+# device sequence, the last two -1 when unknown
+ROUTE_ARCHIVE_COLUMNS = [('<i8', True), ('<i4', True), ('<i4', True), ('<i8', True), ('<i4', False), ('<i8', False)]
+ROUTE_ARCHIVE_LEVEL = 6
+
+
+def to_fixed(value, places):
+    # The value as a whole number of 10**-places units: GPS coordinates are
+    # stored as microdegrees and speeds as hundredths of a km/h
+    number = value if isinstance(value, Decimal) else Decimal(str(value))
+    return int(number.scaleb(places).to_integral_value())
+
+
+def format_fixed(value, places):
+    # A fixed-point integer written out as a DecimalField with that many
+    # places is, e.g. -26200000 at 6 places is '-26.200000'
+    whole, fraction = divmod(abs(value), 10 ** places)
+    return f"{'-' if value < 0 else ''}{whole}.{fraction:0{places}d}"
+
+
+def _encode_value(value, chunks):
+    value = ~(value << 1) if value < 0 else value << 1
+    while value >= 0x20:
+        chunks.append(chr((0x20 | (value & 0x1f)) + 63))
+        value >>= 5
+    chunks.append(chr(value + 63))
+
+
+def encode_polyline(coordinates, precision=POLYLINE_PRECISION):
+    factor = 10 ** precision
+    chunks = []
+    prev_lat = prev_lng = 0
+    for lat, lng in coordinates:
+        lat = round(float(lat) * factor)
+        lng = round(float(lng) * factor)
+        _encode_value(lat - prev_lat, chunks)
+        _encode_value(lng - prev_lng, chunks)
+        prev_lat, prev_lng = lat, lng
+    return ''.join(chunks)
+
+
+def decode_polyline(encoded, precision=POLYLINE_PRECISION):
+    factor = 10 ** precision
+    coordinates = []
+    index = lat = lng = 0
+    length = len(encoded)
+    while index < length:
+        deltas = []
+        for _ in range(2):
+            shift = result = 0
+            while True:
+                byte = ord(encoded[index]) - 63
+                index += 1
+                result |= (byte & 0x1f) << shift
+                shift += 5
+                if byte < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lng += deltas[1]
+        coordinates.append((lat / factor, lng / factor))
+    return coordinates
+
+
+def encode_route_delta(rows):
+    # Layout (little-endian): magic, point count, first timestamp in epoch
+    # milliseconds, then four int32 columns of `count` values each:
+    # latitude and longitude deltas in microdegrees (first value absolute),
+    # timestamp deltas in milliseconds and speed in hundredths (-1 if unknown).
+    lats, lngs, times, speeds = array('i'), array('i'), array('i'), array('i')
+    prev_lat = prev_lng = prev_time = 0
+    first_time = None
+    for lat, lng, timestamp, speed in rows:
+        lat = round(float(lat) * MICRODEGREES)
+        lng = round(float(lng) * MICRODEGREES)
+        millis = round(timestamp.timestamp() * 1000)
+        if first_time is None:
+            first_time = prev_time = millis
+        lats.append(lat - prev_lat)
+        lngs.append(lng - prev_lng)
+        times.append(millis - prev_time)
+        speeds.append(MISSING_SPEED if speed is None else round(float(speed) * 100))
+        prev_lat, prev_lng, prev_time = lat, lng, millis
+
+    columns = [lats, lngs, times, speeds]
+    if sys.byteorder == 'big':
+        for column in columns:
+            column.byteswap()
+    header = ROUTE_DELTA_HEADER.pack(ROUTE_DELTA_MAGIC, len(lats), first_time or 0)
+    return header + b''.join(column.tobytes() for column in columns)
+
+
+def decode_route_delta(payload):
+    magic, count, first_time = ROUTE_DELTA_HEADER.unpack_from(payload)
+    if magic != ROUTE_DELTA_MAGIC:
+        raise ValueError("Not a route delta payload")
+
+    columns = []
+    offset = ROUTE_DELTA_HEADER.size
+    for _ in range(4):
+        column = array('i')
+        column.frombytes(payload[offset:offset + count * column.itemsize])
+        if sys.byteorder == 'big':
+            column.byteswap()
+        columns.append(column)
+        offset += count * column.itemsize
+
+    points = []
+    lat = lng = 0
+    millis = first_time
+    for lat_delta, lng_delta, time_delta, speed in zip(*columns):
+        lat += lat_delta
+        lng += lng_delta
+        millis += time_delta
+        points.append((
+            lat / MICRODEGREES,
+            lng / MICRODEGREES,
+            millis,
+            None if speed == MISSING_SPEED else speed / 100,
+        ))
+    return points
+
+
+def pack_route_archive(columns):
+    # Takes the six columns above as integer arrays, one value per point in
+    # time order. Consecutive points differ by little, so ids, coordinates
+    # and timestamps are stored as differences; each column's bytes are then
+    # grouped by significance, putting the mostly-zero high bytes together,
+    # and the whole is deflated.
+    count = len(columns[0])
+    planes = []
+    for values, (dtype, delta) in zip(columns, ROUTE_ARCHIVE_COLUMNS):
+        values = np.asarray(values, dtype=np.int64)
+        if delta:
+            values = np.diff(values, prepend=0)
+        itemsize = np.dtype(dtype).itemsize
+        planes.append(values.astype(dtype).view(np.uint8).reshape(count, itemsize).T.tobytes())
+    header = ROUTE_ARCHIVE_HEADER.pack(ROUTE_ARCHIVE_MAGIC, count)
+    return header + zlib.compress(b''.join(planes), ROUTE_ARCHIVE_LEVEL)
+
+
+def unpack_route_archive(payload):
+    # Returns the six columns as int64 arrays
+    magic, count = ROUTE_ARCHIVE_HEADER.unpack_from(payload)
+    if magic != ROUTE_ARCHIVE_MAGIC:
+        raise ValueError("Not a route archive")
+
+    data = zlib.decompress(bytes(payload[ROUTE_ARCHIVE_HEADER.size:]))
+    columns = []
+    offset = 0
+    for dtype, delta in ROUTE_ARCHIVE_COLUMNS:
+        itemsize = np.dtype(dtype).itemsize
+        size = itemsize * count
+        planes = np.frombuffer(data, dtype=np.uint8, count=size, offset=offset).reshape(itemsize, count)
+        values = np.ascontiguousarray(planes.T).view(dtype).ravel().astype(np.int64)
+        columns.append(np.cumsum(values) if delta else values)
+        offset += size
+    return columns
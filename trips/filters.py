@@ -0,0 +1,115 @@
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+from .models import Trip
+from .spatial import Area, filter_area, trips_in
+
+MAX_AREA_RADIUS_KM = 500
+
+
+def _numbers(value, count):
+    try:
+        numbers = [float(part) for part in value.split(',')]
+    except ValueError:
+        return None
+    if len(numbers) != count or not all(abs(number) < float('inf') for number in numbers):
+        return None
+    return numbers
+
+
+def area_filter(params, errors):
+    # `bbox=south,west,north,east` or `near=lat,lng&radius=km` as an Area,
+    # None when neither is given; problems are added to `errors`
+    bbox, near, radius = params.get('bbox'), params.get('near'), params.get('radius')
+    if bbox is not None and near is not None:
+        errors['bbox'] = ['Filter by either bbox or near, not both.']
+        return None
+
+    if bbox is not None:
+        numbers = _numbers(bbox, 4)
+        if numbers is None:
+            errors['bbox'] = ['Four comma-separated numbers are required: south,west,north,east.']
+            return None
+        south, west, north, east = numbers
+        if not -90 <= south <= north <= 90 or not -180 <= west <= east <= 180:
+            errors['bbox'] = ['South must not exceed north, west must not exceed east, and both must be valid coordinates.']
+            return None
+        return Area(south, west, north, east)
+
+    if near is not None:
+        numbers = _numbers(near, 2)
+        if numbers is None or not -90 <= numbers[0] <= 90 or not -180 <= numbers[1] <= 180:
+            errors['near'] = ['A latitude and longitude are required, e.g. near=-26.2041,28.0473.']
+            return None
+        radius_numbers = None if radius is None else _numbers(radius, 1)
+        if radius_numbers is None or not 0 < radius_numbers[0] <= MAX_AREA_RADIUS_KM:
+            errors['radius'] = [f'A distance in kilometres greater than 0 and at most {MAX_AREA_RADIUS_KM} is required.']
+            return None
+        return Area.around(numbers[0], numbers[1], radius_numbers[0])
+
+    if radius is not None:
+        errors['radius'] = ['Only allowed together with near.']
+    return None
+
+
+def trip_filter_lookups(params):
+    lookups = {}
+    errors = {}
+
+    status_filter = params.get('status')
+    if status_filter is not None:
+        if status_filter not in dict(Trip.STATUS_CHOICES):
+            errors['status'] = [f'Must be one of: {", ".join(dict(Trip.STATUS_CHOICES))}.']
+        lookups['status'] = status_filter
+
+    for field in ('driver', 'vehicle'):
+        value = params.get(field)
+        if value is not None:
+            if not value.isdigit():
+                errors[field] = ['A numeric id is required.']
+                continue
+            lookups[f'{field}_id'] = int(value)
+
+    for lookup in ('start_time__gte', 'start_time__lt'):
+        value = params.get(lookup)
+        if value is not None:
+            try:
+                moment = parse_datetime(value)
+            except ValueError:
+                # Well formed, but not a real date or time
+                moment = None
+            if moment is None:
+                errors[lookup] = ['An ISO 8601 datetime is required.']
+                continue
+            if timezone.is_naive(moment):
+                moment = timezone.make_aware(moment)
+            lookups[lookup] = moment
+
+    after_hours = params.get('is_after_hours')
+    if after_hours is not None:
+        if after_hours.lower() not in ('true', 'false', '1', '0'):
+            errors['is_after_hours'] = ['Must be true or false.']
+        lookups['is_after_hours'] = after_hours.lower() in ('true', '1')
+
+    area = area_filter(params, errors)
+
+    if errors:
+        raise ValidationError(errors)
+    if area is not None:
+        # Trips that passed through the area
+        lookups['id__in'] = trips_in(area, since=lookups.get('start_time__gte'))
+    return lookups
+
+
+def filter_trips(queryset, params):
+    return queryset.filter(**trip_filter_lookups(params))
+
+
+def filter_jobs(queryset, params):
+    errors = {}
+    area = area_filter(params, errors)
+    if errors:
+        raise ValidationError(errors)
+    if area is not None:
+        queryset = filter_area(queryset, 'location_cell', area)
+    return queryset
@@ -0,0 +1,128 @@
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+WGS84_B = (1 - WGS84_F) * WGS84_A
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = (np.radians(np.asarray(v, dtype=np.float64)) for v in (lat1, lng1, lat2, lng2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def vincenty_km(lat1, lng1, lat2, lng2, max_iterations=100, tolerance=1e-12):
+    # Vectorised Vincenty inverse formula on the WGS-84 ellipsoid; agrees with
+    # geopy's geodesic() to well under a millimetre. The rare nearly-antipodal
+    # pairs that do not converge fall back to haversine.
+    lat1, lng1, lat2, lng2 = (np.radians(np.asarray(v, dtype=np.float64)) for v in (lat1, lng1, lat2, lng2))
+    L = lng2 - lng1
+    U1 = np.arctan((1 - WGS84_F) * np.tan(lat1))
+    U2 = np.arctan((1 - WGS84_F) * np.tan(lat2))
+    sin_u1, cos_u1 = np.sin(U1), np.cos(U1)
+    sin_u2, cos_u2 = np.sin(U2), np.cos(U2)
+
+    lam = L.copy()
+    converged = np.zeros(lam.shape, dtype=bool)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for _ in range(max_iterations):
+            sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+            sin_sigma = np.hypot(cos_u2 * sin_lam, cos_u1 * sin_u2 - sin_u1 * cos_u2 * cos_lam)
+            cos_sigma = sin_u1 * sin_u2 + cos_u1 * cos_u2 * cos_lam
+            sigma = np.arctan2(sin_sigma, cos_sigma)
+            sin_alpha = np.where(sin_sigma == 0, 0.0, cos_u1 * cos_u2 * sin_lam / sin_sigma)
+            cos_sq_alpha = 1 - sin_alpha ** 2
+            cos_2sigma_m = np.where(cos_sq_alpha == 0, 0.0, cos_sigma - 2 * sin_u1 * sin_u2 / cos_sq_alpha)
+            C = WGS84_F / 16 * cos_sq_alpha * (4 + WGS84_F * (4 - 3 * cos_sq_alpha))
+            previous = lam
+            lam = L + (1 - C) * WGS84_F * sin_alpha * (
+                sigma + C * sin_sigma * (cos_2sigma_m + C * cos_sigma * (-1 + 2 * cos_2sigma_m ** 2))
+            )
+            converged = np.abs(lam - previous) < tolerance
+            if converged.all():
+                break
+
+    u_sq = cos_sq_alpha * (WGS84_A ** 2 - WGS84_B ** 2) / WGS84_B ** 2
+    A = 1 + u_sq / 16384 * (4096 + u_sq * (-768 + u_sq * (320 - 175 * u_sq)))
+    B = u_sq / 1024 * (256 + u_sq * (-128 + u_sq * (74 - 47 * u_sq)))
+    delta_sigma = B * sin_sigma * (cos_2sigma_m + B / 4 * (
+        cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)
+        - B / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sigma_m ** 2)
+    ))
+    distance = WGS84_B * A * (sigma - delta_sigma) / 1000
+
+    if not converged.all():
+        fallback = haversine_km(np.degrees(lat1), np.degrees(lng1), np.degrees(lat2), np.degrees(lng2))
+        distance = np.where(converged, distance, fallback)
+    return distance
+
+
+# Spatial cells: each axis is quantized to CELL_BITS bits and the two are
+# interleaved, longitude first, as in a geohash. A cell's code is then a
+# prefix of the codes of every cell inside it, so "inside this cell" is a
+# range query on one B-tree indexed integer column.
+CELL_BITS = 26
+MAX_COVER_CELLS = 16
+
+
+def _spread(value):
+    # Moves bit i of a CELL_BITS-bit value to bit 2i
+    value = (value | (value << 16)) & 0x0000FFFF0000FFFF
+    value = (value | (value << 8)) & 0x00FF00FF00FF00FF
+    value = (value | (value << 4)) & 0x0F0F0F0F0F0F0F0F
+    value = (value | (value << 2)) & 0x3333333333333333
+    return (value | (value << 1)) & 0x5555555555555555
+
+
+def interleave(x, y):
+    # The code of the cell in column x and row y; works on NumPy arrays too
+    return (_spread(x) << 1) | _spread(y)
+
+
+def _quantize(microdegrees, offset, span):
+    return min(max((microdegrees + offset) * (1 << CELL_BITS) // span, 0), (1 << CELL_BITS) - 1)
+
+
+def _cell_xy(latitude_e6, longitude_e6):
+    return _quantize(longitude_e6, 180000000, 360000000), _quantize(latitude_e6, 90000000, 180000000)
+
+
+def cell_of(latitude_e6, longitude_e6):
+    # The finest cell holding a point given in microdegrees; about 0.6 m of
+    # longitude by 0.3 m of latitude at the equator
+    return interleave(*_cell_xy(latitude_e6, longitude_e6))
+
+
+def cell_columns(latitudes_e6, longitudes_e6, level=CELL_BITS):
+    # Column and row of each point's cell at `level` bits per axis, for
+    # NumPy arrays of microdegrees
+    top = (1 << CELL_BITS) - 1
+    x = np.clip((longitudes_e6 + 180000000) * (1 << CELL_BITS) // 360000000, 0, top)
+    y = np.clip((latitudes_e6 + 90000000) * (1 << CELL_BITS) // 180000000, 0, top)
+    return x >> (CELL_BITS - level), y >> (CELL_BITS - level)
+
+
+def cell_ranges(south_e6, west_e6, north_e6, east_e6, max_cells=MAX_COVER_CELLS):
+    # Covers a bounding box in microdegrees with at most `max_cells` cells of
+    # the finest level that allows it, as merged [start, end) code ranges
+    x0, y0 = _cell_xy(south_e6, west_e6)
+    x1, y1 = _cell_xy(north_e6, east_e6)
+    for level in range(CELL_BITS, -1, -1):
+        shift = CELL_BITS - level
+        if ((x1 >> shift) - (x0 >> shift) + 1) * ((y1 >> shift) - (y0 >> shift) + 1) <= max_cells:
+            break
+    codes = sorted(
+        interleave(x, y)
+        for x in range(x0 >> shift, (x1 >> shift) + 1)
+        for y in range(y0 >> shift, (y1 >> shift) + 1)
+    )
+    ranges = []
+    for code in codes:
+        start, end = code << 2 * shift, (code + 1) << 2 * shift
+        if ranges and ranges[-1][1] == start:
+            ranges[-1][1] = end
+        else:
+            ranges.append([start, end])
+    return [tuple(cell_range) for cell_range in ranges]
@@ -0,0 +1,115 @@
+import numpy as np
+from decimal import Decimal
+from functools import lru_cache
+from django.conf import settings
+from django.db.models import OuterRef, Subquery
+from .encoding import MICRODEGREES
+from .geo import cell_columns, haversine_km, interleave
+from .models import Trip, TripEvent
+from .spatial import Area, microdegrees
+
+# Geofences are rasterized onto cells of this level, about 19 m tall and
+# 38 m wide at the equator, so a 200 m fence is a few hundred cells
+GRID_LEVEL = 20
+GRID_CACHE_SIZE = 4096
+EVENT_TYPES = ['arrival', 'departure']
+
+# Where a cell lies: within the entry radius, between the two radii, beyond
+# the exit radius, or across one of them, which needs the exact distance
+NEAR, BETWEEN, FAR, EDGE = range(4)
+
+
+@lru_cache(maxsize=GRID_CACHE_SIZE)
+def geofence_grid(latitude_e6, longitude_e6, enter_metres, exit_metres):
+    # {cell code: NEAR, BETWEEN or EDGE} for the cells around a job
+    # location; cells not listed are wholly beyond `exit_metres`
+    latitude, longitude = latitude_e6 / MICRODEGREES, longitude_e6 / MICRODEGREES
+    south, west, north, east = Area.around(latitude, longitude, exit_metres / 1000).bounds_e6()
+    (x0, x1), (y0, y1) = cell_columns(np.array([south, north]), np.array([west, east]), GRID_LEVEL)
+    xs, ys = (column.ravel() for column in np.meshgrid(np.arange(x0, x1 + 1), np.arange(y0, y1 + 1)))
+    width, height = 360 / (1 << GRID_LEVEL), 180 / (1 << GRID_LEVEL)
+    wests, souths = xs * width - 180, ys * height - 90
+
+    # Furthest corner and closest point of every cell, in metres
+    furthest = np.max([
+        haversine_km(latitude, longitude, souths + dy, wests + dx) for dx in (0, width) for dy in (0, height)
+    ], axis=0) * 1000
+    closest = haversine_km(
+        latitude, longitude, np.clip(latitude, souths, souths + height), np.clip(longitude, wests, wests + width),
+    ) * 1000
+
+    classes = np.full(len(xs), EDGE)
+    classes[furthest <= enter_metres] = NEAR
+    classes[(closest > enter_metres) & (furthest <= exit_metres)] = BETWEEN
+    listed = closest <= exit_metres
+    return dict(zip(interleave(xs[listed], ys[listed]).tolist(), classes[listed].tolist()))
+
+
+def _fences(trip_ids):
+    # {trip id: job location in microdegrees} for the started trips whose
+    # job has a location, and {trip id: (at the job site, time)} from the
+    # latest arrival or departure of those that have one, whether logged by
+    # the driver or detected here
+    latest = TripEvent.objects.filter(trip=OuterRef('pk'), event_type__in=EVENT_TYPES).order_by('-timestamp', '-id')
+    trips = Trip.objects.filter(
+        id__in=trip_ids, status='started', job__job_location_lat__isnull=False, job__job_location_lng__isnull=False,
+    ).annotate(
+        fence_lat=microdegrees('job__job_location_lat'), fence_lng=microdegrees('job__job_location_lng'),
+        last_type=Subquery(latest.values('event_type')[:1]), last_time=Subquery(latest.values('timestamp')[:1]),
+    ).values_list('id', 'fence_lat', 'fence_lng', 'last_type', 'last_time')
+    fences, last = {}, {}
+    for trip_id, lat, lng, last_type, last_time in trips:
+        fences[trip_id] = (lat, lng)
+        if last_type is not None:
+            last[trip_id] = (last_type == 'arrival', last_time)
+    return fences, last
+
+
+def _event(point, event_type, description):
+    return TripEvent(
+        trip_id=point.trip_id, event_type=event_type, timestamp=point.timestamp, description=description,
+        location_lat=Decimal(point.latitude_e6).scaleb(-6), location_lng=Decimal(point.longitude_e6).scaleb(-6),
+    )
+
+
+def detect_geofence_events(points):
+    # Records an arrival when a started trip's points first come within
+    # GEOFENCE_ENTER_METRES of its job location and a departure when they
+    # next go beyond GEOFENCE_EXIT_METRES; the gap between the two keeps GPS
+    # jitter at the edge from flapping. Points older than the trip's latest
+    # arrival or departure are ignored. Returns the events created.
+    fences, last = _fences({point.trip_id for point in points})
+    if not fences:
+        return []
+    points = sorted(
+        (point for point in points if point.trip_id in fences
+         and (point.trip_id not in last or point.timestamp > last[point.trip_id][1])),
+        key=lambda point: (point.trip_id, point.timestamp),
+    )
+    if not points:
+        return []
+
+    enter_metres, exit_metres = settings.GEOFENCE_ENTER_METRES, settings.GEOFENCE_EXIT_METRES
+    grids = {trip_id: geofence_grid(*fence, enter_metres, exit_metres) for trip_id, fence in fences.items()}
+    inside = {trip_id: last[trip_id][0] if trip_id in last else False for trip_id in fences}
+    latitudes = np.array([point.latitude_e6 for point in points], dtype=np.int64)
+    longitudes = np.array([point.longitude_e6 for point in points], dtype=np.int64)
+    codes = interleave(*cell_columns(latitudes, longitudes, GRID_LEVEL)).tolist()
+
+    events = []
+    for point, code in zip(points, codes):
+        place = grids[point.trip_id].get(code, FAR)
+        if place == EDGE:
+            latitude, longitude = fences[point.trip_id]
+            metres = float(haversine_km(
+                latitude / MICRODEGREES, longitude / MICRODEGREES,
+                point.latitude_e6 / MICRODEGREES, point.longitude_e6 / MICRODEGREES,
+            )) * 1000
+            place = NEAR if metres <= enter_metres else BETWEEN if metres <= exit_metres else FAR
+        if place == NEAR and not inside[point.trip_id]:
+            events.append(_event(point, 'arrival', 'Arrived at the job site (detected from GPS)'))
+            inside[point.trip_id] = True
+        elif place == FAR and inside[point.trip_id]:
+            events.append(_event(point, 'departure', 'Left the job site (detected from GPS)'))
+            inside[point.trip_id] = False
+    return TripEvent.objects.bulk_create(events)
@@ -0,0 +1,233 @@
+import csv
+import gzip
+import os
+import numpy as np
+from datetime import date, timedelta
+from django.db import connection, transaction
+from django.db.models import Min
+from django.utils import timezone
+from .encoding import format_fixed
+from .models import ArchivedRoute, GPSPartition, GPSRoutePoint
+from .rollups import local_midnight
+from .route_archive import unpacked_points
+from .routes import invalidate_route_cache
+from .trail import EpochSeconds
+
+TABLE = GPSRoutePoint._meta.db_table
+DEFAULT_PARTITION = f'{TABLE}_default'
+
+# Downsampling reads an hour of the whole fleet at a time, which keeps the
+# arrays small however many vehicles report.
+DOWNSAMPLE_WINDOW = timedelta(hours=1)
+DELETE_CHUNK_SIZE = 2000
+ARCHIVE_FIELDS = ['id', 'trip_id', 'latitude', 'longitude', 'timestamp', 'speed', 'device_seq']
+ARCHIVE_COLUMNS = ['id', 'trip_id', 'latitude_e6', 'longitude_e6', 'timestamp', 'speed_e2', 'device_seq']
+
+
+def native_partitioning():
+    # Migration 0011 turns the table into a partitioned one on PostgreSQL
+    return connection.vendor == 'postgresql'
+
+
+def month_of(day):
+    return day.replace(day=1)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def month_range(month):
+    return local_midnight(month), local_midnight(add_months(month, 1))
+
+
+def partition_name(month):
+    return f'{TABLE}_p{month:%Y_%m}'
+
+
+def _points_in(month):
+    start, end = month_range(month)
+    return GPSRoutePoint.objects.filter(timestamp__gte=start, timestamp__lt=end)
+
+
+def _archived_routes_in(month):
+    # Archived routes expire with the month their trip started in
+    start, end = month_range(month)
+    return ArchivedRoute.objects.filter(trip__start_time__gte=start, trip__start_time__lt=end)
+
+
+def _existing_partitions(cursor):
+    cursor.execute(
+        "SELECT child.relname FROM pg_inherits"
+        " JOIN pg_class child ON child.oid = pg_inherits.inhrelid"
+        " JOIN pg_class parent ON parent.oid = pg_inherits.inhparent"
+        " WHERE parent.relname = %s",
+        [TABLE],
+    )
+    return {name for name, in cursor.fetchall()}
+
+
+def _create_partition(cursor, month):
+    name = connection.ops.quote_name(partition_name(month))
+    table = connection.ops.quote_name(TABLE)
+    default = connection.ops.quote_name(DEFAULT_PARTITION)
+    start, end = month_range(month)
+    cursor.execute(f'SELECT EXISTS (SELECT 1 FROM {default} WHERE "timestamp" >= %s AND "timestamp" < %s)',
+                   [start, end])
+    misplaced, = cursor.fetchone()
+    # Points that arrived before their month's partition existed sit in the
+    # default partition, and PostgreSQL refuses a new partition overlapping
+    # them; take the default out while they are moved across.
+    if misplaced:
+        cursor.execute(f'ALTER TABLE {table} DETACH PARTITION {default}')
+    cursor.execute(f'CREATE TABLE {name} PARTITION OF {table} FOR VALUES FROM (%s) TO (%s)', [start, end])
+    if misplaced:
+        cursor.execute(
+            f'WITH moved AS (DELETE FROM {default} WHERE "timestamp" >= %s AND "timestamp" < %s RETURNING *)'
+            f' INSERT INTO {table} SELECT * FROM moved',
+            [start, end],
+        )
+        cursor.execute(f'ALTER TABLE {table} ATTACH PARTITION {default} DEFAULT')
+
+
+def prepare_months(ahead):
+    # Registers every month from the first stored point until `ahead` months
+    # from now and, on PostgreSQL, creates their partitions so inserts never
+    # land in the default partition. Returns the months that were added.
+    this_month = month_of(timezone.localdate())
+    first = GPSRoutePoint.objects.aggregate(first=Min('timestamp'))['first']
+    month = month_of(timezone.localdate(first)) if first else this_month
+    months = []
+    while month <= add_months(this_month, ahead):
+        months.append(month)
+        month = add_months(month, 1)
+
+    known = set(GPSPartition.objects.values_list('month', flat=True))
+    added = [month for month in months if month not in known]
+    with transaction.atomic():
+        GPSPartition.objects.bulk_create([GPSPartition(month=month) for month in added], ignore_conflicts=True)
+        if native_partitioning():
+            live_months = GPSPartition.objects.filter(dropped_at__isnull=True).values_list('month', flat=True)
+            with connection.cursor() as cursor:
+                existing = _existing_partitions(cursor)
+                for month in live_months:
+                    if partition_name(month) not in existing:
+                        _create_partition(cursor, month)
+    return added
+
+
+def _thin_out(start, end, resolution):
+    # Keeps the first point of every trip in each `resolution`-second bucket
+    # and the last point of every trip in the window, so a trail still starts
+    # and ends where it did. Returns the trip ids that lost points.
+    queryset = GPSRoutePoint.objects.filter(timestamp__gte=start, timestamp__lt=end).order_by(
+        'trip_id', 'timestamp', 'id'
+    ).values_list('id', 'trip_id', EpochSeconds('timestamp'))
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+    if not rows:
+        return set()
+
+    ids = np.array([row[0] for row in rows], dtype=np.int64)
+    trip_ids = np.array([row[1] for row in rows], dtype=np.int64)
+    # Rounded to the millisecond first: SQLite's julianday arithmetic can put
+    # a point on the minute a hair before it
+    seconds = np.round(np.array([row[2] for row in rows], dtype=np.float64), 3)
+    buckets = np.floor(seconds / resolution)
+    new_trip = trip_ids[1:] != trip_ids[:-1]
+    keep = np.ones(len(ids), dtype=bool)
+    keep[1:] = new_trip | (buckets[1:] != buckets[:-1])
+    keep[:-1] |= new_trip
+    keep[-1] = True
+
+    dropped = ids[~keep].tolist()
+    for offset in range(0, len(dropped), DELETE_CHUNK_SIZE):
+        GPSRoutePoint.objects.filter(id__in=dropped[offset:offset + DELETE_CHUNK_SIZE]).delete()
+    return set(trip_ids[~keep].tolist())
+
+
+def downsample(before, resolution):
+    # Thins out every point older than `before`, an hour at a time. Progress
+    # is saved per window, so an interrupted run resumes where it stopped and
+    # a finished window is never read again. Yields (month, points removed).
+    partitions = GPSPartition.objects.filter(dropped_at__isnull=True, month__lt=timezone.localdate(before))
+    for partition in partitions:
+        start, end = month_range(partition.month)
+        window_start = max(start, partition.downsampled_through or start)
+        end = min(end, before)
+        if window_start >= end:
+            continue
+        before_count = _points_in(partition.month).count()
+        while window_start < end:
+            window_end = min(window_start + DOWNSAMPLE_WINDOW, end)
+            with transaction.atomic():
+                trip_ids = _thin_out(window_start, window_end, resolution)
+                GPSPartition.objects.filter(month=partition.month).update(downsampled_through=window_end)
+            invalidate_route_cache(trip_ids)
+            window_start = window_end
+        yield partition.month, before_count - _points_in(partition.month).count()
+
+
+def _archive_row(point_id, trip_id, lat, lng, timestamp, speed, device_seq):
+    return [point_id, trip_id, format_fixed(lat, 6), format_fixed(lng, 6), timestamp.isoformat(),
+            None if speed is None else format_fixed(speed, 2), device_seq]
+
+
+def _archive(month, archive_dir):
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f'gps_points_{month:%Y_%m}.csv.gz')
+    with gzip.open(path, 'wt', newline='') as archive:
+        writer = csv.writer(archive)
+        writer.writerow(ARCHIVE_FIELDS)
+        for row in _points_in(month).order_by().values_list(*ARCHIVE_COLUMNS).iterator(chunk_size=DELETE_CHUNK_SIZE):
+            writer.writerow(_archive_row(*row))
+        for route in _archived_routes_in(month).iterator(chunk_size=100):
+            for point in unpacked_points(route):
+                writer.writerow(_archive_row(*(getattr(point, column) for column in ARCHIVE_COLUMNS)))
+    return path
+
+
+def _drop_points(month):
+    routes = _archived_routes_in(month)
+    count = sum(routes.values_list('point_count', flat=True))
+    routes.delete()
+
+    points = _points_in(month)
+    if native_partitioning():
+        count += points.count()
+        table = connection.ops.quote_name(TABLE)
+        name = connection.ops.quote_name(partition_name(month))
+        with connection.cursor() as cursor:
+            if partition_name(month) in _existing_partitions(cursor):
+                cursor.execute(f'ALTER TABLE {table} DETACH PARTITION {name}')
+                cursor.execute(f'DROP TABLE {name}')
+        # Anything left in the month is in the default partition
+        points.delete()
+        return count
+
+    # Without partitions the month is deleted in chunks, so no single
+    # statement holds the table for long
+    while True:
+        ids = list(points.order_by().values_list('id', flat=True)[:DELETE_CHUNK_SIZE])
+        if not ids:
+            return count
+        count += GPSRoutePoint.objects.filter(id__in=ids).delete()[0]
+
+
+def expire(before_month, archive_dir=None):
+    # Drops every month before `before_month`, archiving its points to a
+    # gzipped CSV first when `archive_dir` is given. Yields each partition.
+    for partition in GPSPartition.objects.filter(dropped_at__isnull=True, month__lt=before_month):
+        trip_ids = set(_points_in(partition.month).order_by().values_list('trip_id', flat=True).distinct())
+        trip_ids.update(_archived_routes_in(partition.month).values_list('trip_id', flat=True))
+        if archive_dir:
+            partition.archive = _archive(partition.month, archive_dir)
+        with transaction.atomic():
+            partition.dropped_points = _drop_points(partition.month)
+            partition.dropped_at = timezone.now()
+            partition.save()
+        invalidate_route_cache(trip_ids)
+        yield partition
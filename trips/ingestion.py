@@ -0,0 +1,225 @@
+from datetime import timezone as dt_timezone
+from decimal import Decimal, InvalidOperation
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+from .geofences import detect_geofence_events
+from .live import record_positions
+from .models import Trip, GPSRoutePoint
+from .route_archive import archived_sequences
+from .routes import invalidate_route_cache
+
+MAX_POINTS_PER_REQUEST = 100000
+BULK_BATCH_SIZE = 2000
+MAX_REPORTED_ERRORS = 50
+MAX_DEVICE_SEQ = 2147483647
+
+COORDINATE_QUANTUM = Decimal('0.000001')
+SPEED_QUANTUM = Decimal('0.01')
+
+
+def _decimal(value, quantum, low, high):
+    if isinstance(value, bool) or value is None or value == '':
+        raise ValueError
+    try:
+        number = Decimal(str(value)).quantize(quantum)
+    except InvalidOperation:
+        raise ValueError
+    if not number.is_finite() or number < low or number > high:
+        raise ValueError
+    return number
+
+
+def _timestamp(value):
+    parsed = parse_datetime(value) if isinstance(value, str) else None
+    if parsed is None:
+        raise ValueError
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, dt_timezone.utc)
+    return parsed
+
+
+def _parse_point(raw, received_at):
+    if not isinstance(raw, dict):
+        return None, {'non_field_errors': ['Expected an object with latitude and longitude.']}
+
+    errors = {}
+    values = {}
+    # Stored as whole microdegrees and hundredths of a km/h
+    for field, low, high in (('latitude', -90, 90), ('longitude', -180, 180)):
+        try:
+            values[f'{field}_e6'] = int(_decimal(raw.get(field), COORDINATE_QUANTUM, low, high).scaleb(6))
+        except ValueError:
+            errors[field] = [f'A number between {low} and {high} is required.']
+
+    speed = raw.get('speed')
+    if speed is None or speed == '':
+        values['speed_e2'] = None
+    else:
+        try:
+            values['speed_e2'] = int(_decimal(speed, SPEED_QUANTUM, 0, Decimal('999.99')).scaleb(2))
+        except ValueError:
+            errors['speed'] = ['A number between 0 and 999.99 is required.']
+
+    timestamp = raw.get('timestamp')
+    if timestamp is None:
+        values['timestamp'] = received_at
+    else:
+        try:
+            values['timestamp'] = _timestamp(timestamp)
+        except ValueError:
+            errors['timestamp'] = ['An ISO 8601 datetime is required.']
+
+    device_seq = raw.get('device_seq')
+    if device_seq is not None and (
+        isinstance(device_seq, bool) or not isinstance(device_seq, int)
+        or device_seq < 0 or device_seq > MAX_DEVICE_SEQ
+    ):
+        errors['device_seq'] = [f'An integer between 0 and {MAX_DEVICE_SEQ} is required.']
+    values['device_seq'] = device_seq
+
+    return values, errors
+
+
+def _check_batch_size(raw_points):
+    if not isinstance(raw_points, list):
+        raise ValidationError({'points': ['Expected a list of GPS points.']})
+    if not raw_points:
+        raise ValidationError({'points': ['At least one GPS point is required.']})
+    if len(raw_points) > MAX_POINTS_PER_REQUEST:
+        raise ValidationError({'points': [f'At most {MAX_POINTS_PER_REQUEST} points may be sent per request.']})
+
+
+def _raise_if_errors(errors):
+    if errors:
+        reported = dict(list(errors.items())[:MAX_REPORTED_ERRORS])
+        raise ValidationError({
+            'points': reported,
+            'non_field_errors': [f'{len(errors)} of the submitted points are invalid.'],
+        })
+
+
+def _existing_sequences(points):
+    ranges = {}
+    for point in points:
+        if point.device_seq is not None:
+            low, high = ranges.get(point.trip_id, (point.device_seq, point.device_seq))
+            ranges[point.trip_id] = (min(low, point.device_seq), max(high, point.device_seq))
+    if not ranges:
+        return set()
+
+    condition = Q()
+    for trip_id, (low, high) in ranges.items():
+        condition |= Q(trip_id=trip_id, device_seq__gte=low, device_seq__lte=high)
+    existing = set(GPSRoutePoint.objects.filter(condition).values_list('trip_id', 'device_seq'))
+    return existing | archived_sequences(ranges)
+
+
+def _lock_sequenced_trips(points):
+    # The device_seq unique key includes the timestamp, as every unique key
+    # of the partitioned point table must on PostgreSQL, so it does not stop
+    # two concurrent batches storing the same sequence number at different
+    # times. Locking the trips makes the check and insert below atomic per
+    # trip instead.
+    trip_ids = {point.trip_id for point in points if point.device_seq is not None}
+    if not trip_ids:
+        return
+    trips = Trip.objects.filter(id__in=trip_ids)
+    if connection.features.has_select_for_update:
+        list(trips.select_for_update().order_by('id').values_list('id'))
+    else:
+        # SQLite has no row locks; a write takes its database lock now,
+        # before the check, rather than at the insert
+        trips.update(status=F('status'))
+
+
+def _bulk_insert(points):
+    with transaction.atomic():
+        _lock_sequenced_trips(points)
+        seen = _existing_sequences(points)
+        new_points = []
+        for point in points:
+            if point.device_seq is not None:
+                key = (point.trip_id, point.device_seq)
+                if key in seen:
+                    continue
+                seen.add(key)
+            new_points.append(point)
+        GPSRoutePoint.objects.bulk_create(new_points, batch_size=BULK_BATCH_SIZE, ignore_conflicts=True)
+        if settings.GEOFENCE_EVENTS:
+            detect_geofence_events(new_points)
+        # Last, so the feed's revision lock is only held until the commit
+        record_positions(new_points)
+    invalidate_route_cache({point.trip_id for point in new_points})
+    return new_points
+
+
+def _summary(points, new_points):
+    return {'created': len(new_points), 'duplicates': len(points) - len(new_points)}
+
+
+def ingest_trip_points(trip, raw_points):
+    if trip.status == 'cancelled':
+        raise ValidationError({'trip': ['GPS points cannot be recorded for a cancelled trip.']})
+    _check_batch_size(raw_points)
+
+    received_at = timezone.now()
+    points = []
+    errors = {}
+    for index, raw in enumerate(raw_points):
+        values, point_errors = _parse_point(raw, received_at)
+        if point_errors:
+            errors[index] = point_errors
+        elif not errors:
+            points.append(GPSRoutePoint(trip_id=trip.id, **values))
+    _raise_if_errors(errors)
+
+    return _summary(points, _bulk_insert(points))
+
+
+def _trip_id(raw):
+    # The point's trip id, or None unless it is an integer; lists and
+    # objects sent there would otherwise break the set lookups
+    trip_id = raw.get('trip') if isinstance(raw, dict) else None
+    return trip_id if isinstance(trip_id, int) and not isinstance(trip_id, bool) else None
+
+
+def _fleet_trip_ids(raw_points):
+    trip_ids = {_trip_id(raw) for raw in raw_points} - {None}
+    return (
+        Trip.objects.filter(id__in=trip_ids)
+        .exclude(status='cancelled')
+        .values_list('id', flat=True)
+    )
+
+
+def _store_fleet_points(raw_points, valid_trip_ids):
+    received_at = timezone.now()
+    points = []
+    errors = {}
+    for index, raw in enumerate(raw_points):
+        values, point_errors = _parse_point(raw, received_at)
+        trip_id = _trip_id(raw)
+        if values is not None and trip_id not in valid_trip_ids:
+            point_errors['trip'] = ['Unknown or cancelled trip.']
+        if point_errors:
+            errors[index] = point_errors
+        elif not errors:
+            points.append(GPSRoutePoint(trip_id=trip_id, **values))
+    _raise_if_errors(errors)
+
+    new_points = _bulk_insert(points)
+    counts = {}
+    for point in new_points:
+        counts[point.trip_id] = counts.get(point.trip_id, 0) + 1
+    summary = _summary(points, new_points)
+    summary['trips'] = counts
+    return summary
+
+
+def ingest_fleet_points(raw_points):
+    _check_batch_size(raw_points)
+    return _store_fleet_points(raw_points, set(_fleet_trip_ids(raw_points)))
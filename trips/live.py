@@ -0,0 +1,277 @@
+import asyncio
+import json
+import time
+import weakref
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.utils import timezone
+from rest_framework.utils.encoders import JSONEncoder
+from .encoding import MICRODEGREES
+from .models import LivePosition, Sequence, Trip
+from .spatial import Area, nearby
+
+REVISION_SEQUENCE = 'live_position'
+CHANGES_KEY = 'live_positions:changes'
+MAX_WAIT = 30
+CHECK_INTERVAL = 0.2
+KEEPALIVE_INTERVAL = 15
+KEEPALIVE_EVENT = ': keepalive\n\n'
+# Event streams end after this many seconds; EventSource clients reconnect
+# with Last-Event-ID and resume where they left off
+STREAM_LIFETIME = 300
+
+POSITION_FIELDS = [
+    'trip_id', 'driver_id', 'vehicle_id', 'latitude_e6', 'longitude_e6', 'speed_e2', 'timestamp', 'is_active', 'revision',
+]
+POSITION_UPDATE_FIELDS = ['latitude_e6', 'longitude_e6', 'speed_e2', 'cell', 'timestamp', 'revision']
+
+# Nearest-vehicle searches start this close and widen fourfold each round
+NEAREST_START_KM = 5
+NEAREST_MAX_KM = 500
+NEAREST_LIMIT = 10
+
+
+def _next_revision():
+    # The allocation keeps the counter row locked until the caller commits,
+    # so revisions become visible in the order they were handed out and a
+    # reader that has seen revision N can never miss a smaller one later.
+    return Sequence.objects.allocate_block(REVISION_SEQUENCE, 1)
+
+
+def _announce():
+    # Wakes waiting feed readers in every process sharing the cache
+    def bump():
+        try:
+            cache.incr(CHANGES_KEY)
+        except ValueError:
+            cache.set(CHANGES_KEY, 1, None)
+    transaction.on_commit(bump)
+
+
+def record_positions(points):
+    latest = {}
+    for point in points:
+        current = latest.get(point.trip_id)
+        if current is None or point.timestamp > current.timestamp:
+            latest[point.trip_id] = point
+    if not latest:
+        return 0
+
+    with transaction.atomic():
+        trips = Trip.objects.filter(id__in=latest, status='started').values_list(
+            'id', 'driver_id', 'vehicle_id', 'live_position__timestamp'
+        )
+        positions = [
+            LivePosition(
+                trip_id=trip_id,
+                driver_id=driver_id,
+                vehicle_id=vehicle_id,
+                latitude_e6=latest[trip_id].latitude_e6,
+                longitude_e6=latest[trip_id].longitude_e6,
+                speed_e2=latest[trip_id].speed_e2,
+                timestamp=latest[trip_id].timestamp,
+            )
+            for trip_id, driver_id, vehicle_id, known in trips
+            # Points uploaded late must not move the vehicle backwards
+            if known is None or latest[trip_id].timestamp > known
+        ]
+        if positions:
+            # Allocated only now that something moved, and right before the
+            # write, so batches that change no position never wait on the
+            # revision lock and the others hold it as briefly as possible
+            revision = _next_revision()
+            for position in positions:
+                position.revision = revision
+            LivePosition.objects.bulk_create(
+                positions, update_conflicts=True, unique_fields=['trip'], update_fields=POSITION_UPDATE_FIELDS,
+            )
+            _announce()
+    return len(positions)
+
+
+def end_position(trip_id):
+    # Kept as an inactive row so feed readers learn the trip has ended
+    active = LivePosition.objects.filter(trip_id=trip_id, is_active=True)
+    if active.exists() and active.update(is_active=False, revision=_next_revision()):
+        _announce()
+
+
+def _committed_revision_query():
+    return Sequence.objects.filter(name=REVISION_SEQUENCE).values_list('last_value', flat=True)
+
+
+def _changed_positions(since):
+    positions = LivePosition.objects.order_by('revision')
+    if since is None:
+        positions = positions.filter(is_active=True)
+    else:
+        positions = positions.filter(revision__gt=since)
+    return positions.values_list(*POSITION_FIELDS)
+
+
+def _position(row):
+    trip_id, driver_id, vehicle_id, lat, lng, speed, timestamp, is_active, _ = row
+    return {
+        'trip': trip_id,
+        'driver': driver_id,
+        'vehicle': vehicle_id,
+        'latitude': lat / MICRODEGREES,
+        'longitude': lng / MICRODEGREES,
+        'speed': None if speed is None else speed / 100,
+        'timestamp': timezone.localtime(timestamp),
+        'active': is_active,
+    }
+
+
+def nearest_positions(latitude, longitude, limit=NEAREST_LIMIT, within_km=NEAREST_MAX_KM):
+    # The active trips closest to a point, nearest first, each with its
+    # distance in km. The search circle widens until it holds `limit`
+    # vehicles; everything closer than its edge is inside it, so they are
+    # the true nearest.
+    radius = NEAREST_START_KM
+    while True:
+        radius = min(radius, within_km)
+        found = nearby(
+            LivePosition.objects.filter(is_active=True), 'cell', Area.around(latitude, longitude, radius), *POSITION_FIELDS
+        )
+        if len(found) >= limit or radius >= within_km:
+            break
+        radius *= 4
+    return [dict(_position(row), distance_km=round(distance, 3)) for row, distance in found[:limit]]
+
+
+def _release_connection():
+    # A waiting reader must not keep a database connection open for the
+    # whole wait; thousands of them would exhaust the server's connections.
+    if not connection.in_atomic_block:
+        connection.close()
+
+
+def position_feed(since=None):
+    # Without `since` this is a snapshot of the active trips; with it, every
+    # position that changed after that revision, including trips that ended.
+    # The committed revision is read first: everything up to it is visible
+    # to the query that follows.
+    revision = max(since or 0, _committed_revision_query().first() or 0)
+    rows = list(_changed_positions(since))
+    if rows:
+        revision = max(revision, rows[-1][-1])
+    return {'revision': revision, 'positions': [_position(row) for row in rows]}
+
+
+async def aposition_feed(since=None):
+    revision = max(since or 0, await _committed_revision_query().afirst() or 0)
+    rows = [row async for row in _changed_positions(since)]
+    if rows:
+        revision = max(revision, rows[-1][-1])
+    return {'revision': revision, 'positions': [_position(row) for row in rows]}
+
+
+def poll_positions(since, wait):
+    # Long poll: returns as soon as something changed after `since`, or with
+    # no positions once `wait` seconds have passed. Between database reads
+    # only the shared change counter in the cache is checked.
+    deadline = time.monotonic() + min(wait, MAX_WAIT)
+    changes = cache.get(CHANGES_KEY)
+    while True:
+        feed = position_feed(since)
+        if feed['positions'] or time.monotonic() >= deadline:
+            return feed
+        _release_connection()
+        while time.monotonic() < deadline:
+            time.sleep(CHECK_INTERVAL)
+            latest = cache.get(CHANGES_KEY)
+            if latest != changes:
+                changes = latest
+                break
+
+
+class _ChangeBroadcast:
+    # Async readers in one event loop share a single watcher of the change
+    # counter, so a thousand idle readers cost one cache read per interval.
+    def __init__(self):
+        self.readers = 0
+        self.changed = asyncio.Event()
+        self.ready = asyncio.Event()
+        self.task = None
+
+    async def _watch(self):
+        get = sync_to_async(cache.get, thread_sensitive=False)
+        changes = await get(CHANGES_KEY)
+        self.ready.set()
+        while self.readers:
+            await asyncio.sleep(CHECK_INTERVAL)
+            latest = await get(CHANGES_KEY)
+            if latest != changes:
+                changes = latest
+                self.changed.set()
+                self.changed = asyncio.Event()
+        self.task = None
+        self.ready = asyncio.Event()
+
+    async def next_change(self):
+        # Taken before the reader queries the database, so a change that
+        # commits after the query always sets the returned event.
+        if self.task is None:
+            self.task = asyncio.create_task(self._watch())
+        await self.ready.wait()
+        return self.changed
+
+
+_broadcasts = weakref.WeakKeyDictionary()
+
+
+async def apoll_positions(since, wait):
+    # Same as poll_positions, but a waiting reader only costs a coroutine
+    deadline = time.monotonic() + min(wait, MAX_WAIT)
+    loop = asyncio.get_running_loop()
+    broadcast = _broadcasts.setdefault(loop, _ChangeBroadcast())
+    broadcast.readers += 1
+    try:
+        while True:
+            changed = await broadcast.next_change()
+            feed = await aposition_feed(since)
+            remaining = deadline - time.monotonic()
+            if feed['positions'] or remaining <= 0:
+                return feed
+            await sync_to_async(_release_connection)()
+            try:
+                await asyncio.wait_for(changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        broadcast.readers -= 1
+
+
+def _event(name, feed):
+    data = json.dumps(feed, cls=JSONEncoder)
+    return f"id: {feed['revision']}\nevent: {name}\ndata: {data}\n\n"
+
+
+def position_events(since=None):
+    # Server-Sent Events: a snapshot first unless resuming, then one event
+    # per batch of changes and a comment line to keep idle proxies open,
+    # until STREAM_LIFETIME is up. Ending the stream is also how a reader
+    # that has gone away is let go of, since the server does not say so.
+    deadline = time.monotonic() + STREAM_LIFETIME
+    if since is None:
+        feed = position_feed()
+        yield _event('snapshot', feed)
+        since = feed['revision']
+    while (remaining := deadline - time.monotonic()) > 0:
+        feed = poll_positions(since, min(KEEPALIVE_INTERVAL, remaining))
+        yield _event('positions', feed) if feed['positions'] else KEEPALIVE_EVENT
+        since = feed['revision']
+
+
+async def aposition_events(since=None):
+    deadline = time.monotonic() + STREAM_LIFETIME
+    if since is None:
+        feed = await aposition_feed()
+        yield _event('snapshot', feed)
+        since = feed['revision']
+    while (remaining := deadline - time.monotonic()) > 0:
+        feed = await apoll_positions(since, min(KEEPALIVE_INTERVAL, remaining))
+        yield _event('positions', feed) if feed['positions'] else KEEPALIVE_EVENT
+        since = feed['revision']
@@ -0,0 +1,28 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from trips.route_archive import archivable_trips, archive_route
+
+
+class Command(BaseCommand):
+    help = ("Pack the GPS points of completed trips into compressed route blobs and delete their rows; "
+            "also folds points uploaded after a trip was archived into its blob")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, help="Archive at most this many trips")
+
+    def handle(self, *args, **options):
+        if options['limit'] is not None and options['limit'] < 1:
+            raise CommandError("--limit must be at least 1")
+        trip_ids = archivable_trips().order_by('id').values_list('id', flat=True)
+        if options['limit']:
+            trip_ids = trip_ids[:options['limit']]
+
+        trips = points = 0
+        started = time.perf_counter()
+        for trip_id in list(trip_ids):
+            points += archive_route(trip_id)
+            trips += 1
+            if trips % 100 == 0:
+                elapsed = time.perf_counter() - started
+                self.stdout.write(f"{trips} trips archived, {points} points ({trips / elapsed:,.0f} trips/s)")
+        self.stdout.write(self.style.SUCCESS(f"Archived {points} points of {trips} trips"))
@@ -0,0 +1,57 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from trips import gps_storage
+
+
+class Command(BaseCommand):
+    help = ("Maintain GPS point storage: create upcoming monthly partitions, downsample old points "
+            "and drop (or archive, then drop) months past retention. Meant to run daily.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months-ahead', type=int, default=settings.GPS_PARTITIONS_AHEAD,
+                            help="Months of partitions to create ahead of the current one")
+        parser.add_argument('--downsample-after', type=int, default=settings.GPS_DOWNSAMPLE_AFTER_DAYS,
+                            help="Downsample points older than this many days")
+        parser.add_argument('--resolution', type=int, default=settings.GPS_DOWNSAMPLE_SECONDS,
+                            help="Seconds between the points kept per trip when downsampling")
+        parser.add_argument('--retain-months', type=int, default=settings.GPS_RETENTION_MONTHS,
+                            help="Months kept before the current one; older months are dropped")
+        parser.add_argument('--archive-dir', help="Write each month to a gzipped CSV here before dropping it")
+        parser.add_argument('--skip-downsample', action='store_true')
+        parser.add_argument('--skip-expire', action='store_true')
+
+    def handle(self, *args, **options):
+        for name in ('months_ahead', 'downsample_after', 'retain_months'):
+            if options[name] < 0:
+                raise CommandError(f"--{name.replace('_', '-')} must not be negative")
+        if options['resolution'] < 1:
+            raise CommandError("--resolution must be at least 1")
+
+        added = gps_storage.prepare_months(options['months_ahead'])
+        layout = "partitions" if gps_storage.native_partitioning() else "months"
+        self.stdout.write(f"Prepared {len(added)} new {layout}"
+                          + (f" ({added[0]:%Y-%m} to {added[-1]:%Y-%m})" if added else ""))
+
+        if not options['skip_downsample']:
+            before = timezone.now() - timedelta(days=options['downsample_after'])
+            removed = 0
+            for month, count in gps_storage.downsample(before, options['resolution']):
+                removed += count
+                self.stdout.write(f"{month:%Y-%m}: removed {count} points")
+            self.stdout.write(self.style.SUCCESS(
+                f"Downsampled points before {timezone.localtime(before):%Y-%m-%d %H:%M} "
+                f"to {options['resolution']}s, {removed} removed"
+            ))
+
+        if not options['skip_expire']:
+            before_month = gps_storage.add_months(
+                gps_storage.month_of(timezone.localdate()), -options['retain_months']
+            )
+            dropped = 0
+            for partition in gps_storage.expire(before_month, options['archive_dir']):
+                dropped += 1
+                archived = f", archived to {partition.archive}" if partition.archive else ""
+                self.stdout.write(f"{partition.month:%Y-%m}: dropped {partition.dropped_points} points{archived}")
+            self.stdout.write(self.style.SUCCESS(f"Dropped {dropped} months before {before_month:%Y-%m}"))
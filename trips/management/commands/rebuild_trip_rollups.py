@@ -0,0 +1,35 @@
+from datetime import date, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Min
+from django.utils import timezone
+from trips.models import Trip
+from trips.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = "Rebuild the daily trip rollups from completed trips, one chunk of days at a time"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', type=date.fromisoformat, help="First day to rebuild (YYYY-MM-DD)")
+        parser.add_argument('--end', type=date.fromisoformat, help="Last day to rebuild, inclusive (YYYY-MM-DD)")
+        parser.add_argument('--chunk-days', type=int, default=31)
+
+    def handle(self, *args, **options):
+        start = options['start']
+        if start is None:
+            first_trip = Trip.objects.filter(status='completed').aggregate(first=Min('start_time'))['first']
+            if first_trip is None:
+                self.stdout.write("No completed trips to roll up.")
+                return
+            start = timezone.localdate(first_trip)
+        end = (options['end'] or timezone.localdate()) + timedelta(days=1)
+        if start >= end:
+            raise CommandError("--start must not be after --end")
+        if options['chunk_days'] < 1:
+            raise CommandError("--chunk-days must be at least 1")
+
+        total = 0
+        for chunk_start, chunk_end, count in rebuild_rollups(start, end, options['chunk_days']):
+            total += count
+            self.stdout.write(f"{chunk_start} to {chunk_end - timedelta(days=1)}: {count} rollup rows")
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {total} rollup rows"))
@@ -0,0 +1,49 @@
+import time
+from datetime import date, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Min
+from django.utils import timezone
+from trips.metrics import CHUNK_SIZE, recomputable_trips, recompute_trip_metrics
+from trips.rollups import local_midnight, rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = "Recompute distance, GPS distance, duration, route compliance and after-hours flags for ended trips in bulk"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', type=date.fromisoformat, help="First trip start day (YYYY-MM-DD)")
+        parser.add_argument('--end', type=date.fromisoformat, help="Last trip start day, inclusive (YYYY-MM-DD)")
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+        parser.add_argument('--gps', action='store_true',
+                            help="Also re-measure GPS trail distances (reads every GPS point of the trips)")
+        parser.add_argument('--skip-rollups', action='store_true',
+                            help="Do not rebuild the daily rollups for the recomputed days")
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError("--chunk-size must be at least 1")
+        trips = recomputable_trips()
+        start = options['start']
+        if start is None:
+            first_trip = trips.aggregate(first=Min('start_time'))['first']
+            if first_trip is None:
+                self.stdout.write("No ended trips to recompute.")
+                return
+            start = timezone.localdate(first_trip)
+        end = (options['end'] or timezone.localdate()) + timedelta(days=1)
+        if start >= end:
+            raise CommandError("--start must not be after --end")
+        trips = trips.filter(start_time__gte=local_midnight(start), start_time__lt=local_midnight(end))
+
+        processed = updated = 0
+        started = time.perf_counter()
+        for chunk_processed, chunk_updated in recompute_trip_metrics(trips, options['chunk_size'], options['gps']):
+            processed += chunk_processed
+            updated += chunk_updated
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f"{processed} trips processed, {updated} updated ({processed / elapsed:,.0f} trips/s)")
+        self.stdout.write(self.style.SUCCESS(f"Recomputed {processed} trips, {updated} changed"))
+
+        if updated and not options['skip_rollups']:
+            rows = sum(count for _, _, count in rebuild_rollups(start, end))
+            self.stdout.write(self.style.SUCCESS(f"Rebuilt {rows} rollup rows from {start} to {end - timedelta(days=1)}"))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+from trips.worker import POLL_INTERVAL, run_worker
+
+
+class Command(BaseCommand):
+    help = "Run queued background tasks (trip finalization) from the database task queue"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--poll-interval', type=float, default=POLL_INTERVAL,
+                            help="Seconds to wait between checks of an empty queue")
+        parser.add_argument('--burst', action='store_true',
+                            help="Exit once the queue is empty instead of waiting for new tasks")
+
+    def handle(self, *args, **options):
+        if options['poll_interval'] <= 0:
+            raise CommandError("--poll-interval must be positive")
+        self.stdout.write("Waiting for tasks..." if not options['burst'] else "Running queued tasks...")
+        try:
+            run_worker(options['poll_interval'], options['burst'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS("Worker stopped"))
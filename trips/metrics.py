@@ -0,0 +1,192 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+import numpy as np
+from django.db import connection, transaction
+from django.db.models import FloatField
+from django.db.models.functions import Cast
+from django.utils import timezone
+from .geo import vincenty_km
+from .models import ArchivedRoute, GPSRoutePoint, Trip, METRIC_FIELDS, WORK_START, WORK_END
+from .trail import load_trails, trail_lengths
+
+CHUNK_SIZE = 5000
+# Trails are measured this many trips at a time, which bounds the points
+# held in memory however large the chunk
+TRAIL_BATCH_SIZE = 200
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+
+_FLOAT_COLUMNS = {
+    'start_km': 'start_odometer',
+    'end_km': 'end_odometer',
+    'start_lat': 'start_location_lat',
+    'start_lng': 'start_location_lng',
+    'end_lat': 'end_location_lat',
+    'end_lng': 'end_location_lng',
+    'job_lat': 'job__job_location_lat',
+    'job_lng': 'job__job_location_lng',
+    'old_distance': 'distance_travelled',
+    'old_compliance': 'route_compliance',
+    'old_gps_distance': 'gps_distance',
+}
+
+
+def recomputable_trips():
+    # The same trips Trip.calculate_metrics would touch
+    return Trip.objects.filter(end_time__isnull=False, end_odometer__isnull=False).exclude(end_odometer=0)
+
+
+def _microseconds(moment):
+    return ((moment.hour * 60 + moment.minute) * 60 + moment.second) * 1_000_000 + moment.microsecond
+
+
+def _epoch_microseconds(moments):
+    # Whole microseconds keep durations exact, unlike float timestamps
+    return np.array([(moment - EPOCH) // MICROSECOND for moment in moments], dtype=np.int64)
+
+
+def _local_time_of_day(epoch_microseconds):
+    # Offsets only change on the hour in practice, so look one up per distinct
+    # hour instead of converting every timestamp.
+    tz = timezone.get_current_timezone()
+    hour = 3600 * 1_000_000
+    hours, inverse = np.unique(epoch_microseconds // hour, return_inverse=True)
+    offsets = np.array([
+        (EPOCH + timedelta(hours=int(value))).astimezone(tz).utcoffset() // MICROSECOND for value in hours
+    ], dtype=np.int64)
+    return (epoch_microseconds + offsets[inverse]) % (24 * hour)
+
+
+def _load_chunk(queryset, after_id, chunk_size):
+    rows = list(
+        queryset.filter(id__gt=after_id).order_by('id')
+        .annotate(**{name: Cast(field, FloatField()) for name, field in _FLOAT_COLUMNS.items()})
+        .values_list('id', 'start_time', 'end_time', 'duration_minutes', 'is_after_hours',
+                     'route_compliance', *_FLOAT_COLUMNS)[:chunk_size]
+    )
+    if not rows:
+        return None
+    columns = list(zip(*rows))
+    chunk = {
+        'id': np.array(columns[0], dtype=np.int64),
+        'start': _epoch_microseconds(columns[1]),
+        'end': _epoch_microseconds(columns[2]),
+        'old_duration': np.array([-1 if value is None else value for value in columns[3]], dtype=np.int64),
+        'old_after_hours': np.array(columns[4], dtype=bool),
+        'route_compliance': columns[5],
+    }
+    for offset, name in enumerate(_FLOAT_COLUMNS, start=6):
+        chunk[name] = np.array(columns[offset], dtype=np.float64)
+    return chunk
+
+
+def _gps_distances(chunk):
+    # One query per batch of the chunk's trails; trips without a trail get NaN
+    ids = chunk['id']
+    distances = np.full(ids.shape, np.nan)
+    for offset in range(0, len(ids), TRAIL_BATCH_SIZE):
+        batch = ids[offset:offset + TRAIL_BATCH_SIZE].tolist()
+        trails = load_trails(
+            GPSRoutePoint.objects.filter(trip_id__in=batch),
+            ArchivedRoute.objects.filter(trip_id__in=batch).values_list('trip_id', 'data'),
+        )
+        if trails is not None:
+            trip_ids, lengths = trail_lengths(*trails)
+            distances[np.searchsorted(ids, trip_ids)] = np.round(lengths, 2)
+    return distances
+
+
+def compute_metrics(chunk, gps_distance):
+    distance = np.round(chunk['end_km'] - chunk['start_km'], 2)
+    elapsed = chunk['end'] - chunk['start']
+    # int() truncates toward zero, so round negative durations the same way
+    duration = np.sign(elapsed) * (np.abs(elapsed) // 60_000_000)
+
+    coordinates = [chunk[name] for name in ('start_lat', 'start_lng', 'end_lat', 'end_lng', 'job_lat', 'job_lng')]
+    has_route = np.logical_and.reduce([~np.isnan(column) & (column != 0) for column in coordinates[:4]])
+    has_route &= ~np.isnan(chunk['job_lat']) & ~np.isnan(chunk['job_lng']) & (chunk['job_lat'] != 0)
+    # Score against the trail actually driven when there is one
+    actual = np.where(np.nan_to_num(gps_distance) > 0, gps_distance, distance)
+    has_route &= actual > 0
+
+    compliance = np.full(distance.shape, np.nan)
+    if has_route.any():
+        start_lat, start_lng, end_lat, end_lng, job_lat, job_lng = (column[has_route] for column in coordinates)
+        direct = vincenty_km(start_lat, start_lng, job_lat, job_lng) + vincenty_km(job_lat, job_lng, end_lat, end_lng)
+        compliance[has_route] = np.round(np.minimum(100.0, direct / actual[has_route] * 100), 2)
+
+    start_of_day = _local_time_of_day(chunk['start'])
+    after_hours = (start_of_day < _microseconds(WORK_START)) | (start_of_day > _microseconds(WORK_END))
+    return distance, duration, compliance, after_hours
+
+
+def _differs(new, old):
+    return (np.isnan(new) != np.isnan(old)) | (~np.isnan(new) & (new != old))
+
+
+def _changed(chunk, distance, gps_distance, duration, compliance, after_hours):
+    old_compliance = chunk['old_compliance']
+    compliance_changed = ~np.isnan(compliance) & (np.isnan(old_compliance) | (compliance != old_compliance))
+    return (
+        np.isnan(chunk['old_distance']) | (distance != chunk['old_distance'])
+        | _differs(gps_distance, chunk['old_gps_distance'])
+        | (duration != chunk['old_duration'])
+        | compliance_changed
+        | (after_hours != chunk['old_after_hours'])
+    )
+
+
+def _write_back(rows):
+    # QuerySet.bulk_update() builds a CASE expression per row and spends far
+    # longer in Python than in the database; one prepared UPDATE executed for
+    # every row is the same write at a fraction of the cost.
+    if not rows:
+        return
+    fields = [Trip._meta.get_field(name) for name in METRIC_FIELDS]
+    quote = connection.ops.quote_name
+    sql = 'UPDATE {} SET {} WHERE {} = %s'.format(
+        quote(Trip._meta.db_table),
+        ', '.join(f'{quote(field.column)} = %s' for field in fields),
+        quote(Trip._meta.pk.column),
+    )
+    params = [
+        [field.get_db_prep_save(value, connection) for field, value in zip(fields, row[:-1])] + [row[-1]]
+        for row in rows
+    ]
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.executemany(sql, params)
+
+
+def recompute_trip_metrics(queryset=None, chunk_size=CHUNK_SIZE, gps=False):
+    # Batch counterpart of Trip.calculate_metrics: each chunk of trips is
+    # loaded as columns, computed with NumPy and only the trips whose metrics
+    # actually changed are written back. The stored GPS trail distance is
+    # reused unless gps is set, since measuring trails reads every point.
+    queryset = recomputable_trips() if queryset is None else queryset
+    last_id = 0
+    while True:
+        chunk = _load_chunk(queryset, last_id, chunk_size)
+        if chunk is None:
+            return
+        gps_distance = _gps_distances(chunk) if gps else chunk['old_gps_distance']
+        distance, duration, compliance, after_hours = compute_metrics(chunk, gps_distance)
+        changed = np.flatnonzero(_changed(chunk, distance, gps_distance, duration, compliance, after_hours))
+
+        rows = []
+        for index in changed.tolist():
+            route_compliance = chunk['route_compliance'][index]
+            if not np.isnan(compliance[index]):
+                route_compliance = Decimal(f"{compliance[index]:.2f}")
+            rows.append((
+                Decimal(f"{distance[index]:.2f}"),
+                None if np.isnan(gps_distance[index]) else Decimal(f"{gps_distance[index]:.2f}"),
+                int(duration[index]),
+                route_compliance,
+                bool(after_hours[index]),
+                int(chunk['id'][index]),
+            ))
+        _write_back(rows)
+
+        last_id = int(chunk['id'][-1])
+        yield len(chunk['id']), len(rows)
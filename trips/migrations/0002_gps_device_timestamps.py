@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-17 19:16
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gpsroutepoint',
+            name='device_seq',
+            field=models.PositiveIntegerField(blank=True, help_text='Sequence number assigned by the tracker', null=True),
+        ),
+        migrations.AlterField(
+            model_name='gpsroutepoint',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AlterField(
+            model_name='tripevent',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddConstraint(
+            model_name='gpsroutepoint',
+            constraint=models.UniqueConstraint(fields=('trip', 'device_seq'), name='unique_gps_point_device_seq'),
+        ),
+    ]
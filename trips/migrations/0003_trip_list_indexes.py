@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-17 19:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0002_gps_device_timestamps'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='trip',
+            index=models.Index(fields=['-start_time', '-id'], name='trip_start_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='trip',
+            index=models.Index(fields=['status', '-start_time'], name='trip_status_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='trip',
+            index=models.Index(fields=['driver', '-start_time'], name='trip_driver_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='trip',
+            index=models.Index(fields=['vehicle', '-start_time'], name='trip_vehicle_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='trip',
+            index=models.Index(condition=models.Q(('is_after_hours', True)), fields=['-start_time'], name='trip_after_hours_start_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.7 on 2026-10-17 19:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0003_trip_list_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='gpsroutepoint',
+            index=models.Index(fields=['trip', 'timestamp'], name='gpspoint_trip_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(fields=['assigned_driver', 'status'], name='job_driver_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='trip',
+            index=models.Index(fields=['driver', 'status', '-start_time'], name='trip_driver_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tripevent',
+            index=models.Index(fields=['trip', 'timestamp'], name='tripevent_trip_time_idx'),
+        ),
+    ]
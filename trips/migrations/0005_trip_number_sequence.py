@@ -0,0 +1,32 @@
+# Generated by Django 4.2.7 on 2026-10-17 19:26
+
+from django.db import migrations, models
+
+
+def seed_trip_number_sequence(apps, schema_editor):
+    Trip = apps.get_model('trips', 'Trip')
+    Sequence = apps.get_model('trips', 'Sequence')
+    last_value = 0
+    for trip_number in Trip.objects.values_list('trip_number', flat=True).iterator():
+        prefix, _, number = trip_number.partition('-')
+        if prefix == 'TRIP' and number.isdigit():
+            last_value = max(last_value, int(number))
+    Sequence.objects.create(name='trip_number', last_value=last_value)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0004_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Sequence',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('last_value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(seed_trip_number_sequence, migrations.RunPython.noop),
+    ]
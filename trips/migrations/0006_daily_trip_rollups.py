@@ -0,0 +1,37 @@
+# Generated by Django 4.2.7 on 2026-10-17 19:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0005_trip_number_sequence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyTripRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('trip_count', models.IntegerField(default=0)),
+                ('total_distance', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('total_duration_minutes', models.BigIntegerField(default=0)),
+                ('total_fuel_consumed', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('after_hours_trips', models.IntegerField(default=0)),
+                ('compliance_sum', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('compliance_count', models.IntegerField(default=0)),
+                ('driver', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_rollups', to='trips.driver')),
+                ('vehicle', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_rollups', to='trips.vehicle')),
+            ],
+            options={
+                'ordering': ['date'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='dailytriprollup',
+            constraint=models.UniqueConstraint(fields=('date', 'driver', 'vehicle'), name='unique_daily_trip_rollup'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-17 19:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0006_daily_trip_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trip',
+            name='gps_distance',
+            field=models.DecimalField(blank=True, decimal_places=2, help_text='Kilometres along the GPS trail', max_digits=10, null=True),
+        ),
+    ]
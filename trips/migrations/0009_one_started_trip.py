@@ -0,0 +1,38 @@
+# Generated by Django 4.2.7 on 2026-10-17 19:52
+
+from django.db import migrations, models
+
+
+def cancel_duplicate_started_trips(apps, schema_editor):
+    # Double-submitted starts left some drivers and vehicles with more than
+    # one started trip; keep the first and cancel the rest so the
+    # constraints can be added.
+    Trip = apps.get_model('trips', 'Trip')
+    seen_drivers = set()
+    seen_vehicles = set()
+    duplicates = []
+    for trip in Trip.objects.filter(status='started').order_by('id').only('id', 'driver_id', 'vehicle_id'):
+        if trip.driver_id in seen_drivers or trip.vehicle_id in seen_vehicles:
+            duplicates.append(trip.id)
+        seen_drivers.add(trip.driver_id)
+        seen_vehicles.add(trip.vehicle_id)
+    Trip.objects.filter(id__in=duplicates).update(status='cancelled')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0008_background_tasks'),
+    ]
+
+    operations = [
+        migrations.RunPython(cancel_duplicate_started_trips, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='trip',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'started')), fields=('driver',), name='one_started_trip_per_driver'),
+        ),
+        migrations.AddConstraint(
+            model_name='trip',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'started')), fields=('vehicle',), name='one_started_trip_per_vehicle'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.7 on 2026-10-17 20:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0009_one_started_trip'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LivePosition',
+            fields=[
+                ('trip', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='live_position', serialize=False, to='trips.trip')),
+                ('latitude', models.DecimalField(decimal_places=6, max_digits=9)),
+                ('longitude', models.DecimalField(decimal_places=6, max_digits=9)),
+                ('speed', models.DecimalField(blank=True, decimal_places=2, max_digits=5, null=True)),
+                ('timestamp', models.DateTimeField()),
+                ('is_active', models.BooleanField(default=True)),
+                ('revision', models.BigIntegerField(db_index=True, help_text='Feed revision of the last change')),
+                ('driver', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='trips.driver')),
+                ('vehicle', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='trips.vehicle')),
+            ],
+        ),
+    ]
@@ -0,0 +1,97 @@
+# Generated by Django 4.2.7 on 2026-10-17 20:16
+
+from datetime import date, datetime, time
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def _month_start(month):
+    return timezone.make_aware(datetime.combine(month, time.min))
+
+
+def _next_month(month):
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def partition_gps_points(apps, schema_editor):
+    # PostgreSQL only: rebuild trips_gpsroutepoint as a table partitioned by
+    # month of timestamp, with a default partition for anything outside the
+    # months created here. Every unique constraint on a partitioned table
+    # must include the partition key, hence the wider primary key and
+    # device sequence constraint; ingestion locks the trip to keep device_seq
+    # unique per trip. Other databases keep the single table.
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    execute = schema_editor.execute
+    execute('ALTER TABLE trips_gpsroutepoint RENAME TO trips_gpsroutepoint_unpartitioned')
+    execute('ALTER TABLE trips_gpsroutepoint_unpartitioned ALTER COLUMN id DROP IDENTITY IF EXISTS')
+    execute('ALTER TABLE trips_gpsroutepoint_unpartitioned ALTER COLUMN id DROP DEFAULT')
+    execute('DROP SEQUENCE IF EXISTS trips_gpsroutepoint_id_seq')
+    execute(
+        'CREATE TABLE trips_gpsroutepoint (LIKE trips_gpsroutepoint_unpartitioned INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'
+        ' PARTITION BY RANGE ("timestamp")'
+    )
+    execute('CREATE SEQUENCE trips_gpsroutepoint_id_seq OWNED BY trips_gpsroutepoint.id')
+    execute("ALTER TABLE trips_gpsroutepoint ALTER COLUMN id SET DEFAULT nextval('trips_gpsroutepoint_id_seq')")
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('SELECT MIN("timestamp"), MAX("timestamp") FROM trips_gpsroutepoint_unpartitioned')
+        first, last = cursor.fetchone()
+    months = []
+    if first is not None:
+        month = timezone.localdate(first).replace(day=1)
+        while month <= timezone.localdate(last):
+            months.append(month)
+            month = _next_month(month)
+    for month in months:
+        execute(
+            f'CREATE TABLE trips_gpsroutepoint_p{month:%Y_%m} PARTITION OF trips_gpsroutepoint'
+            ' FOR VALUES FROM (%s) TO (%s)',
+            [_month_start(month), _month_start(_next_month(month))],
+        )
+    execute('CREATE TABLE trips_gpsroutepoint_default PARTITION OF trips_gpsroutepoint DEFAULT')
+
+    execute('INSERT INTO trips_gpsroutepoint SELECT * FROM trips_gpsroutepoint_unpartitioned')
+    execute("SELECT setval('trips_gpsroutepoint_id_seq', COALESCE(MAX(id), 0) + 1, false) FROM trips_gpsroutepoint")
+    execute('DROP TABLE trips_gpsroutepoint_unpartitioned')
+    execute('ALTER TABLE trips_gpsroutepoint ADD CONSTRAINT trips_gpsroutepoint_pkey PRIMARY KEY (id, "timestamp")')
+    execute(
+        'ALTER TABLE trips_gpsroutepoint ADD CONSTRAINT unique_gps_point_device_seq'
+        ' UNIQUE (trip_id, device_seq, "timestamp")'
+    )
+    execute(
+        'ALTER TABLE trips_gpsroutepoint ADD CONSTRAINT trips_gpsroutepoint_trip_id_fk_trips_trip_id'
+        ' FOREIGN KEY (trip_id) REFERENCES trips_trip (id) DEFERRABLE INITIALLY DEFERRED'
+    )
+    execute('CREATE INDEX gpspoint_trip_time_idx ON trips_gpsroutepoint (trip_id, "timestamp")')
+
+    GPSPartition = apps.get_model('trips', 'GPSPartition')
+    GPSPartition.objects.bulk_create([GPSPartition(month=month) for month in months])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0010_live_positions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GPSPartition',
+            fields=[
+                ('month', models.DateField(help_text='First day of the month', primary_key=True, serialize=False)),
+                ('downsampled_through', models.DateTimeField(blank=True, null=True)),
+                ('dropped_at', models.DateTimeField(blank=True, null=True)),
+                ('dropped_points', models.BigIntegerField(default=0)),
+                ('archive', models.CharField(blank=True, help_text='File the points were archived to', max_length=500)),
+            ],
+            options={
+                'ordering': ['month'],
+            },
+        ),
+        migrations.RunPython(partition_gps_points, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='gpsroutepoint',
+            index=models.Index(fields=['timestamp'], name='gpspoint_time_idx'),
+        ),
+    ]
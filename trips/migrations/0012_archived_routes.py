@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-17 20:19
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0011_gps_partitions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedRoute',
+            fields=[
+                ('trip', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='archived_route', serialize=False, to='trips.trip')),
+                ('point_count', models.PositiveIntegerField()),
+                ('data', models.BinaryField()),
+                ('archived_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,100 @@
+from django.db import migrations, models
+from django.db.models import F
+from django.db.models.functions import Cast, Round
+
+SCALED_FIELDS = [('latitude', 'latitude_e6', 6), ('longitude', 'longitude_e6', 6), ('speed', 'speed_e2', 2)]
+MODELS = ['GPSRoutePoint', 'LivePosition']
+DECIMAL_FIELDS = {
+    'latitude': models.DecimalField(decimal_places=6, max_digits=9, null=True),
+    'longitude': models.DecimalField(decimal_places=6, max_digits=9, null=True),
+    'speed': models.DecimalField(blank=True, decimal_places=2, max_digits=5, null=True),
+}
+
+
+def to_integers(apps, schema_editor):
+    # One UPDATE per table; on a large GPS table run this in a quiet period
+    for name in MODELS:
+        apps.get_model('trips', name).objects.update(**{
+            scaled: Cast(Round(F(decimal) * 10 ** places), models.IntegerField())
+            for decimal, scaled, places in SCALED_FIELDS
+        })
+
+
+def to_decimals(apps, schema_editor):
+    # The reverse, run once the decimal columns are back and still nullable
+    for name in MODELS:
+        apps.get_model('trips', name).objects.update(**{
+            decimal: Cast(Cast(F(scaled), models.FloatField()) / 10 ** places, DECIMAL_FIELDS[decimal])
+            for decimal, scaled, places in SCALED_FIELDS
+        })
+
+
+def nullable_decimals(model_name):
+    # Removed columns come back nullable when migrating backwards, so they
+    # are made nullable first and only made required again once refilled
+    return [
+        migrations.AlterField(model_name=model_name, name=name, field=field)
+        for name, field in DECIMAL_FIELDS.items()
+    ]
+
+
+def scaled_fields(model_name):
+    return [
+        migrations.AddField(
+            model_name=model_name,
+            name='latitude_e6',
+            field=models.IntegerField(help_text='Latitude in microdegrees', null=True),
+        ),
+        migrations.AddField(
+            model_name=model_name,
+            name='longitude_e6',
+            field=models.IntegerField(help_text='Longitude in microdegrees', null=True),
+        ),
+        migrations.AddField(
+            model_name=model_name,
+            name='speed_e2',
+            field=models.IntegerField(blank=True, help_text='Speed in hundredths of a km/h', null=True),
+        ),
+    ]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0012_archived_routes'),
+    ]
+
+    operations = [
+        *scaled_fields('gpsroutepoint'),
+        *scaled_fields('liveposition'),
+        migrations.RunPython(to_integers, migrations.RunPython.noop),
+        *nullable_decimals('gpsroutepoint'),
+        *nullable_decimals('liveposition'),
+        migrations.RunPython(migrations.RunPython.noop, to_decimals),
+        migrations.RemoveField(model_name='gpsroutepoint', name='latitude'),
+        migrations.RemoveField(model_name='gpsroutepoint', name='longitude'),
+        migrations.RemoveField(model_name='gpsroutepoint', name='speed'),
+        migrations.RemoveField(model_name='liveposition', name='latitude'),
+        migrations.RemoveField(model_name='liveposition', name='longitude'),
+        migrations.RemoveField(model_name='liveposition', name='speed'),
+        migrations.AlterField(
+            model_name='gpsroutepoint',
+            name='latitude_e6',
+            field=models.IntegerField(help_text='Latitude in microdegrees'),
+        ),
+        migrations.AlterField(
+            model_name='gpsroutepoint',
+            name='longitude_e6',
+            field=models.IntegerField(help_text='Longitude in microdegrees'),
+        ),
+        migrations.AlterField(
+            model_name='liveposition',
+            name='latitude_e6',
+            field=models.IntegerField(help_text='Latitude in microdegrees'),
+        ),
+        migrations.AlterField(
+            model_name='liveposition',
+            name='longitude_e6',
+            field=models.IntegerField(help_text='Longitude in microdegrees'),
+        ),
+    ]
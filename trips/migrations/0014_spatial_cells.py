@@ -0,0 +1,185 @@
+import struct
+import zlib
+import numpy as np
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import F, Value
+from django.db.models.functions import Cast, Greatest, Least, Round
+
+# The cell and route archive code below is frozen as it was when this
+# migration was written, so later changes to trips.geo, trips.encoding or
+# trips.models cannot change what it does
+CELL_BITS = 26
+SPREAD_STEPS = [(16, 0x0000FFFF0000FFFF), (8, 0x00FF00FF00FF00FF), (4, 0x0F0F0F0F0F0F0F0F),
+                (2, 0x3333333333333333), (1, 0x5555555555555555)]
+
+ROUTE_ARCHIVE_MAGIC = b'FRA1'
+ROUTE_ARCHIVE_HEADER = struct.Struct('<4sI')
+# Byte size of the id column, then latitude and longitude in microdegrees
+# stored as differences; the columns after them are not needed here
+ROUTE_ARCHIVE_ID_SIZE = 8
+ROUTE_ARCHIVE_COORDINATE_DTYPE = '<i4'
+
+
+def cell_of(latitude_e6, longitude_e6):
+    def quantize(value, offset, span):
+        return min(max((value + offset) * (1 << CELL_BITS) // span, 0), (1 << CELL_BITS) - 1)
+
+    def spread(value):
+        for shift, mask in SPREAD_STEPS:
+            value = (value | (value << shift)) & mask
+        return value
+    return (spread(quantize(longitude_e6, 180000000, 360000000)) << 1) | spread(quantize(latitude_e6, 90000000, 180000000))
+
+
+class GeoCellField(models.BigIntegerField):
+    # trips.models.GeoCellField for the historical models. It deconstructs
+    # to the model field's path, so the two compare equal.
+    def __init__(self, latitude_field, longitude_field, microdegrees=False, **kwargs):
+        self.latitude_field = latitude_field
+        self.longitude_field = longitude_field
+        self.microdegrees = microdegrees
+        kwargs.setdefault('editable', False)
+        super().__init__(**kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        args = [self.latitude_field, self.longitude_field, *args]
+        if self.microdegrees:
+            kwargs['microdegrees'] = True
+        return name, 'trips.models.GeoCellField', args, kwargs
+
+    def pre_save(self, model_instance, add):
+        latitude = getattr(model_instance, self.latitude_field)
+        longitude = getattr(model_instance, self.longitude_field)
+        if latitude is None or longitude is None:
+            value = None
+        elif self.microdegrees:
+            value = cell_of(latitude, longitude)
+        else:
+            value = cell_of(*(int(Decimal(str(degrees)).scaleb(6).to_integral_value()) for degrees in (latitude, longitude)))
+        setattr(model_instance, self.attname, value)
+        return value
+
+
+def archived_coordinates(payload):
+    # The latitude and longitude columns of a packed route, in microdegrees
+    magic, count = ROUTE_ARCHIVE_HEADER.unpack_from(payload)
+    if magic != ROUTE_ARCHIVE_MAGIC:
+        raise ValueError("Not a route archive")
+    data = zlib.decompress(bytes(payload[ROUTE_ARCHIVE_HEADER.size:]))
+    itemsize = np.dtype(ROUTE_ARCHIVE_COORDINATE_DTYPE).itemsize
+    columns = []
+    for offset in (ROUTE_ARCHIVE_ID_SIZE * count, (ROUTE_ARCHIVE_ID_SIZE + itemsize) * count):
+        # Each column is stored byte plane by byte plane
+        planes = np.frombuffer(data, dtype=np.uint8, count=itemsize * count, offset=offset).reshape(itemsize, count)
+        values = np.ascontiguousarray(planes.T).view(ROUTE_ARCHIVE_COORDINATE_DTYPE).ravel().astype(np.int64)
+        columns.append(np.cumsum(values))
+    return columns
+
+
+def _quantized(microdegrees, offset, span):
+    # Cast first: the product overflows a 32-bit integer column
+    value = (Cast(microdegrees, models.BigIntegerField()) + offset) * (1 << CELL_BITS) / span
+    return Least(Greatest(value, Value(0)), Value((1 << CELL_BITS) - 1))
+
+
+def _spread(value):
+    for shift, mask in SPREAD_STEPS:
+        value = value.bitor(value.bitleftshift(shift)).bitand(mask)
+    return value
+
+
+def cell_expression(latitude_e6, longitude_e6):
+    # cell_of in SQL, so each table is filled by one UPDATE
+    x = _quantized(longitude_e6, 180000000, 360000000)
+    y = _quantized(latitude_e6, 90000000, 180000000)
+    return _spread(x).bitleftshift(1).bitor(_spread(y))
+
+
+def microdegrees(field):
+    return Cast(Round(F(field) * 1000000), models.BigIntegerField())
+
+
+def fill_cells(apps, schema_editor):
+    for name in ['GPSRoutePoint', 'LivePosition']:
+        apps.get_model('trips', name).objects.update(cell=cell_expression(F('latitude_e6'), F('longitude_e6')))
+    apps.get_model('trips', 'Job').objects.filter(
+        job_location_lat__isnull=False, job_location_lng__isnull=False,
+    ).update(location_cell=cell_expression(microdegrees('job_location_lat'), microdegrees('job_location_lng')))
+
+    ArchivedRoute = apps.get_model('trips', 'ArchivedRoute')
+    for route in ArchivedRoute.objects.filter(point_count__gt=0).iterator(chunk_size=100):
+        lats, lngs = archived_coordinates(route.data)
+        ArchivedRoute.objects.filter(pk=route.pk).update(
+            min_latitude_e6=int(lats.min()), max_latitude_e6=int(lats.max()),
+            min_longitude_e6=int(lngs.min()), max_longitude_e6=int(lngs.max()),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0013_integer_coordinates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gpsroutepoint',
+            name='cell',
+            field=GeoCellField('latitude_e6', 'longitude_e6', editable=False, microdegrees=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='liveposition',
+            name='cell',
+            field=GeoCellField('latitude_e6', 'longitude_e6', editable=False, microdegrees=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='location_cell',
+            field=GeoCellField('job_location_lat', 'job_location_lng', blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='archivedroute',
+            name='min_latitude_e6',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='archivedroute',
+            name='max_latitude_e6',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='archivedroute',
+            name='min_longitude_e6',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='archivedroute',
+            name='max_longitude_e6',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(fill_cells, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='gpsroutepoint',
+            name='cell',
+            field=GeoCellField('latitude_e6', 'longitude_e6', editable=False, microdegrees=True),
+        ),
+        migrations.AlterField(
+            model_name='liveposition',
+            name='cell',
+            field=GeoCellField('latitude_e6', 'longitude_e6', editable=False, microdegrees=True),
+        ),
+        migrations.AddIndex(
+            model_name='gpsroutepoint',
+            index=models.Index(fields=['cell'], name='gpspoint_cell_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='liveposition',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['cell'], name='liveposition_active_cell_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(fields=['location_cell'], name='job_location_cell_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-17 20:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0014_spatial_cells'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='liveposition',
+            index=models.Index(fields=['driver', 'timestamp'], name='liveposition_driver_time_idx'),
+        ),
+    ]
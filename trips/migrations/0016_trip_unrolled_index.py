@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-17 21:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0015_live_position_driver_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='trip',
+            index=models.Index(condition=models.Q(models.Q(('status', 'completed'), _negated=True), ('metrics_status__in', ['pending', 'processing', 'failed']), _connector='OR'), fields=['-start_time'], name='trip_unrolled_start_idx'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+from decimal import Decimal
+from django.db import migrations
+from django.db.models import Count, DecimalField, F, Q, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate
+
+BATCH_SIZE = 1000
+
+
+def backfill_rollups(apps, schema_editor):
+    # Trips completed before the rollups existed were never recorded in them,
+    # so the analytics endpoints would leave them out. Rebuild every row from
+    # the finalized completed trips, as rebuild_trip_rollups does; rows kept
+    # since 0006 come out the same.
+    Trip = apps.get_model('trips', 'Trip')
+    DailyTripRollup = apps.get_model('trips', 'DailyTripRollup')
+    DailyTripRollup.objects.all().delete()
+
+    completed = Trip.objects.filter(status='completed').exclude(
+        metrics_status__in=['pending', 'processing', 'failed']
+    ).order_by()
+    zero = Value(Decimal('0'), output_field=DecimalField())
+    rows = completed.annotate(date=TruncDate('start_time')).values('date', 'driver_id', 'vehicle_id').annotate(
+        trip_count=Count('id'),
+        total_distance=Coalesce(Sum('distance_travelled'), zero),
+        total_duration_minutes=Coalesce(Sum('duration_minutes'), 0),
+        total_fuel_consumed=Coalesce(Sum(F('start_fuel_level') - F('end_fuel_level')), zero),
+        after_hours_trips=Count('id', filter=Q(is_after_hours=True)),
+        compliance_sum=Coalesce(Sum('route_compliance'), zero),
+        compliance_count=Count('route_compliance'),
+    )
+    batch = []
+    for row in rows.iterator(chunk_size=BATCH_SIZE):
+        batch.append(DailyTripRollup(**row))
+        if len(batch) == BATCH_SIZE:
+            DailyTripRollup.objects.bulk_create(batch)
+            batch = []
+    DailyTripRollup.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0016_trip_unrolled_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
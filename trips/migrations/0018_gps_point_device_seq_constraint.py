@@ -0,0 +1,39 @@
+from django.db import migrations, models
+
+
+class OutsidePostgreSQL:
+    # 0011 already gave PostgreSQL's partitioned table the wide constraint;
+    # elsewhere the database follows the model state
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != 'postgresql':
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != 'postgresql':
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+
+
+class RemoveConstraint(OutsidePostgreSQL, migrations.RemoveConstraint):
+    pass
+
+
+class AddConstraint(OutsidePostgreSQL, migrations.AddConstraint):
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0017_backfill_daily_trip_rollups'),
+    ]
+
+    operations = [
+        RemoveConstraint(
+            model_name='gpsroutepoint',
+            name='unique_gps_point_device_seq',
+        ),
+        AddConstraint(
+            model_name='gpsroutepoint',
+            constraint=models.UniqueConstraint(fields=('trip', 'device_seq', 'timestamp'), name='unique_gps_point_device_seq'),
+        ),
+    ]
@@ -1,9 +1,53 @@
-from django.db import models
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import F, Q
 from django.contrib.auth.models import User
 from django.utils import timezone
 from decimal import Decimal
 from geopy.distance import geodesic
-from datetime import datetime, time
+from datetime import datetime, time, timedelta
+from .encoding import to_fixed
+from .geo import cell_of
+from .sequences import BlockAllocator
+from .trail import gps_trail_distance
+
+# Working hours in the fleet's local time; trips starting outside them are after-hours
+WORK_START = time(7, 0)
+WORK_END = time(18, 0)
+
+# Columns written by Trip.calculate_metrics
+METRIC_FIELDS = ['distance_travelled', 'gps_distance', 'duration_minutes', 'route_compliance', 'is_after_hours']
+
+class GeoCellField(models.BigIntegerField):
+    # The spatial cell (see geo.cell_of) of the position held in two other
+    # fields, filled in on every save and bulk_create; None without one.
+    # `microdegrees` says the fields hold integer microdegrees, not degrees.
+    def __init__(self, latitude_field, longitude_field, microdegrees=False, **kwargs):
+        self.latitude_field = latitude_field
+        self.longitude_field = longitude_field
+        self.microdegrees = microdegrees
+        kwargs.setdefault('editable', False)
+        super().__init__(**kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        args = [self.latitude_field, self.longitude_field, *args]
+        if self.microdegrees:
+            kwargs['microdegrees'] = True
+        return name, path, args, kwargs
+
+    def pre_save(self, model_instance, add):
+        latitude = getattr(model_instance, self.latitude_field)
+        longitude = getattr(model_instance, self.longitude_field)
+        if latitude is None or longitude is None:
+            value = None
+        elif self.microdegrees:
+            value = cell_of(latitude, longitude)
+        else:
+            value = cell_of(to_fixed(latitude, 6), to_fixed(longitude, 6))
+        setattr(model_instance, self.attname, value)
+        return value
+
 
 class Driver(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
@@ -56,6 +100,7 @@ class Job(models.Model):
     job_location = models.CharField(max_length=255)
     job_location_lat = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
     job_location_lng = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    location_cell = GeoCellField('job_location_lat', 'job_location_lng', null=True, blank=True)
     description = models.TextField()
     instructions = models.TextField(blank=True)
     expected_duration = models.IntegerField(help_text="Expected duration in minutes")
@@ -70,6 +115,10 @@ class Job(models.Model):
     
     class Meta:
         ordering = ['-scheduled_start']
+        indexes = [
+            models.Index(fields=['assigned_driver', 'status'], name='job_driver_status_idx'),
+            models.Index(fields=['location_cell'], name='job_location_cell_idx'),
+        ]
 
 
 class Trip(models.Model):
@@ -79,6 +128,13 @@ class Trip(models.Model):
         ('cancelled', 'Cancelled'),
     ]
     
+    METRICS_STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('ready', 'Ready'),
+        ('failed', 'Failed'),
+    ]
+    
     trip_number = models.CharField(max_length=50, unique=True, editable=False)
     job = models.ForeignKey(Job, on_delete=models.CASCADE, related_name='trips')
     driver = models.ForeignKey(Driver, on_delete=models.CASCADE, related_name='trips')
@@ -97,21 +153,19 @@ class Trip(models.Model):
     end_location_lng = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
     
     distance_travelled = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    gps_distance = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, help_text="Kilometres along the GPS trail")
     duration_minutes = models.IntegerField(null=True, blank=True)
     route_compliance = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True)
     is_after_hours = models.BooleanField(default=False)
     
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='started')
+    metrics_status = models.CharField(max_length=20, choices=METRICS_STATUS_CHOICES, blank=True, help_text="Progress of the post-trip metrics calculation")
     notes = models.TextField(blank=True)
     
     def save(self, *args, **kwargs):
         if not self.trip_number:
-            last_trip = Trip.objects.order_by('-id').first()
-            if last_trip and last_trip.trip_number:
-                last_num = int(last_trip.trip_number.split('-')[1])
-                self.trip_number = f"TRIP-{last_num + 1:05d}"
-            else:
-                self.trip_number = "TRIP-00001"
+            number = trip_numbers.next(settings.TRIP_NUMBER_BLOCK_SIZE)
+            self.trip_number = f"TRIP-{number:05d}"
         super().save(*args, **kwargs)
     
     def calculate_metrics(self):
@@ -120,6 +174,11 @@ class Trip(models.Model):
             
             duration = self.end_time - self.start_time
             self.duration_minutes = int(duration.total_seconds() / 60)
+
+            gps_distance = gps_trail_distance(
+                self.gps_points.all(), ArchivedRoute.objects.filter(trip=self).values_list('trip_id', 'data')
+            )
+            self.gps_distance = None if gps_distance is None else Decimal(f"{gps_distance:.2f}")
             
             if self.start_location_lat and self.start_location_lng and self.end_location_lat and self.end_location_lng:
                 start_coords = (float(self.start_location_lat), float(self.start_location_lng))
@@ -128,17 +187,16 @@ class Trip(models.Model):
                 
                 if job_coords:
                     direct_distance = geodesic(start_coords, job_coords).km + geodesic(job_coords, end_coords).km
-                    actual_distance = float(self.distance_travelled)
+                    # Score against the trail actually driven when there is one
+                    actual_distance = float(self.gps_distance or self.distance_travelled)
                     
                     if actual_distance > 0:
                         self.route_compliance = min(Decimal('100'), Decimal(str((direct_distance / actual_distance) * 100)))
             
-            start_hour = self.start_time.time()
-            work_start = time(7, 0)
-            work_end = time(18, 0)
-            self.is_after_hours = start_hour < work_start or start_hour > work_end
+            start_hour = timezone.localtime(self.start_time).time()
+            self.is_after_hours = start_hour < WORK_START or start_hour > WORK_END
             
-            self.save()
+            self.save(update_fields=METRIC_FIELDS)
     
     def get_fuel_consumed(self):
         if self.end_fuel_level:
@@ -151,11 +209,46 @@ class Trip(models.Model):
             return float(self.distance_travelled) / float(fuel_consumed)
         return None
     
+    def get_distance_discrepancy(self):
+        # Percentage by which the odometer reading differs from the GPS trail
+        if self.distance_travelled is not None and self.gps_distance:
+            return round((float(self.distance_travelled) - float(self.gps_distance)) / float(self.gps_distance) * 100, 2)
+        return None
+    
+    def has_distance_discrepancy(self):
+        discrepancy = self.get_distance_discrepancy()
+        return discrepancy is not None and abs(discrepancy) > settings.DISTANCE_DISCREPANCY_PERCENT
+    
     def __str__(self):
         return f"{self.trip_number} - {self.driver.user.get_full_name()}"
     
     class Meta:
         ordering = ['-start_time']
+        indexes = [
+            models.Index(fields=['-start_time', '-id'], name='trip_start_time_idx'),
+            models.Index(fields=['status', '-start_time'], name='trip_status_start_idx'),
+            models.Index(fields=['driver', '-start_time'], name='trip_driver_start_idx'),
+            models.Index(fields=['driver', 'status', '-start_time'], name='trip_driver_status_idx'),
+            models.Index(fields=['vehicle', '-start_time'], name='trip_vehicle_start_idx'),
+            models.Index(
+                fields=['-start_time'], condition=models.Q(is_after_hours=True),
+                name='trip_after_hours_start_idx'
+            ),
+            # Trips the daily rollups do not count yet, which analytics reads live
+            models.Index(
+                fields=['-start_time'],
+                condition=~models.Q(status='completed') | models.Q(metrics_status__in=['pending', 'processing', 'failed']),
+                name='trip_unrolled_start_idx'
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['driver'], condition=models.Q(status='started'), name='one_started_trip_per_driver'
+            ),
+            models.UniqueConstraint(
+                fields=['vehicle'], condition=models.Q(status='started'), name='one_started_trip_per_vehicle'
+            ),
+        ]
 
 
 class TripEvent(models.Model):
@@ -172,7 +265,7 @@ class TripEvent(models.Model):
     
     trip = models.ForeignKey(Trip, on_delete=models.CASCADE, related_name='events')
     event_type = models.CharField(max_length=20, choices=EVENT_TYPES)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    timestamp = models.DateTimeField(default=timezone.now)
     description = models.TextField()
     location_lat = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
     location_lng = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
@@ -183,17 +276,214 @@ class TripEvent(models.Model):
     
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            models.Index(fields=['trip', 'timestamp'], name='tripevent_trip_time_idx'),
+        ]
+
+
+def fixed_point_decimal(field_name, places):
+    # Decimal view of an integer column holding value * 10**places, so
+    # Model(latitude=Decimal(...)) and point.latitude keep working. Hot
+    # paths read and write the integer column directly.
+    def get(self):
+        value = getattr(self, field_name)
+        return None if value is None else Decimal(value).scaleb(-places)
+
+    def set(self, value):
+        setattr(self, field_name, None if value is None else to_fixed(value, places))
+
+    return property(get, set)
 
 
 class GPSRoutePoint(models.Model):
     trip = models.ForeignKey(Trip, on_delete=models.CASCADE, related_name='gps_points')
-    latitude = models.DecimalField(max_digits=9, decimal_places=6)
-    longitude = models.DecimalField(max_digits=9, decimal_places=6)
-    timestamp = models.DateTimeField(auto_now_add=True)
-    speed = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True)
+    latitude_e6 = models.IntegerField(help_text="Latitude in microdegrees")
+    longitude_e6 = models.IntegerField(help_text="Longitude in microdegrees")
+    timestamp = models.DateTimeField(default=timezone.now)
+    speed_e2 = models.IntegerField(null=True, blank=True, help_text="Speed in hundredths of a km/h")
+    device_seq = models.PositiveIntegerField(null=True, blank=True, help_text="Sequence number assigned by the tracker")
+    cell = GeoCellField('latitude_e6', 'longitude_e6', microdegrees=True)
+
+    latitude = fixed_point_decimal('latitude_e6', 6)
+    longitude = fixed_point_decimal('longitude_e6', 6)
+    speed = fixed_point_decimal('speed_e2', 2)
     
     def __str__(self):
         return f"GPS Point for {self.trip.trip_number} at {self.timestamp}"
     
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            models.Index(fields=['trip', 'timestamp'], name='gpspoint_trip_time_idx'),
+            models.Index(fields=['timestamp'], name='gpspoint_time_idx'),
+            models.Index(fields=['cell'], name='gpspoint_cell_idx'),
+        ]
+        # On PostgreSQL the table is partitioned by timestamp, and every
+        # unique key must include it: the primary key there is (id,
+        # timestamp), which the model cannot declare, and this constraint
+        # cannot be narrowed to (trip, device_seq). Ingestion keeps device_seq
+        # unique per trip by locking the trip while it checks and inserts.
+        constraints = [
+            models.UniqueConstraint(fields=['trip', 'device_seq', 'timestamp'], name='unique_gps_point_device_seq'),
+        ]
+
+
+class GPSPartition(models.Model):
+    # One row per calendar month of GPS points. On PostgreSQL each month is a
+    # partition of GPSRoutePoint; elsewhere it is a timestamp range of the
+    # one table. Either way the row tracks what maintenance has done to it.
+    month = models.DateField(primary_key=True, help_text="First day of the month")
+    downsampled_through = models.DateTimeField(null=True, blank=True)
+    dropped_at = models.DateTimeField(null=True, blank=True)
+    dropped_points = models.BigIntegerField(default=0)
+    archive = models.CharField(max_length=500, blank=True, help_text="File the points were archived to")
+
+    def __str__(self):
+        return f"GPS points for {self.month:%Y-%m}"
+
+    class Meta:
+        ordering = ['month']
+
+
+class ArchivedRoute(models.Model):
+    # A completed trip's GPS points packed into one compressed blob (see
+    # encoding.pack_route_archive) in place of their GPSRoutePoint rows. Kept
+    # apart from Trip so trip queries never load it.
+    trip = models.OneToOneField(Trip, on_delete=models.CASCADE, primary_key=True, related_name='archived_route')
+    point_count = models.PositiveIntegerField()
+    data = models.BinaryField()
+    # Bounding box of the points in microdegrees, for area searches
+    min_latitude_e6 = models.IntegerField(null=True, blank=True)
+    max_latitude_e6 = models.IntegerField(null=True, blank=True)
+    min_longitude_e6 = models.IntegerField(null=True, blank=True)
+    max_longitude_e6 = models.IntegerField(null=True, blank=True)
+    archived_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Archived route for {self.trip_id} ({self.point_count} points)"
+
+
+class LivePosition(models.Model):
+    # Last known position of each trip, written on ingestion so the live feed
+    # never has to search GPSRoutePoint for the newest point.
+    trip = models.OneToOneField(Trip, on_delete=models.CASCADE, primary_key=True, related_name='live_position')
+    driver = models.ForeignKey(Driver, on_delete=models.CASCADE, related_name='+')
+    vehicle = models.ForeignKey(Vehicle, on_delete=models.CASCADE, related_name='+')
+    latitude_e6 = models.IntegerField(help_text="Latitude in microdegrees")
+    longitude_e6 = models.IntegerField(help_text="Longitude in microdegrees")
+    speed_e2 = models.IntegerField(null=True, blank=True, help_text="Speed in hundredths of a km/h")
+    cell = GeoCellField('latitude_e6', 'longitude_e6', microdegrees=True)
+    timestamp = models.DateTimeField()
+    is_active = models.BooleanField(default=True)
+    revision = models.BigIntegerField(db_index=True, help_text="Feed revision of the last change")
+
+    latitude = fixed_point_decimal('latitude_e6', 6)
+    longitude = fixed_point_decimal('longitude_e6', 6)
+    speed = fixed_point_decimal('speed_e2', 2)
+
+    def __str__(self):
+        return f"Live position for {self.trip_id} at {self.timestamp}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['cell'], condition=models.Q(is_active=True), name='liveposition_active_cell_idx'),
+            # Each driver's last known position, for dispatch suggestions
+            models.Index(fields=['driver', 'timestamp'], name='liveposition_driver_time_idx'),
+        ]
+
+
+class DailyTripRollup(models.Model):
+    date = models.DateField()
+    driver = models.ForeignKey(Driver, on_delete=models.CASCADE, related_name='daily_rollups')
+    vehicle = models.ForeignKey(Vehicle, on_delete=models.CASCADE, related_name='daily_rollups')
+    trip_count = models.IntegerField(default=0)
+    total_distance = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    total_duration_minutes = models.BigIntegerField(default=0)
+    total_fuel_consumed = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    after_hours_trips = models.IntegerField(default=0)
+    compliance_sum = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    compliance_count = models.IntegerField(default=0)
+    
+    def __str__(self):
+        return f"{self.date} - {self.driver} - {self.vehicle}"
+    
+    class Meta:
+        ordering = ['date']
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'driver', 'vehicle'], name='unique_daily_trip_rollup'),
+        ]
+
+class SequenceManager(models.Manager):
+    def allocate_block(self, name, size):
+        # UPDATE ... SET last_value = last_value + size takes the row lock
+        # before reading, so concurrent allocations can never overlap.
+        with transaction.atomic():
+            if not self.filter(name=name).update(last_value=F('last_value') + size):
+                self.get_or_create(name=name)
+                self.filter(name=name).update(last_value=F('last_value') + size)
+            last_value = self.filter(name=name).values_list('last_value', flat=True).get()
+        return last_value - size + 1
+
+
+class Sequence(models.Model):
+    name = models.CharField(max_length=50, primary_key=True)
+    last_value = models.BigIntegerField(default=0)
+    
+    objects = SequenceManager()
+    
+    def __str__(self):
+        return f"{self.name} = {self.last_value}"
+
+
+trip_numbers = BlockAllocator('trip_number', Sequence.objects.allocate_block)
+
+
+class BackgroundTaskManager(models.Manager):
+    def enqueue(self, name, delay=None, **payload):
+        run_after = timezone.now() + (delay or timedelta())
+        return self.create(name=name, payload=payload, run_after=run_after)
+    
+    def claim(self, worker, lock_timeout):
+        # Claim with a conditional UPDATE so two workers racing for the same
+        # task cannot both win; a task locked for longer than lock_timeout
+        # belongs to a worker that died and is handed out again.
+        now = timezone.now()
+        claimable = Q(status='queued', run_after__lte=now) | Q(status='running', locked_at__lt=now - lock_timeout)
+        for task_id in self.filter(claimable).order_by('run_after', 'id').values_list('id', flat=True)[:10]:
+            claimed = self.filter(claimable, id=task_id).update(
+                status='running', locked_by=worker, locked_at=now, attempts=F('attempts') + 1,
+            )
+            if claimed:
+                return self.get(id=task_id)
+        return None
+
+
+class BackgroundTask(models.Model):
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+    
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    attempts = models.PositiveIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    objects = BackgroundTaskManager()
+    
+    def __str__(self):
+        return f"{self.name} #{self.id} ({self.status})"
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='task_status_run_after_idx'),
+        ]
@@ -0,0 +1,7 @@
+from rest_framework.pagination import CursorPagination
+
+
+class TripCursorPagination(CursorPagination):
+    ordering = ('-start_time', '-id')
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
@@ -0,0 +1,44 @@
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+
+def _render_error(data, renderer_context):
+    # Errors from views whose formats are not JSON are sent as JSON, and
+    # labelled as such rather than with the format's media type
+    response = (renderer_context or {}).get('response')
+    if response is not None:
+        response['Content-Type'] = 'application/json'
+    return JSONRenderer().render(data)
+
+
+class PolylineRenderer(JSONRenderer):
+    media_type = 'application/vnd.fleet.polyline+json'
+    format = 'polyline'
+
+
+class RouteDeltaRenderer(BaseRenderer):
+    media_type = 'application/vnd.fleet.route-delta'
+    format = 'delta'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, bytes):
+            return data
+        return _render_error(data, renderer_context)
+
+
+class StreamingExportRenderer(BaseRenderer):
+    # Exports are written straight to a StreamingHttpResponse; rendering only
+    # happens for error responses
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return _render_error(data, renderer_context)
+
+
+class NDJSONRenderer(StreamingExportRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+
+class CSVRenderer(StreamingExportRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
@@ -0,0 +1,86 @@
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from django.db import IntegrityError, transaction
+from django.db.models import Count, DecimalField, F, Q, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+from .models import Trip, DailyTripRollup
+
+# Completed trips in these metrics states are not in the rollups yet
+UNROLLED_METRICS_STATUSES = ['pending', 'processing', 'failed']
+
+ROLLUP_FIELDS = [
+    'trip_count', 'total_distance', 'total_duration_minutes', 'total_fuel_consumed',
+    'after_hours_trips', 'compliance_sum', 'compliance_count',
+]
+
+
+def local_midnight(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def _trip_values(trip):
+    fuel_consumed = Decimal('0')
+    if trip.end_fuel_level is not None:
+        fuel_consumed = trip.start_fuel_level - trip.end_fuel_level
+    return {
+        'trip_count': 1,
+        'total_distance': trip.distance_travelled or Decimal('0'),
+        'total_duration_minutes': trip.duration_minutes or 0,
+        'total_fuel_consumed': fuel_consumed,
+        'after_hours_trips': int(trip.is_after_hours),
+        'compliance_sum': trip.route_compliance or Decimal('0'),
+        'compliance_count': int(trip.route_compliance is not None),
+    }
+
+
+def record_completed_trip(trip):
+    key = {
+        'date': timezone.localdate(trip.start_time),
+        'driver_id': trip.driver_id,
+        'vehicle_id': trip.vehicle_id,
+    }
+    values = _trip_values(trip)
+    increments = {field: F(field) + value for field, value in values.items()}
+
+    with transaction.atomic():
+        if DailyTripRollup.objects.filter(**key).update(**increments):
+            return
+        try:
+            with transaction.atomic():
+                DailyTripRollup.objects.create(**key, **values)
+                return
+        except IntegrityError:
+            # Another request created the row first; add to it instead
+            pass
+        DailyTripRollup.objects.filter(**key).update(**increments)
+
+
+def _aggregate_day_range(start, end):
+    completed = Trip.objects.filter(
+        status='completed', start_time__gte=local_midnight(start), start_time__lt=local_midnight(end)
+    ).exclude(metrics_status__in=UNROLLED_METRICS_STATUSES).order_by()
+    zero = Value(Decimal('0'), output_field=DecimalField())
+    rows = completed.annotate(date=TruncDate('start_time')).values('date', 'driver_id', 'vehicle_id').annotate(
+        trip_count=Count('id'),
+        total_distance=Coalesce(Sum('distance_travelled'), zero),
+        total_duration_minutes=Coalesce(Sum('duration_minutes'), 0),
+        total_fuel_consumed=Coalesce(Sum(F('start_fuel_level') - F('end_fuel_level')), zero),
+        after_hours_trips=Count('id', filter=Q(is_after_hours=True)),
+        compliance_sum=Coalesce(Sum('route_compliance'), zero),
+        compliance_count=Count('route_compliance'),
+    )
+    return [DailyTripRollup(**row) for row in rows]
+
+
+def rebuild_rollups(start, end, chunk_days=31):
+    # Rebuilds [start, end) one chunk of days per transaction so a backfill
+    # over years of history never holds a long lock or a huge result set.
+    chunk_start = start
+    while chunk_start < end:
+        chunk_end = min(chunk_start + timedelta(days=chunk_days), end)
+        with transaction.atomic():
+            DailyTripRollup.objects.filter(date__gte=chunk_start, date__lt=chunk_end).delete()
+            rollups = DailyTripRollup.objects.bulk_create(_aggregate_day_range(chunk_start, chunk_end))
+        yield chunk_start, chunk_end, len(rollups)
+        chunk_start = chunk_end
@@ -0,0 +1,158 @@
+import heapq
+import numpy as np
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from .encoding import MICRODEGREES, MISSING_SPEED, pack_route_archive, unpack_route_archive
+from .models import ArchivedRoute, GPSRoutePoint, Trip
+
+POINT_FIELDS = ['id', 'latitude_e6', 'longitude_e6', 'timestamp', 'speed_e2', 'device_seq']
+ROW_FIELDS = POINT_FIELDS[:5]
+MISSING_DEVICE_SEQ = -1
+DELETE_CHUNK_SIZE = 2000
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def _epoch_micros(timestamp):
+    delta = timestamp - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def _columns(rows):
+    ids, lats, lngs, times, speeds, seqs = zip(*rows)
+    return [
+        np.array(ids, dtype=np.int64),
+        np.array(lats, dtype=np.int64),
+        np.array(lngs, dtype=np.int64),
+        np.array([_epoch_micros(timestamp) for timestamp in times], dtype=np.int64),
+        np.array([MISSING_SPEED if speed is None else speed for speed in speeds], dtype=np.int64),
+        np.array([MISSING_DEVICE_SEQ if seq is None else seq for seq in seqs], dtype=np.int64),
+    ]
+
+
+def _merge(first, second):
+    order = np.lexsort((np.concatenate([first[0], second[0]]), np.concatenate([first[3], second[3]])))
+    return [np.concatenate([a, b])[order] for a, b in zip(first, second)]
+
+
+def _timestamps(micros):
+    return [EPOCH + timedelta(microseconds=value) for value in micros.tolist()]
+
+
+def _speeds(hundredths, scale):
+    return [None if value == MISSING_SPEED else scale(value) for value in hundredths.tolist()]
+
+
+def archived_columns(trip_id):
+    data = ArchivedRoute.objects.filter(trip_id=trip_id).values_list('data', flat=True).first()
+    return None if data is None else unpack_route_archive(data)
+
+
+def archive_route(trip_id):
+    # Moves the trip's GPSRoutePoint rows into its archived route, merging
+    # them with any points archived before. Returns the number of rows moved.
+    with transaction.atomic():
+        # Two archivers of one trip would each pack the other's rows
+        Trip.objects.select_for_update().filter(id=trip_id).exists()
+        rows = list(GPSRoutePoint.objects.filter(trip_id=trip_id).order_by('timestamp', 'id').values_list(*POINT_FIELDS))
+        if not rows:
+            return 0
+        columns = _columns(rows)
+        archived = archived_columns(trip_id)
+        if archived is not None:
+            columns = _merge(archived, columns)
+        lats, lngs = columns[1], columns[2]
+        ArchivedRoute.objects.update_or_create(trip_id=trip_id, defaults={
+            'point_count': len(columns[0]), 'data': pack_route_archive(columns),
+            'min_latitude_e6': int(lats.min()), 'max_latitude_e6': int(lats.max()),
+            'min_longitude_e6': int(lngs.min()), 'max_longitude_e6': int(lngs.max()),
+        })
+        # By id: a point uploaded meanwhile stays a row and is archived next time
+        ids = [row[0] for row in rows]
+        for offset in range(0, len(ids), DELETE_CHUNK_SIZE):
+            GPSRoutePoint.objects.filter(id__in=ids[offset:offset + DELETE_CHUNK_SIZE]).delete()
+    return len(rows)
+
+
+def archivable_trips():
+    # Completed trips with points still stored as rows, including points
+    # that arrived after the trip was archived
+    return Trip.objects.filter(status='completed').filter(Exists(GPSRoutePoint.objects.filter(trip=OuterRef('pk'))))
+
+
+def _points(trip_id, columns):
+    ids, lats, lngs, micros, speeds, seqs = columns
+    return [
+        GPSRoutePoint(id=point_id, trip_id=trip_id, latitude_e6=lat, longitude_e6=lng, timestamp=timestamp,
+                      speed_e2=speed, device_seq=None if seq == MISSING_DEVICE_SEQ else seq)
+        for point_id, lat, lng, timestamp, speed, seq in zip(
+            ids.tolist(), lats.tolist(), lngs.tolist(), _timestamps(micros), _speeds(speeds, int), seqs.tolist(),
+        )
+    ]
+
+
+def unpacked_points(route):
+    # The points packed in an ArchivedRoute as unsaved GPSRoutePoint instances
+    return _points(route.trip_id, unpack_route_archive(route.data))
+
+
+def archived_points(trip):
+    # Every point of an archived trip as unsaved GPSRoutePoint instances in
+    # time order, including any stored as rows since; None if not archived.
+    columns = archived_columns(trip.id)
+    if columns is None:
+        return None
+    points = _points(trip.id, columns)
+    rows = list(trip.gps_points.all())
+    if rows:
+        points = sorted(points + rows, key=lambda point: (point.timestamp, point.id))
+    return points
+
+
+def _column_rows(columns, chunk_size):
+    # Rows of ROW_FIELDS converted from the packed columns a chunk at a time
+    ids, lats, lngs, micros, speeds, _ = columns
+    for start in range(0, len(ids), chunk_size):
+        end = start + chunk_size
+        yield from zip(
+            ids[start:end].tolist(), lats[start:end].tolist(), lngs[start:end].tolist(),
+            _timestamps(micros[start:end]), _speeds(speeds[start:end], int),
+        )
+
+
+def archived_point_rows(trip, chunk_size):
+    # Every point of an archived trip as a ROW_FIELDS tuple in time order,
+    # read lazily: the archived points straight from their columns, merged
+    # with a chunked query over any stored as rows since. None if not
+    # archived.
+    columns = archived_columns(trip.id)
+    if columns is None:
+        return None
+    rows = trip.gps_points.order_by('timestamp', 'id').values_list(*ROW_FIELDS).iterator(chunk_size=chunk_size)
+    return heapq.merge(_column_rows(columns, chunk_size), rows, key=lambda row: (row[3], row[0]))
+
+
+def trip_points(trip):
+    points = archived_points(trip)
+    return trip.gps_points.all() if points is None else points
+
+
+def archived_route_rows(trip_id):
+    # (latitude, longitude, timestamp, speed) with floats, as routes.route_rows
+    columns = archived_columns(trip_id)
+    if columns is None:
+        return None
+    _, lats, lngs, micros, speeds, _ = columns
+    return list(zip(
+        (lats / MICRODEGREES).tolist(), (lngs / MICRODEGREES).tolist(), _timestamps(micros), _speeds(speeds, lambda value: value / 100),
+    ))
+
+
+def archived_sequences(ranges):
+    # (trip_id, device_seq) pairs already archived, for {trip_id: (low, high)}
+    found = set()
+    for trip_id, data in ArchivedRoute.objects.filter(trip_id__in=ranges).values_list('trip_id', 'data'):
+        low, high = ranges[trip_id]
+        seqs = unpack_route_archive(data)[5]
+        found.update((trip_id, seq) for seq in seqs[(seqs >= low) & (seqs <= high)].tolist())
+    return found
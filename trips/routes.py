@@ -0,0 +1,139 @@
+import csv
+import io
+import json
+from itertools import islice
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.utils import timezone
+from .encoding import MICRODEGREES, format_fixed
+from .route_archive import archived_point_rows, archived_route_rows
+from .simplify import simplify_route, tolerance_for_zoom
+
+ROUTE_CACHE_TIMEOUT = 60 * 60 * 24
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_FIELDS = ['id', 'latitude', 'longitude', 'timestamp', 'speed']
+POINT_COLUMNS = ['id', 'latitude_e6', 'longitude_e6', 'timestamp', 'speed_e2']
+
+
+def _version_key(trip_id):
+    return f'gps_route_version:{trip_id}'
+
+
+def invalidate_route_cache(trip_ids):
+    for trip_id in trip_ids:
+        key = _version_key(trip_id)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, None)
+
+
+def route_rows(trip):
+    # Every consumer of these rows works in floats
+    rows = [
+        (lat / MICRODEGREES, lng / MICRODEGREES, timestamp, None if speed is None else speed / 100)
+        for lat, lng, timestamp, speed in trip.gps_points.values_list('latitude_e6', 'longitude_e6', 'timestamp', 'speed_e2')
+    ]
+    archived = archived_route_rows(trip.id)
+    if archived is None:
+        return rows
+    # Points uploaded after the trip was archived are still rows
+    return sorted(archived + rows, key=lambda row: row[2]) if rows else archived
+
+
+def simplified_route_rows(trip, zoom=None, tolerance=None):
+    # Only completed trips are cached: an active trip's route keeps growing.
+    cache_key = None
+    if trip.status == 'completed':
+        level = f'z{zoom}' if zoom is not None else f't{tolerance:g}'
+        version = cache.get(_version_key(trip.id), 0)
+        cache_key = f'gps_route_simplified:{trip.id}:{version}:{level}'
+        rows = cache.get(cache_key)
+        if rows is not None:
+            return rows
+
+    rows = route_rows(trip)
+    if rows:
+        latitudes = [row[0] for row in rows]
+        longitudes = [row[1] for row in rows]
+        if zoom is not None:
+            tolerance = tolerance_for_zoom(zoom, sum(latitudes) / len(latitudes))
+        rows = [rows[i] for i in simplify_route(latitudes, longitudes, tolerance)]
+
+    if cache_key:
+        cache.set(cache_key, rows, ROUTE_CACHE_TIMEOUT)
+    return rows
+
+
+def _export_row(point_id, lat, lng, timestamp, speed):
+    return (
+        point_id,
+        format_fixed(lat, 6),
+        format_fixed(lng, 6),
+        timezone.localtime(timestamp).isoformat(),
+        None if speed is None else format_fixed(speed, 2),
+    )
+
+
+def _point_rows(trip):
+    rows = archived_point_rows(trip, EXPORT_CHUNK_SIZE)
+    if rows is None:
+        rows = trip.gps_points.values_list(*POINT_COLUMNS).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    return rows
+
+
+def _export_rows(trip):
+    for row in _point_rows(trip):
+        yield _export_row(*row)
+
+
+async def _aexport_rows(trip):
+    # values_list().aiterator() runs its query on the event loop in this
+    # Django, so read the synchronous iterator a chunk at a time in a thread
+    rows = await sync_to_async(_point_rows)(trip)
+    while chunk := await sync_to_async(list)(islice(rows, EXPORT_CHUNK_SIZE)):
+        for row in chunk:
+            yield _export_row(*row)
+
+
+def _line_writer(route_format):
+    # A function turning an export row into one line of the format
+    if route_format == 'ndjson':
+        return lambda row: json.dumps(dict(zip(EXPORT_FIELDS, row))) + '\n'
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def line(row):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow(row)
+        return buffer.getvalue()
+    return line
+
+
+def stream_route(trip, route_format):
+    # The full-resolution route as chunks of CSV or NDJSON, read from the
+    # database a chunk at a time
+    line = _line_writer(route_format)
+    chunk = [line(EXPORT_FIELDS)] if route_format == 'csv' else []
+    for row in _export_rows(trip):
+        chunk.append(line(row))
+        if len(chunk) >= EXPORT_CHUNK_SIZE:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+
+async def astream_route(trip, route_format):
+    # stream_route for ASGI, which would otherwise read a synchronous
+    # iterator to the end in a thread before sending any of it
+    line = _line_writer(route_format)
+    chunk = [line(EXPORT_FIELDS)] if route_format == 'csv' else []
+    async for row in _aexport_rows(trip):
+        chunk.append(line(row))
+        if len(chunk) >= EXPORT_CHUNK_SIZE:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
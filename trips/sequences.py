@@ -0,0 +1,36 @@
+import threading
+from django.db import transaction
+
+
+class BlockAllocator:
+    # Hands out values from a block reserved in the database, so only one
+    # allocation in `block_size` touches the counter row. Values left in a
+    # block when the process exits are skipped, leaving gaps.
+    def __init__(self, name, allocate_block):
+        self.name = name
+        self.allocate_block = allocate_block
+        self.lock = threading.Lock()
+        self.next_value = self.end = 0
+
+    def next(self, block_size):
+        with self.lock:
+            if self.next_value < self.end:
+                value = self.next_value
+                self.next_value += 1
+                return value
+
+        start = self.allocate_block(self.name, block_size)
+        # The rest of the block is only kept once the reservation commits: if
+        # the surrounding transaction rolls back, the counter row is restored
+        # and the same block will be handed out again.
+        transaction.on_commit(lambda: self._keep_block(start + 1, start + block_size))
+        return start
+
+    def _keep_block(self, start, end):
+        with self.lock:
+            if self.next_value >= self.end:
+                self.next_value, self.end = start, end
+
+    def reset(self):
+        with self.lock:
+            self.next_value = self.end = 0
@@ -1,4 +1,5 @@
 from rest_framework import serializers
+from .encoding import format_fixed
 from .models import Driver, Vehicle, Job, Trip, TripEvent, GPSRoutePoint
 
 class DriverSerializer(serializers.ModelSerializer):
@@ -44,7 +45,22 @@ class TripEventSerializer(serializers.ModelSerializer):
         fields = ['id', 'trip', 'event_type', 'timestamp', 'description', 'location_lat', 'location_lng', 'photo']
 
 
+class FixedPointField(serializers.ReadOnlyField):
+    # An integer column scaled by 10**places, written out as the decimal
+    # string the DecimalField it replaced produced
+    def __init__(self, places, **kwargs):
+        self.places = places
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        return format_fixed(value, self.places)
+
+
 class GPSRoutePointSerializer(serializers.ModelSerializer):
+    latitude = FixedPointField(6, source='latitude_e6')
+    longitude = FixedPointField(6, source='longitude_e6')
+    speed = FixedPointField(2, source='speed_e2')
+
     class Meta:
         model = GPSRoutePoint
         fields = ['id', 'latitude', 'longitude', 'timestamp', 'speed']
@@ -55,6 +71,8 @@ class TripSerializer(serializers.ModelSerializer):
     vehicle_name = serializers.SerializerMethodField()
     fuel_consumed = serializers.SerializerMethodField()
     fuel_efficiency = serializers.SerializerMethodField()
+    distance_discrepancy = serializers.SerializerMethodField()
+    has_distance_discrepancy = serializers.SerializerMethodField()
     
     def get_driver_name(self, obj):
         return obj.driver.user.get_full_name()
@@ -68,12 +86,19 @@ class TripSerializer(serializers.ModelSerializer):
     def get_fuel_efficiency(self, obj):
         return obj.get_fuel_efficiency()
     
+    def get_distance_discrepancy(self, obj):
+        return obj.get_distance_discrepancy()
+    
+    def get_has_distance_discrepancy(self, obj):
+        return obj.has_distance_discrepancy()
+    
     class Meta:
         model = Trip
         fields = [
             'id', 'trip_number', 'job', 'driver', 'vehicle', 'driver_name', 'vehicle_name',
             'start_time', 'start_odometer', 'start_fuel_level', 'start_location_lat', 'start_location_lng',
             'end_time', 'end_odometer', 'end_fuel_level', 'end_location_lat', 'end_location_lng',
-            'distance_travelled', 'duration_minutes', 'route_compliance', 'is_after_hours',
-            'fuel_consumed', 'fuel_efficiency', 'status', 'notes'
+            'distance_travelled', 'gps_distance', 'distance_discrepancy', 'has_distance_discrepancy',
+            'duration_minutes', 'route_compliance', 'is_after_hours',
+            'fuel_consumed', 'fuel_efficiency', 'status', 'metrics_status', 'notes'
         ]
@@ -0,0 +1,33 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .caching import invalidate_api_cache
+from .drivers import invalidate_dashboard
+from .models import Driver, Job, Trip, Vehicle
+
+
+@receiver([post_save, post_delete], sender=Trip)
+def trip_changed(sender, instance, **kwargs):
+    invalidate_dashboard(instance.driver_id)
+
+
+@receiver([post_save, post_delete], sender=Job)
+def job_changed(sender, instance, **kwargs):
+    # A job moved to another driver stays on the previous driver's cached
+    # dashboard until it expires; starting it there is refused anyway.
+    invalidate_dashboard(instance.assigned_driver_id)
+    invalidate_api_cache(Job)
+
+
+@receiver([post_save, post_delete], sender=Driver)
+@receiver([post_save, post_delete], sender=Vehicle)
+def reference_data_changed(sender, instance, **kwargs):
+    invalidate_api_cache(sender)
+
+
+@receiver([post_save, post_delete], sender=User)
+def user_changed(sender, instance, update_fields=None, **kwargs):
+    # Every login saves last_login, which no API response shows
+    if update_fields is not None and set(update_fields) == {'last_login'}:
+        return
+    invalidate_api_cache(User)
@@ -0,0 +1,78 @@
+import math
+import numpy as np
+
+EARTH_RADIUS_M = 6371008.8
+METERS_PER_PIXEL_AT_ZOOM_0 = 156543.03392
+MIN_ZOOM = 0
+MAX_ZOOM = 22
+
+
+def tolerance_for_zoom(zoom, latitude):
+    # One screen pixel of a 256px web-mercator tile at this zoom level
+    return METERS_PER_PIXEL_AT_ZOOM_0 * math.cos(math.radians(latitude)) / (2 ** zoom)
+
+
+def project(latitudes, longitudes):
+    lats = np.radians(np.asarray(latitudes, dtype=np.float64))
+    lngs = np.radians(np.asarray(longitudes, dtype=np.float64))
+    scale = math.cos(float(lats.mean())) if lats.size else 1.0
+    return lngs * scale * EARTH_RADIUS_M, lats * EARTH_RADIUS_M
+
+
+def douglas_peucker(x, y, tolerance):
+    # Level-synchronous Douglas-Peucker: every open segment is split in the
+    # same pass, so each pass is a handful of array operations over the
+    # remaining interior points instead of one Python call per segment.
+    n = len(x)
+    if n <= 2:
+        return np.arange(n)
+
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    starts = np.array([0])
+    ends = np.array([n - 1])
+
+    while starts.size:
+        lengths = ends - starts - 1
+        open_segments = lengths > 0
+        starts, ends, lengths = starts[open_segments], ends[open_segments], lengths[open_segments]
+        if not starts.size:
+            break
+
+        ax, ay = x[starts], y[starts]
+        dx, dy = x[ends] - ax, y[ends] - ay
+        norm = np.hypot(dx, dy)
+        closed = norm == 0
+        norm[closed] = 1.0
+
+        bounds = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        segment = np.repeat(np.arange(starts.size), lengths)
+        idx = np.arange(lengths.sum()) - np.repeat(bounds - starts - 1, lengths)
+        px = x[idx] - np.repeat(ax, lengths)
+        py = y[idx] - np.repeat(ay, lengths)
+        distances = np.abs(px * np.repeat(dy, lengths) - py * np.repeat(dx, lengths))
+        distances /= np.repeat(norm, lengths)
+        if closed.any():
+            # Loops that end where they started: fall back to radial distance
+            looped = closed[segment]
+            distances[looped] = np.hypot(px[looped], py[looped])
+
+        max_distances = np.maximum.reduceat(distances, bounds)
+        candidates = np.flatnonzero(distances == max_distances[segment])
+        first = np.concatenate(([True], segment[candidates[1:]] != segment[candidates[:-1]]))
+        split = idx[candidates[first]]
+
+        splitting = max_distances > tolerance
+        split = split[splitting]
+        keep[split] = True
+        starts, ends = (
+            np.concatenate((starts[splitting], split)),
+            np.concatenate((split, ends[splitting])),
+        )
+
+    return np.flatnonzero(keep)
+
+
+def simplify_route(latitudes, longitudes, tolerance):
+    x, y = project(latitudes, longitudes)
+    return douglas_peucker(x, y, tolerance)
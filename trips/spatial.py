@@ -0,0 +1,156 @@
+import math
+import numpy as np
+from datetime import timedelta
+from decimal import Decimal
+from django.db.models import BigIntegerField, F, Q
+from django.db.models.functions import Cast, Round
+from .encoding import MICRODEGREES, unpack_route_archive
+from .geo import EARTH_RADIUS_KM, cell_ranges, haversine_km
+from .models import ArchivedRoute, GPSRoutePoint, Trip
+from .route_archive import EPOCH
+
+# Archived routes are unpacked this many at a time
+ARCHIVE_CHUNK_SIZE = 100
+# The box inscribed in a circle is that enclosing a circle this much smaller
+INSCRIBED_BOX_SCALE = 0.7
+
+
+class Area:
+    # A bounding box in degrees, or the circle of `radius_km` around
+    # `centre` together with the box enclosing it. Boxes do not wrap around
+    # the antimeridian; a circle crossing it is cut off there.
+    def __init__(self, south, west, north, east, centre=None, radius_km=None):
+        self.south, self.west, self.north, self.east = south, west, north, east
+        self.centre = centre
+        self.radius_km = radius_km
+
+    @classmethod
+    def around(cls, latitude, longitude, radius_km):
+        angle = radius_km / EARTH_RADIUS_KM
+        south = max(latitude - math.degrees(angle), -90.0)
+        north = min(latitude + math.degrees(angle), 90.0)
+        # The widest point of a circle on the sphere; one reaching a pole
+        # spans every longitude
+        reach = math.sin(angle) / math.cos(math.radians(latitude)) if abs(latitude) < 90 else 1
+        if north >= 90 or south <= -90 or reach >= 1:
+            west, east = -180.0, 180.0
+        else:
+            spread = math.degrees(math.asin(reach))
+            west, east = max(longitude - spread, -180.0), min(longitude + spread, 180.0)
+        return cls(south, west, north, east, (latitude, longitude), radius_km)
+
+    def inscribed_box(self):
+        # A box wholly inside the circle, so points in it need no measuring;
+        # None when none is worth having, as near the poles
+        inner = Area.around(*self.centre, self.radius_km * INSCRIBED_BOX_SCALE)
+        south, west, north, east = (value / MICRODEGREES for value in inner.bounds_e6())
+        # Along the box's edges distance from the centre peaks at the corners
+        corners = self.distances_km(np.array([south, south, north, north]), np.array([west, east, west, east]))
+        if (corners > self.radius_km).any():
+            return None
+        return Area(inner.south, inner.west, inner.north, inner.east)
+
+    def bounds_e6(self):
+        # (south, west, north, east) in whole microdegrees, rounded outwards
+        return (
+            math.floor(self.south * MICRODEGREES), math.floor(self.west * MICRODEGREES),
+            math.ceil(self.north * MICRODEGREES), math.ceil(self.east * MICRODEGREES),
+        )
+
+    def distances_km(self, latitudes, longitudes):
+        return haversine_km(self.centre[0], self.centre[1], latitudes, longitudes)
+
+    def contains(self, latitudes, longitudes):
+        inside = (latitudes >= self.south) & (latitudes <= self.north) & (longitudes >= self.west) & (longitudes <= self.east)
+        if self.centre is not None:
+            inside &= self.distances_km(latitudes, longitudes) <= self.radius_km
+        return inside
+
+
+def microdegrees(field):
+    # A decimal-degree column read as whole microdegrees; turning Decimals
+    # into integers row by row is slow enough to matter for a few hundred
+    return Cast(Round(F(field) * MICRODEGREES), BigIntegerField())
+
+
+def _cell_field(queryset, name):
+    return queryset.model._meta.get_field(name)
+
+
+def filter_box(queryset, cell_field, area):
+    # The records of `queryset` whose position lies in the area's bounding
+    # box. The ranges of the covering cells let the database use the cell
+    # index; the coordinate bounds then trim the cells' overhang.
+    field = _cell_field(queryset, cell_field)
+    bounds = area.bounds_e6()
+    if not field.microdegrees:
+        bounds = [Decimal(value).scaleb(-6) for value in bounds]
+    south, west, north, east = bounds
+    cells = Q()
+    for start, end in cell_ranges(*area.bounds_e6()):
+        cells |= Q(**{f'{cell_field}__gte': start, f'{cell_field}__lt': end})
+    return queryset.filter(cells, **{
+        f'{field.latitude_field}__gte': south, f'{field.latitude_field}__lte': north,
+        f'{field.longitude_field}__gte': west, f'{field.longitude_field}__lte': east,
+    })
+
+
+def nearby(queryset, cell_field, area, *fields):
+    # (row of `fields`, kilometres from the centre) for every record of
+    # `queryset` within a circular area, nearest first
+    field = _cell_field(queryset, cell_field)
+    rows = list(filter_box(queryset, cell_field, area).values_list(*fields, field.latitude_field, field.longitude_field))
+    if not rows:
+        return []
+    coordinates = np.array([row[-2:] for row in rows], dtype=np.float64)
+    if field.microdegrees:
+        coordinates /= MICRODEGREES
+    distances = area.distances_km(coordinates[:, 0], coordinates[:, 1])
+    return [
+        (rows[index][:-2], float(distances[index]))
+        for index in np.argsort(distances, kind='stable').tolist()
+        if distances[index] <= area.radius_km
+    ]
+
+
+def filter_area(queryset, cell_field, area):
+    if area.centre is None:
+        return filter_box(queryset, cell_field, area)
+    return queryset.filter(pk__in=[row[0] for row, _ in nearby(queryset, cell_field, area, 'pk')])
+
+
+def trips_in(area, since=None):
+    # The trips with a GPS point in the area, counting archived routes, as a
+    # queryset of ids to filter with; points before `since` are not searched
+    points = GPSRoutePoint.objects.order_by()
+    if since is not None:
+        points = points.filter(timestamp__gte=since)
+    # Not DISTINCT: asked for it, SQLite walks the trip index over the whole
+    # table instead of using the cells, while IN needs no unique rows
+    inner = area if area.centre is None else area.inscribed_box()
+    if inner is None:
+        matched = points.none().values('trip_id')
+    else:
+        matched = filter_box(points, 'cell', inner).values('trip_id')
+    trip_ids = set()
+    if area.centre is not None:
+        # Only the points of other trips between the two boxes are measured
+        trip_ids = {row[0] for row, _ in nearby(points.exclude(trip_id__in=matched), 'cell', area, 'trip_id')}
+
+    south, west, north, east = area.bounds_e6()
+    routes = ArchivedRoute.objects.filter(
+        min_latitude_e6__lte=north, max_latitude_e6__gte=south, min_longitude_e6__lte=east, max_longitude_e6__gte=west,
+    ).exclude(trip_id__in=matched)
+    if since is not None:
+        routes = routes.filter(trip__end_time__gte=since)
+    candidates = [trip_id for trip_id in routes.values_list('trip_id', flat=True) if trip_id not in trip_ids]
+    for offset in range(0, len(candidates), ARCHIVE_CHUNK_SIZE):
+        chunk = candidates[offset:offset + ARCHIVE_CHUNK_SIZE]
+        for trip_id, data in ArchivedRoute.objects.filter(trip_id__in=chunk).values_list('trip_id', 'data'):
+            _, lats, lngs, micros, _, _ = unpack_route_archive(data)
+            inside = area.contains(lats / MICRODEGREES, lngs / MICRODEGREES)
+            if since is not None:
+                inside &= micros >= (since - EPOCH) // timedelta(microseconds=1)
+            if inside.any():
+                trip_ids.add(trip_id)
+    return Trip.objects.filter(Q(id__in=matched) | Q(id__in=trip_ids)).values('id')
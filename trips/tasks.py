@@ -0,0 +1,36 @@
+from django.conf import settings
+from django.db import transaction
+from .drivers import invalidate_dashboard
+from .models import Trip
+from .rollups import record_completed_trip
+from .route_archive import archive_route
+from .routes import simplified_route_rows
+from .worker import task
+
+# Zoom levels whose simplified route is computed ahead of the first map view;
+# 14 is what the dashboard asks for.
+PREWARM_ZOOMS = (14,)
+
+
+def _mark_failed(trip_id):
+    Trip.objects.filter(id=trip_id).update(metrics_status='failed')
+    invalidate_dashboard(*Trip.objects.filter(id=trip_id).values_list('driver_id', flat=True))
+
+
+@task('finalize_trip', on_failure=_mark_failed)
+def finalize_trip(trip_id):
+    trip = Trip.objects.select_related('job').get(id=trip_id)
+    if trip.metrics_status != 'ready':
+        Trip.objects.filter(id=trip_id).update(metrics_status='processing')
+        # Metrics, rollups and the status commit together, so a retry after a
+        # failure can never count the trip in the rollups twice.
+        with transaction.atomic():
+            trip.calculate_metrics()
+            record_completed_trip(trip)
+            Trip.objects.filter(id=trip_id).update(metrics_status='ready')
+
+    if settings.ARCHIVE_COMPLETED_ROUTES:
+        archive_route(trip_id)
+    for zoom in PREWARM_ZOOMS:
+        simplified_route_rows(trip, zoom=zoom)
+
@@ -0,0 +1,1278 @@
+import gzip
+import io
+import json
+import os
+import random
+import tempfile
+import threading
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from .models import (
+    ArchivedRoute, BackgroundTask, Driver, Vehicle, Job, Trip, TripEvent, GPSRoutePoint, GPSPartition, DailyTripRollup,
+    LivePosition, Sequence, METRIC_FIELDS, trip_numbers,
+)
+from . import gps_storage, ingestion, live, metrics, routes, transitions, worker
+from .dispatch import Candidates
+from .encoding import decode_polyline, decode_route_delta, encode_polyline, encode_route_delta
+from .geo import cell_of, cell_ranges, haversine_km
+from .geofences import BETWEEN, EDGE, FAR, NEAR, geofence_grid
+from .route_archive import archive_route
+from .spatial import Area
+from .simplify import douglas_peucker, simplify_route, tolerance_for_zoom
+from .tasks import finalize_trip
+from .trail import trail_lengths
+from .rollups import ROLLUP_FIELDS, record_completed_trip
+
+
+TRACKER_TOKEN = 'tracker-token'
+TRACKER_AUTH = {'HTTP_AUTHORIZATION': f'Bearer {TRACKER_TOKEN}'}
+
+
+def make_driver(username):
+    user = User.objects.create_user(username=username, first_name=username.title(), last_name='Driver')
+    return Driver.objects.create(user=user, phone='+27 000 000 000', license_number=f'DL-{username}')
+
+
+def make_vehicle(registration):
+    return Vehicle.objects.create(
+        name=f'Vehicle {registration}',
+        registration_number=registration,
+        vehicle_type='bakkie',
+        fuel_capacity=Decimal('80.00'),
+        current_odometer=Decimal('1000.00'),
+    )
+
+
+def make_job(job_number, driver, vehicle, status='assigned'):
+    return Job.objects.create(
+        job_number=job_number,
+        customer_name='Customer',
+        customer_phone='+27 000 000 000',
+        job_location='Sandton',
+        job_location_lat=Decimal('-26.107600'),
+        job_location_lng=Decimal('28.056700'),
+        description='Delivery',
+        expected_duration=60,
+        scheduled_start=timezone.now(),
+        assigned_driver=driver,
+        assigned_vehicle=vehicle,
+        status=status,
+    )
+
+
+def make_trip(job, status='completed'):
+    return Trip.objects.create(
+        job=job,
+        driver=job.assigned_driver,
+        vehicle=job.assigned_vehicle,
+        start_odometer=Decimal('1000.00'),
+        start_fuel_level=Decimal('60.00'),
+        start_location_lat=Decimal('-26.204100'),
+        start_location_lng=Decimal('28.047300'),
+        status=status,
+    )
+
+
+class APIQueryCountTests(TestCase):
+    # Each list endpoint must issue the same number of queries no matter how
+    # many rows are on the page.
+    def add_rows(self, count):
+        offset = Driver.objects.count()
+        for i in range(offset, offset + count):
+            driver = make_driver(f'driver{i}')
+            vehicle = make_vehicle(f'REG-{i}')
+            trip = make_trip(make_job(f'JOB-{i}', driver, vehicle))
+            TripEvent.objects.create(trip=trip, event_type='other', description='Event')
+            GPSRoutePoint.objects.create(trip=trip, latitude=Decimal('-26.1'), longitude=Decimal('28.0'))
+
+    def assertConstantQueries(self, url, expected):
+        # Counts the uncached response; see APIResponseCacheTests
+        self.add_rows(2)
+        cache.clear()
+        with CaptureQueriesContext(connection) as small_page:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+        self.add_rows(20)
+        cache.clear()
+        with CaptureQueriesContext(connection) as large_page:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(len(small_page), expected)
+        self.assertEqual(len(large_page), expected)
+
+    def test_drivers(self):
+        self.assertConstantQueries('/api/drivers/', 2)
+
+    def test_vehicles(self):
+        self.assertConstantQueries('/api/vehicles/', 2)
+
+    def test_jobs(self):
+        self.assertConstantQueries('/api/jobs/', 2)
+
+    def test_trips(self):
+        # Cursor pagination: no COUNT(*) query
+        self.assertConstantQueries('/api/trips/', 1)
+
+    def test_trip_events(self):
+        self.assertConstantQueries('/api/trip-events/', 2)
+
+    def test_trip_detail(self):
+        self.add_rows(1)
+        trip = Trip.objects.get()
+        with self.assertNumQueries(1):
+            self.client.get(f'/api/trips/{trip.id}/')
+
+
+class APIResponseCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.driver = make_driver('john')
+        self.vehicle = make_vehicle('REG-1')
+        self.job = make_job('JOB-1', self.driver, self.vehicle)
+
+    def test_repeat_request_is_served_from_cache(self):
+        first = self.client.get('/api/jobs/')
+        with self.assertNumQueries(0):
+            second = self.client.get('/api/jobs/')
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(second['ETag'], first['ETag'])
+
+    def test_matching_etag_returns_not_modified(self):
+        etag = self.client.get('/api/vehicles/')['ETag']
+        response = self.client.get('/api/vehicles/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], etag)
+
+    def test_saving_a_model_invalidates_dependent_endpoints(self):
+        job_etag = self.client.get('/api/jobs/')['ETag']
+        driver_etag = self.client.get('/api/drivers/')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.vehicle.name = 'Renamed'
+            self.vehicle.save()
+
+        response = self.client.get('/api/jobs/', HTTP_IF_NONE_MATCH=job_etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][0]['vehicle_name'], 'Renamed')
+        # The drivers endpoint does not show vehicles
+        response = self.client.get('/api/drivers/', HTTP_IF_NONE_MATCH=driver_etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_ending_a_trip_invalidates_the_job(self):
+        trip = make_trip(self.job, status='started')
+        etag = self.client.get(f'/api/jobs/{self.job.id}/')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            transitions.end_trip(self.driver.id, trip.id, Decimal('1100.00'), Decimal('40.00'))
+
+        response = self.client.get(f'/api/jobs/{self.job.id}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], 'completed')
+
+
+class TripListTests(TestCase):
+    def setUp(self):
+        self.driver = make_driver('john')
+        self.vehicle = make_vehicle('REG-1')
+        self.trips = [make_trip(make_job(f'JOB-{i}', self.driver, self.vehicle)) for i in range(5)]
+        other = make_driver('sarah')
+        self.other_trip = make_trip(make_job('JOB-OTHER', other, make_vehicle('REG-2')), status='started')
+
+    def test_cursor_pagination_walks_every_trip_once(self):
+        seen = []
+        url = '/api/trips/?page_size=2'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen.extend(trip['id'] for trip in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(sorted(seen), sorted(t.id for t in self.trips + [self.other_trip]))
+        self.assertEqual(len(seen), len(set(seen)))
+
+    def test_filters(self):
+        response = self.client.get(f'/api/trips/?driver={self.driver.id}&status=completed')
+        self.assertEqual({t['id'] for t in response.data['results']}, {t.id for t in self.trips})
+
+        response = self.client.get('/api/trips/?status=started')
+        self.assertEqual([t['id'] for t in response.data['results']], [self.other_trip.id])
+
+        Trip.objects.filter(id=self.trips[0].id).update(is_after_hours=True)
+        response = self.client.get('/api/trips/?is_after_hours=true')
+        self.assertEqual([t['id'] for t in response.data['results']], [self.trips[0].id])
+
+        response = self.client.get('/api/trips/?start_time__gte=2000-01-01T00:00:00&start_time__lt=2001-01-01T00:00:00')
+        self.assertEqual(response.data['results'], [])
+
+    def test_invalid_filters(self):
+        response = self.client.get('/api/trips/?status=lost&driver=x&start_time__gte=yesterday')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.data), {'status', 'driver', 'start_time__gte'})
+
+    def test_impossible_dates_are_rejected(self):
+        response = self.client.get('/api/trips/?start_time__gte=2026-13-45T00:00:00&start_time__lt=2026-02-30T10:00:00')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.data), {'start_time__gte', 'start_time__lt'})
+
+
+class AnalyticsTests(TestCase):
+    def setUp(self):
+        self.john = make_driver('john')
+        self.sarah = make_driver('sarah')
+        vehicle = make_vehicle('REG-1')
+        for i, (driver, distance, after_hours) in enumerate([
+            (self.john, '10.00', False), (self.john, '30.00', True), (self.sarah, '5.00', False),
+        ]):
+            trip = make_trip(make_job(f'JOB-{i}', driver, vehicle))
+            Trip.objects.filter(id=trip.id).update(
+                distance_travelled=Decimal(distance), duration_minutes=30,
+                end_fuel_level=Decimal('55.00'), route_compliance=Decimal('80.00'),
+                is_after_hours=after_hours,
+            )
+            record_completed_trip(Trip.objects.get(id=trip.id))
+        make_trip(make_job('JOB-ACTIVE', self.sarah, vehicle), status='started')
+
+    def test_summary(self):
+        response = self.client.get('/api/analytics/summary/')
+        self.assertEqual(response.data['trip_count'], 4)
+        self.assertEqual(response.data['active_trips'], 1)
+        self.assertEqual(response.data['total_distance'], 45.0)
+        self.assertEqual(response.data['total_fuel_consumed'], 15.0)
+        self.assertEqual(response.data['after_hours_ratio'], round(1 / 3, 4))
+
+    def test_driver_rollup(self):
+        # One query over the rollups, one over the trips they do not count yet
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/analytics/drivers/')
+        rows = {row['driver_name']: row for row in response.data}
+        self.assertEqual(rows['John Driver']['completed_trips'], 2)
+        self.assertEqual(rows['John Driver']['average_distance'], 20.0)
+        self.assertEqual(rows['Sarah Driver']['trip_count'], 2)
+        self.assertEqual(rows['Sarah Driver']['after_hours_trips'], 0)
+
+    def test_trips_awaiting_finalization_are_counted(self):
+        trip = Trip.objects.get(status='started')
+        transitions.end_trip(self.sarah.id, trip.id, Decimal('1010.00'), Decimal('55.00'))
+        summary = self.client.get('/api/analytics/summary/').data
+        self.assertEqual((summary['trip_count'], summary['completed_trips'], summary['active_trips']), (4, 4, 0))
+        rows = {row['driver_name']: row for row in self.client.get('/api/analytics/drivers/').data}
+        self.assertEqual((rows['Sarah Driver']['trip_count'], rows['Sarah Driver']['completed_trips']), (2, 2))
+
+        Trip.objects.filter(id=trip.id).update(metrics_status='failed')
+        self.assertEqual(self.client.get('/api/analytics/summary/').data['trip_count'], 4)
+        Trip.objects.filter(id=trip.id).update(metrics_status='pending')
+        worker.run_pending()
+        summary = self.client.get('/api/analytics/summary/').data
+        self.assertEqual((summary['trip_count'], summary['total_distance']), (4, 55.0))
+
+    def test_rollups_match_trip_scan(self):
+        from_rollups = self.client.get('/api/analytics/drivers/').data
+        # A status filter cannot be answered from the rollups
+        from_trips = self.client.get('/api/analytics/drivers/?status=completed').data
+        self.assertEqual(
+            [(r['driver_name'], r['total_distance'], r['average_route_compliance']) for r in from_rollups],
+            [(r['driver_name'], r['total_distance'], r['average_route_compliance']) for r in from_trips],
+        )
+
+    def test_rebuild_command_restores_rollups(self):
+        expected = list(DailyTripRollup.objects.values_list(*ROLLUP_FIELDS))
+        DailyTripRollup.objects.all().delete()
+        call_command('rebuild_trip_rollups', stdout=io.StringIO())
+        self.assertEqual(list(DailyTripRollup.objects.values_list(*ROLLUP_FIELDS)), expected)
+
+    def test_daily_rollup_respects_time_filters(self):
+        response = self.client.get('/api/analytics/daily/')
+        self.assertEqual(sum(row['trip_count'] for row in response.data), 4)
+        response = self.client.get('/api/analytics/daily/?start_time__lt=2000-01-01T00:00:00')
+        self.assertEqual(response.data, [])
+
+    def test_impossible_dates_are_rejected(self):
+        for endpoint in ('summary', 'drivers', 'vehicles', 'daily'):
+            response = self.client.get(f'/api/analytics/{endpoint}/?start_time__gte=2026-13-45T00:00:00')
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(set(response.data), {'start_time__gte'})
+
+
+class TripTransitionTests(TestCase):
+    def setUp(self):
+        self.driver = make_driver('john')
+        self.driver.user.set_password('secret')
+        self.driver.user.save()
+        self.vehicle = make_vehicle('REG-1')
+        self.job = make_job('JOB-1', self.driver, self.vehicle)
+        self.client.login(username='john', password='secret')
+
+    def start(self, job):
+        return self.client.post(f'/start-trip/{job.id}/', {'start_odometer': '1000', 'start_fuel_level': '60'})
+
+    def test_repeated_start_creates_one_trip(self):
+        self.start(self.job)
+        self.start(self.job)
+        self.start(make_job('JOB-2', self.driver, self.vehicle))
+        trip = Trip.objects.get()
+        self.assertEqual(trip.status, 'started')
+        self.assertEqual(Job.objects.get(id=self.job.id).status, 'in_progress')
+
+    def test_database_allows_one_started_trip_per_driver_and_vehicle(self):
+        make_trip(self.job, status='started')
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            make_trip(make_job('JOB-2', self.driver, make_vehicle('REG-2')), status='started')
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            make_trip(make_job('JOB-3', make_driver('sarah'), self.vehicle), status='started')
+        make_trip(make_job('JOB-4', self.driver, self.vehicle))
+
+    def test_start_errors_name_their_cause(self):
+        sarah = make_driver('sarah')
+        with self.assertRaises(transitions.TripNotFound):
+            transitions.start_trip(sarah.id, self.job.id, Decimal('1000'), Decimal('60'))
+        with self.assertRaises(transitions.TripNotFound):
+            transitions.end_trip(sarah.id, make_trip(self.job).id, Decimal('1010'), Decimal('55'))
+        make_trip(make_job('JOB-2', sarah, self.vehicle), status='started')
+        with self.assertRaisesMessage(transitions.TripTransitionError, 'This vehicle is already on another trip.'):
+            transitions.start_trip(self.driver.id, self.job.id, Decimal('1000'), Decimal('60'))
+
+        # A clash on anything but a started trip is not reported as one
+        Trip.objects.filter(driver=sarah).update(status='completed')
+        trip_numbers.reset()
+        taken = make_trip(make_job('JOB-3', sarah, self.vehicle))
+        number = int(taken.trip_number.split('-')[1]) + settings.TRIP_NUMBER_BLOCK_SIZE
+        Trip.objects.filter(id=taken.id).update(trip_number=f'TRIP-{number:05d}')
+        with self.assertRaises(IntegrityError):
+            transitions.start_trip(self.driver.id, self.job.id, Decimal('1000'), Decimal('60'))
+
+    def test_end_trip_queues_finalization_once(self):
+        self.start(self.job)
+        trip = Trip.objects.get()
+        data = {'end_odometer': '1042.50', 'end_fuel_level': '50'}
+        self.client.post(f'/end-trip/{trip.id}/', data)
+        self.client.post(f'/end-trip/{trip.id}/', data)
+
+        trip.refresh_from_db()
+        self.assertEqual((trip.status, trip.metrics_status), ('completed', 'pending'))
+        self.assertEqual(Job.objects.get(id=self.job.id).status, 'completed')
+        self.assertEqual(Vehicle.objects.get(id=self.vehicle.id).current_odometer, Decimal('1042.50'))
+        self.assertEqual(BackgroundTask.objects.filter(name='finalize_trip').count(), 1)
+
+
+class RouteEncodingTests(SimpleTestCase):
+    def test_polyline_round_trip(self):
+        # The example from Google's description of the format
+        coordinates = [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]
+        self.assertEqual(encode_polyline(coordinates), '_p~iF~ps|U_ulLnnqC_mqNvxq`@')
+        self.assertEqual(decode_polyline('_p~iF~ps|U_ulLnnqC_mqNvxq`@'), coordinates)
+        self.assertEqual(decode_polyline(encode_polyline([])), [])
+
+        rng = random.Random(1)
+        coordinates = [(rng.uniform(-90, 90), rng.uniform(-180, 180)) for _ in range(500)]
+        for precision in (5, 6):
+            decoded = decode_polyline(encode_polyline(coordinates, precision), precision)
+            self.assertEqual(len(decoded), len(coordinates))
+            for original, value in zip(coordinates, decoded):
+                for expected, actual in zip(original, value):
+                    self.assertAlmostEqual(actual, expected, delta=0.5 / 10 ** precision + 1e-9)
+
+    def test_route_delta_round_trip(self):
+        start = datetime(2026, 1, 5, 8, 0, tzinfo=dt_timezone.utc)
+        rows = [
+            (Decimal('-26.204100'), Decimal('28.047300'), start, Decimal('0.00')),
+            (Decimal('-26.204099'), Decimal('28.047351'), start + timedelta(milliseconds=1500), None),
+            (Decimal('-25.900000'), Decimal('27.500000'), start + timedelta(hours=2), Decimal('120.55')),
+            (Decimal('-90.000000'), Decimal('180.000000'), start + timedelta(hours=2), Decimal('999.99')),
+        ]
+        self.assertEqual(decode_route_delta(encode_route_delta(rows)), [
+            (float(lat), float(lng), round(timestamp.timestamp() * 1000), None if speed is None else float(speed))
+            for lat, lng, timestamp, speed in rows
+        ])
+        self.assertEqual(decode_route_delta(encode_route_delta([])), [])
+        with self.assertRaises(ValueError):
+            decode_route_delta(b'XXXX' + encode_route_delta(rows)[4:])
+
+
+class RouteSimplificationTests(SimpleTestCase):
+    def assertDroppedWithin(self, x, y, kept, tolerance):
+        # Every dropped point lies within `tolerance` of the line through
+        # the kept points either side of it
+        for a, b in zip(kept[:-1], kept[1:]):
+            if b - a < 2:
+                continue
+            dx, dy = x[b] - x[a], y[b] - y[a]
+            px, py = x[a + 1:b] - x[a], y[a + 1:b] - y[a]
+            norm = np.hypot(dx, dy)
+            distances = np.hypot(px, py) if norm == 0 else np.abs(px * dy - py * dx) / norm
+            self.assertLessEqual(distances.max(), tolerance + 1e-9)
+
+    def test_dropped_points_stay_within_tolerance(self):
+        rng = np.random.default_rng(1)
+        x, y = np.cumsum(rng.normal(size=5000)) * 10, np.cumsum(rng.normal(size=5000)) * 10
+        self.assertEqual(len(douglas_peucker(x, y, 0)), 5000)
+        previous = None
+        for tolerance in (1, 5, 25, 100, 1000):
+            kept = douglas_peucker(x, y, tolerance)
+            self.assertEqual((kept[0], kept[-1]), (0, 4999))
+            self.assertTrue(np.all(np.diff(kept) > 0))
+            self.assertDroppedWithin(x, y, kept, tolerance)
+            # A coarser tolerance only ever drops more points
+            if previous is not None:
+                self.assertLessEqual(set(kept.tolist()), set(previous.tolist()))
+            previous = kept
+
+    def test_short_straight_and_looped_routes(self):
+        self.assertEqual(douglas_peucker(np.zeros(1), np.zeros(1), 1).tolist(), [0])
+        self.assertEqual(douglas_peucker(np.zeros(2), np.zeros(2), 1).tolist(), [0, 1])
+        self.assertEqual(douglas_peucker(np.arange(10.0), np.arange(10.0) * 2, 0.001).tolist(), [0, 9])
+        # A loop back to its start keeps the point furthest from it
+        angles = np.linspace(0, 2 * np.pi, 101)
+        x, y = np.cos(angles) * 100, np.sin(angles) * 100
+        x[-1], y[-1] = x[0], y[0]
+        kept = douglas_peucker(x, y, 10)
+        self.assertIn(50, kept.tolist())
+        self.assertDroppedWithin(x, y, kept, 10)
+
+    def test_zoom_tolerance(self):
+        self.assertAlmostEqual(tolerance_for_zoom(0, 0), 156543.03392)
+        self.assertAlmostEqual(tolerance_for_zoom(1, 60), 156543.03392 / 4)
+        # A 1 km zig-zag disappears at zoom 0 and survives at street level
+        latitudes = [-26.2, -26.19, -26.2, -26.19, -26.2]
+        longitudes = [28.0, 28.01, 28.02, 28.03, 28.04]
+        self.assertEqual(simplify_route(latitudes, longitudes, tolerance_for_zoom(0, -26.2)).tolist(), [0, 4])
+        self.assertEqual(len(simplify_route(latitudes, longitudes, tolerance_for_zoom(16, -26.2))), 5)
+
+
+class TrailLengthTests(SimpleTestCase):
+    def test_lengths_per_trip(self):
+        # Trip 1 heads north 0.01 degrees a minute, with one fix thrown
+        # a degree off; trip 2 has a single fix; trip 3 two close ones
+        latitudes = [-26.0 + 0.01 * i for i in range(6)]
+        latitudes[3] += 1
+        trip_ids = np.array([1] * 6 + [2] + [3, 3])
+        latitudes = np.array(latitudes + [-26.0, -26.0, -26.001])
+        longitudes = np.array([28.0] * 9)
+        seconds = np.array([60.0 * i for i in range(6)] + [0.0, 0.0, 30.0])
+
+        ids, totals = trail_lengths(trip_ids, latitudes, longitudes, seconds)
+        self.assertEqual(ids.tolist(), [1, 3])
+        self.assertAlmostEqual(totals[0], float(haversine_km(-26.0, 28.0, -25.95, 28.0)))
+        self.assertAlmostEqual(totals[1], float(haversine_km(-26.0, 28.0, -26.001, 28.0)))
+
+    def test_length_is_the_sum_of_the_legs(self):
+        rng = np.random.default_rng(1)
+        latitudes = -26.2 + np.cumsum(rng.uniform(-0.0005, 0.0005, 1000))
+        longitudes = 28.0 + np.cumsum(rng.uniform(-0.0005, 0.0005, 1000))
+        seconds = np.arange(1000) * 5.0
+        _, totals = trail_lengths(np.ones(1000, dtype=np.int64), latitudes, longitudes, seconds)
+        legs = haversine_km(latitudes[:-1], longitudes[:-1], latitudes[1:], longitudes[1:])
+        self.assertAlmostEqual(totals[0], legs.sum())
+        # Measuring two trips at once gives each the same length
+        _, both = trail_lengths(np.r_[np.ones(1000), np.full(1000, 2)].astype(np.int64),
+                                np.r_[latitudes, latitudes], np.r_[longitudes, longitudes], np.r_[seconds, seconds])
+        self.assertTrue(np.allclose(both, totals[0]))
+
+
+class TripMetricsTests(TestCase):
+    def setUp(self):
+        driver, vehicle = make_driver('john'), make_vehicle('REG-1')
+        start = timezone.now().replace(hour=10) - timedelta(days=1)
+        for i in range(5):
+            trip = make_trip(make_job(f'JOB-{i}', driver, vehicle))
+            trip.start_time = start + timedelta(hours=i)
+            trip.end_time = trip.start_time + timedelta(minutes=40 + i)
+            trip.end_odometer = Decimal('1020.00') + i
+            trip.end_location_lat, trip.end_location_lng = Decimal('-26.150000'), Decimal('28.060000')
+            trip.save()
+            # Trip 0 has no trail and trip 1 a single fix
+            GPSRoutePoint.objects.bulk_create([
+                GPSRoutePoint(trip=trip, latitude=Decimal('-26.204100') + Decimal(n * (i + 1)) / 10000,
+                              longitude=Decimal('28.047300'), timestamp=trip.start_time + timedelta(seconds=30 * n))
+                for n in range(min(i * 50, 1 if i == 1 else 200))
+            ])
+        archive_route(trip.id)
+
+    def test_batch_matches_single_trip_metrics(self):
+        for trip in Trip.objects.select_related('job'):
+            trip.calculate_metrics()
+        expected = {trip[0]: trip[1:] for trip in Trip.objects.values_list('id', *METRIC_FIELDS)}
+        self.assertEqual(sum(distance is not None for _, distance, *_ in expected.values()), 3)
+        Trip.objects.update(distance_travelled=None, gps_distance=None, duration_minutes=None, route_compliance=None)
+
+        self.addCleanup(setattr, metrics, 'TRAIL_BATCH_SIZE', metrics.TRAIL_BATCH_SIZE)
+        metrics.TRAIL_BATCH_SIZE = 2
+        self.assertEqual(list(metrics.recompute_trip_metrics(chunk_size=3, gps=True)), [(3, 3), (2, 2)])
+        self.assertEqual({trip[0]: trip[1:] for trip in Trip.objects.values_list('id', *METRIC_FIELDS)}, expected)
+
+
+class WorkerRetryTests(TestCase):
+    def register(self, name, function, on_failure=None):
+        worker.task(name, on_failure)(function)
+        self.addCleanup(worker._handlers.pop, name)
+
+    def make_due(self, task):
+        BackgroundTask.objects.filter(id=task.id).update(run_after=timezone.now())
+
+    def test_failing_task_backs_off_then_fails(self):
+        failures = []
+        self.register('tests.broken', lambda **payload: 1 / 0, lambda **payload: failures.append(payload))
+        task = BackgroundTask.objects.enqueue('tests.broken', trip_id=7)
+        for attempt in range(1, worker.MAX_ATTEMPTS + 1):
+            before = timezone.now()
+            self.assertEqual(worker.run_pending(limit=1), 1)
+            task.refresh_from_db()
+            self.assertEqual(task.attempts, attempt)
+            self.assertIn('ZeroDivisionError', task.last_error)
+            if attempt < worker.MAX_ATTEMPTS:
+                # 30 s, 1 min, 2 min, 4 min
+                self.assertEqual(task.status, 'queued')
+                delay = worker.RETRY_DELAY * 2 ** (attempt - 1)
+                self.assertTrue(before + delay <= task.run_after <= timezone.now() + delay)
+                self.assertEqual(worker.run_pending(), 0)
+                self.make_due(task)
+        self.assertEqual(task.status, 'failed')
+        self.assertIsNotNone(task.finished_at)
+        self.assertEqual(failures, [{'trip_id': 7}])
+
+    def test_retry_succeeds_and_stale_locks_are_reclaimed(self):
+        calls = []
+
+        def flaky():
+            calls.append(1)
+            if len(calls) == 1:
+                raise RuntimeError('Temporary failure')
+        self.register('tests.flaky', flaky)
+        task = BackgroundTask.objects.enqueue('tests.flaky')
+        worker.run_pending()
+        self.make_due(task)
+        worker.run_pending()
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.attempts, task.last_error), ('done', 2, ''))
+
+        # Claimed by a worker that died mid-task
+        stale = BackgroundTask.objects.enqueue('tests.flaky')
+        BackgroundTask.objects.filter(id=stale.id).update(
+            status='running', locked_by='dead', locked_at=timezone.now() - worker.LOCK_TIMEOUT - timedelta(minutes=1),
+            attempts=1,
+        )
+        self.assertEqual(worker.run_pending(), 1)
+        stale.refresh_from_db()
+        self.assertEqual((stale.status, stale.attempts, stale.locked_by), ('done', 2, ''))
+
+
+@override_settings(GPS_INGEST_TOKENS=[TRACKER_TOKEN])
+class GPSIngestionTests(TestCase):
+    def setUp(self):
+        self.trip = make_trip(make_job('JOB-1', make_driver('john'), make_vehicle('REG-1')), status='started')
+
+    def post_points(self, points, trip=None, auth=TRACKER_AUTH):
+        url = '/api/trips/gps-points/' if trip is None else f'/api/trips/{trip.id}/gps-points/'
+        return self.client.post(url, {'points': points}, content_type='application/json', **auth)
+
+    def test_points_are_stored(self):
+        response = self.post_points([
+            {'latitude': -26.2041, 'longitude': 28.0473, 'speed': 42.5, 'timestamp': '2026-01-05T08:00:00Z'},
+            {'latitude': '-26.2042', 'longitude': '28.0474'},
+        ], self.trip)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json(), {'created': 2, 'duplicates': 0})
+        first, second = self.trip.gps_points.order_by('id')
+        self.assertEqual((first.latitude, first.longitude, first.speed),
+                         (Decimal('-26.204100'), Decimal('28.047300'), Decimal('42.50')))
+        self.assertEqual((second.latitude, second.speed), (Decimal('-26.204200'), None))
+
+    def test_invalid_points_are_reported(self):
+        valid = {'latitude': -26.0, 'longitude': 28.0}
+        for point, field in [
+            ({'latitude': 91, 'longitude': 28.0}, 'latitude'),
+            ({'latitude': -26.0, 'longitude': 'east'}, 'longitude'),
+            ({'latitude': -26.0, 'longitude': 28.0, 'speed': -1}, 'speed'),
+            ({'latitude': -26.0, 'longitude': 28.0, 'timestamp': 'yesterday'}, 'timestamp'),
+            ({'latitude': -26.0, 'longitude': 28.0, 'timestamp': '2026-13-45T00:00:00Z'}, 'timestamp'),
+            ({'longitude': 28.0}, 'latitude'),
+            ({'latitude': -26.0}, 'longitude'),
+            ('-26.0,28.0', 'non_field_errors'),
+        ]:
+            response = self.post_points([valid, point], self.trip)
+            self.assertEqual(response.status_code, 400, point)
+            body = response.json()
+            self.assertEqual({index: list(errors) for index, errors in body['points'].items()}, {'1': [field]}, point)
+            self.assertEqual(body['non_field_errors'], ['1 of the submitted points are invalid.'])
+        response = self.post_points([{'latitude': -91, 'longitude': 181}], self.trip)
+        self.assertEqual(response.json()['points']['0'], {
+            'latitude': ['A number between -90 and 90 is required.'],
+            'longitude': ['A number between -180 and 180 is required.'],
+        })
+        self.assertFalse(GPSRoutePoint.objects.exists())
+
+    def test_batch_size_is_limited(self):
+        self.addCleanup(setattr, ingestion, 'MAX_POINTS_PER_REQUEST', ingestion.MAX_POINTS_PER_REQUEST)
+        ingestion.MAX_POINTS_PER_REQUEST = 2
+        point = {'latitude': -26.0, 'longitude': 28.0}
+        for points in [[point] * 3, [], point]:
+            response = self.post_points(points, self.trip)
+            self.assertEqual(response.status_code, 400, points)
+            self.assertEqual(list(response.json()), ['points'])
+        self.assertEqual(self.post_points([point] * 2, self.trip).json()['created'], 2)
+
+    def test_trip_must_accept_points(self):
+        point = {'latitude': -26.0, 'longitude': 28.0}
+        # Trackers upload what they buffered after the trip has ended
+        completed = make_trip(make_job('JOB-2', make_driver('sarah'), make_vehicle('REG-2')))
+        self.assertEqual(self.post_points([point], completed).status_code, 201)
+        Trip.objects.filter(id=self.trip.id).update(status='cancelled')
+        response = self.post_points([point], self.trip)
+        self.assertEqual((response.status_code, list(response.json())), (400, ['trip']))
+        self.assertEqual(self.client.post('/api/trips/0/gps-points/', {'points': [point]},
+                                          content_type='application/json', **TRACKER_AUTH).status_code, 404)
+        self.assertEqual(GPSRoutePoint.objects.count(), 1)
+
+    def test_fleet_batch_spans_trips(self):
+        other = make_trip(make_job('JOB-2', make_driver('sarah'), make_vehicle('REG-2')), status='started')
+        response = self.post_points([
+            {'trip': self.trip.id, 'latitude': -26.0, 'longitude': 28.0},
+            {'trip': other.id, 'latitude': -26.1, 'longitude': 28.1},
+            {'trip': other.id, 'latitude': -26.2, 'longitude': 28.2},
+        ])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json(), {'created': 3, 'duplicates': 0, 'trips': {str(self.trip.id): 1, str(other.id): 2}})
+
+        cancelled = make_trip(make_job('JOB-3', make_driver('thabo'), make_vehicle('REG-3')), status='cancelled')
+        response = self.post_points([
+            {'trip': self.trip.id, 'latitude': -26.0, 'longitude': 28.0},
+            {'trip': cancelled.id, 'latitude': -26.0, 'longitude': 28.0},
+            {'trip': 0, 'latitude': -26.0, 'longitude': 28.0},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['points'], {
+            '1': {'trip': ['Unknown or cancelled trip.']}, '2': {'trip': ['Unknown or cancelled trip.']},
+        })
+        self.assertEqual(GPSRoutePoint.objects.count(), 3)
+
+    def test_fleet_points_need_an_integer_trip_id(self):
+        for trip in [[self.trip.id], {'id': self.trip.id}, True, str(self.trip.id)]:
+            response = self.post_points([{'trip': trip, 'latitude': -26.0, 'longitude': 28.0}])
+            self.assertEqual(response.status_code, 400, trip)
+            self.assertEqual(list(response.json()['points']['0']), ['trip'], trip)
+
+    def test_repeated_device_seq_is_skipped(self):
+        points = [
+            {'latitude': -26.0, 'longitude': 28.0, 'device_seq': 1},
+            {'latitude': -26.1, 'longitude': 28.1, 'device_seq': 2},
+            {'latitude': -26.2, 'longitude': 28.2, 'device_seq': 1},
+        ]
+        self.assertEqual(self.post_points(points, self.trip).json(), {'created': 2, 'duplicates': 1})
+        # A retried batch stores nothing new
+        self.assertEqual(self.post_points(points, self.trip).json(), {'created': 0, 'duplicates': 3})
+        points.append({'latitude': -26.3, 'longitude': 28.3, 'device_seq': 3})
+        self.assertEqual(self.post_points(points, self.trip).json(), {'created': 1, 'duplicates': 3})
+        self.assertEqual(sorted(self.trip.gps_points.values_list('device_seq', flat=True)), [1, 2, 3])
+        self.assertEqual(self.trip.gps_points.get(device_seq=1).latitude, Decimal('-26.000000'))
+
+    def test_device_seq_is_per_trip(self):
+        other = make_trip(make_job('JOB-2', make_driver('sarah'), make_vehicle('REG-2')), status='started')
+        response = self.post_points([
+            {'trip': self.trip.id, 'latitude': -26.0, 'longitude': 28.0, 'device_seq': 1},
+            {'trip': other.id, 'latitude': -26.0, 'longitude': 28.0, 'device_seq': 1},
+        ])
+        self.assertEqual(response.json()['created'], 2)
+
+    def test_points_without_device_seq_are_always_stored(self):
+        points = [{'latitude': -26.0, 'longitude': 28.0, 'timestamp': '2026-01-05T08:00:00Z'}] * 2
+        self.assertEqual(self.post_points(points, self.trip).json(), {'created': 2, 'duplicates': 0})
+        self.assertEqual(self.post_points(points, self.trip).json(), {'created': 2, 'duplicates': 0})
+        self.assertEqual(self.trip.gps_points.filter(device_seq__isnull=True).count(), 4)
+
+    def test_device_timestamps_are_stored(self):
+        self.post_points([
+            {'latitude': -26.0, 'longitude': 28.0, 'timestamp': '2026-01-05T08:00:00+02:00', 'device_seq': 1},
+            {'latitude': -26.0, 'longitude': 28.0, 'timestamp': '2026-01-05T08:00:00', 'device_seq': 2},
+            {'latitude': -26.0, 'longitude': 28.0, 'device_seq': 3},
+        ], self.trip)
+        stored = dict(self.trip.gps_points.values_list('device_seq', 'timestamp'))
+        # Naive device times are taken as UTC, not the server's time zone
+        self.assertEqual(stored[1], datetime(2026, 1, 5, 6, tzinfo=dt_timezone.utc))
+        self.assertEqual(stored[2], datetime(2026, 1, 5, 8, tzinfo=dt_timezone.utc))
+        self.assertLess(abs(stored[3] - timezone.now()), timedelta(minutes=1))
+
+    def test_tracker_token_is_required(self):
+        point = {'trip': self.trip.id, 'latitude': -26.0, 'longitude': 28.0}
+        for auth in [{}, {'HTTP_AUTHORIZATION': 'Bearer wrong-token'}, {'HTTP_AUTHORIZATION': TRACKER_TOKEN}]:
+            for trip in [self.trip, None]:
+                response = self.post_points([point], trip, auth=auth)
+                self.assertEqual((response.status_code, response['WWW-Authenticate']), (401, 'Bearer'), auth)
+        with override_settings(GPS_INGEST_TOKENS=[]):
+            self.assertEqual(self.post_points([point], self.trip).status_code, 401)
+        self.assertFalse(GPSRoutePoint.objects.exists())
+
+
+@override_settings(GPS_INGEST_TOKENS=[TRACKER_TOKEN])
+class LivePositionTests(TestCase):
+    def setUp(self):
+        self.driver = make_driver('john')
+        self.vehicle = make_vehicle('REG-1')
+        self.job = make_job('JOB-1', self.driver, self.vehicle)
+        self.trip = make_trip(self.job, status='started')
+        self.client.post(f'/api/trips/{self.trip.id}/gps-points/', {'points': [
+            {'latitude': -26.2, 'longitude': 28.0, 'timestamp': '2026-01-05T08:00:05Z'},
+            {'latitude': -26.1, 'longitude': 28.1, 'timestamp': '2026-01-05T08:00:10Z'},
+        ]}, content_type='application/json', **TRACKER_AUTH)
+
+    def post_points(self, points):
+        return self.client.post('/api/trips/gps-points/', points, content_type='application/json', **TRACKER_AUTH)
+
+    def test_snapshot_shows_latest_point_of_each_active_trip(self):
+        feed = self.client.get('/api/live-positions/').json()
+        self.assertEqual(len(feed['positions']), 1)
+        position = feed['positions'][0]
+        self.assertEqual((position['trip'], position['vehicle']), (self.trip.id, self.vehicle.id))
+        self.assertEqual((position['latitude'], position['longitude']), (-26.1, 28.1))
+
+    def test_late_points_do_not_move_the_vehicle_back(self):
+        revision = self.client.get('/api/live-positions/').json()['revision']
+        self.post_points([{'trip': self.trip.id, 'latitude': -26.3, 'longitude': 28.3, 'timestamp': '2026-01-05T08:00:00Z'}])
+        feed = self.client.get(f'/api/live-positions/?since={revision}').json()
+        # Nothing moved, so no revision was taken either
+        self.assertEqual(feed, {'revision': revision, 'positions': []})
+        self.assertEqual(LivePosition.objects.get().latitude, Decimal('-26.100000'))
+
+    def test_deltas_include_moved_and_ended_trips(self):
+        other = make_trip(make_job('JOB-2', make_driver('sarah'), make_vehicle('REG-2')), status='started')
+        revision = self.client.get('/api/live-positions/').json()['revision']
+        self.post_points([{'trip': other.id, 'latitude': -26.0, 'longitude': 28.0}])
+        transitions.end_trip(self.driver.id, self.trip.id, Decimal('1010.00'), Decimal('55.00'))
+
+        feed = self.client.get(f'/api/live-positions/?since={revision}&wait=1').json()
+        self.assertEqual([(p['trip'], p['active']) for p in feed['positions']], [(other.id, True), (self.trip.id, False)])
+        later = self.client.get(f"/api/live-positions/?since={feed['revision']}").json()
+        self.assertEqual(later['positions'], [])
+        self.assertEqual([p['trip'] for p in self.client.get('/api/live-positions/').json()['positions']], [other.id])
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.client.get('/api/live-positions/?since=-1').status_code, 400)
+        self.assertEqual(self.client.get('/api/live-positions/?since=0&wait=600').status_code, 400)
+        self.assertEqual(self.client.get('/api/trips/gps-points/').status_code, 405)
+        self.assertEqual(self.post_points('{"points": [').status_code, 400)
+
+    async def test_stream_served_over_asgi_starts_with_a_snapshot(self):
+        response = await self.async_client.get('/api/live-positions/stream/')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = aiter(response.streaming_content)
+        event = (await anext(events)).decode()
+        self.assertTrue(event.startswith('id: '))
+        self.assertIn('event: snapshot', event)
+        self.assertIn(f'"trip":{self.trip.id}', event.replace(' ', ''))
+        await events.aclose()
+
+    async def test_stream_ends_after_its_lifetime(self):
+        self.addCleanup(setattr, live, 'STREAM_LIFETIME', live.STREAM_LIFETIME)
+        live.STREAM_LIFETIME = 0.5
+        response = await self.async_client.get('/api/live-positions/stream/')
+        events = [event.decode() async for event in response.streaming_content]
+        self.assertIn('event: snapshot', events[0])
+        self.assertEqual(events[1:], [live.KEEPALIVE_EVENT])
+
+    def test_resumed_stream_ends_after_its_lifetime(self):
+        self.addCleanup(setattr, live, 'STREAM_LIFETIME', live.STREAM_LIFETIME)
+        live.STREAM_LIFETIME = 0.5
+        response = self.client.get('/api/live-positions/stream/', HTTP_LAST_EVENT_ID='0')
+        events = [event.decode() for event in response.streaming_content]
+        self.assertIn('event: positions', events[0])
+        self.assertEqual(events[1:], [live.KEEPALIVE_EVENT])
+
+
+class GPSStorageTests(TestCase):
+    def setUp(self):
+        self.trip = make_trip(make_job('JOB-1', make_driver('john'), make_vehicle('REG-1')))
+        self.hour = timezone.now().replace(minute=0, second=0, microsecond=0)
+
+    def add_points(self, start, count, seconds=5):
+        GPSRoutePoint.objects.bulk_create([
+            GPSRoutePoint(trip=self.trip, latitude=Decimal('-26.2'), longitude=Decimal('28.0') + Decimal(i) / 10000,
+                          timestamp=start + timedelta(seconds=seconds * i))
+            for i in range(count)
+        ])
+
+    def manage_storage(self, *args):
+        call_command('manage_gps_storage', *args, stdout=io.StringIO())
+
+    def test_downsamples_old_points_once(self):
+        old_start = self.hour - timedelta(days=40)
+        self.add_points(old_start, 120)
+        self.add_points(self.hour - timedelta(days=1), 120)
+
+        self.manage_storage('--downsample-after', '30', '--resolution', '60', '--retain-months', '24')
+        old = GPSRoutePoint.objects.filter(timestamp__lt=self.hour - timedelta(days=30))
+        expected = [old_start + timedelta(minutes=m) for m in range(10)] + [old_start + timedelta(seconds=595)]
+        self.assertEqual(list(old.values_list('timestamp', flat=True)), expected)
+        self.assertEqual(GPSRoutePoint.objects.count(), 11 + 120)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.manage_storage('--downsample-after', '30', '--resolution', '10', '--retain-months', '24')
+        self.assertEqual(GPSRoutePoint.objects.count(), 11 + 120)
+        self.assertFalse([q for q in queries if q['sql'].startswith('DELETE')])
+
+    def test_expired_months_are_archived_and_dropped(self):
+        this_month = gps_storage.month_of(timezone.localdate())
+        expired = gps_storage.add_months(this_month, -14)
+        self.add_points(gps_storage.month_range(expired)[0] + timedelta(days=3), 10)
+        self.add_points(self.hour - timedelta(days=1), 10, seconds=60)
+        archive_dir = tempfile.mkdtemp()
+
+        self.manage_storage('--skip-downsample', '--retain-months', '12', '--archive-dir', archive_dir)
+        self.assertEqual(GPSRoutePoint.objects.count(), 10)
+        partition = GPSPartition.objects.get(month=expired)
+        self.assertEqual(partition.dropped_points, 10)
+        self.assertEqual(partition.archive, os.path.join(archive_dir, f'gps_points_{expired:%Y_%m}.csv.gz'))
+        with gzip.open(partition.archive, 'rt') as archive:
+            self.assertEqual(len(archive.readlines()), 11)
+        months = GPSPartition.objects.filter(dropped_at__isnull=True).values_list('month', flat=True)
+        self.assertEqual(list(months), [gps_storage.add_months(this_month, n) for n in range(-12, 3)])
+
+
+@override_settings(GPS_INGEST_TOKENS=[TRACKER_TOKEN])
+class RouteArchiveTests(TestCase):
+    ROUTE_FORMATS = ['json', 'polyline', 'delta', 'csv', 'ndjson']
+
+    def setUp(self):
+        self.trip = make_trip(make_job('JOB-1', make_driver('john'), make_vehicle('REG-1')))
+        self.trip.end_time = timezone.now()
+        self.trip.end_odometer = Decimal('1020.00')
+        self.start = timezone.now().replace(microsecond=123456) - timedelta(hours=1)
+        GPSRoutePoint.objects.bulk_create([
+            GPSRoutePoint(trip=self.trip, latitude=Decimal('-26.204100') + Decimal(i) / 100000,
+                          longitude=Decimal('28.047300') - Decimal(i % 7) / 1000000,
+                          timestamp=self.start + timedelta(seconds=5 * i, microseconds=i),
+                          speed=None if i % 10 == 0 else Decimal('42.35'), device_seq=i if i % 3 else None)
+            for i in range(200)
+        ])
+
+    def route(self, route_format, query=''):
+        response = self.client.get(f'/api/trips/{self.trip.id}/gps-route/?format={route_format}{query}')
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content) if response.streaming else response.content
+
+    def routes(self):
+        return [self.route(route_format) for route_format in self.ROUTE_FORMATS] + [self.route('json', '&zoom=14')]
+
+    def test_route_output_format(self):
+        first, second = self.client.get(f'/api/trips/{self.trip.id}/gps-route/').json()[:2]
+        self.assertEqual((first['latitude'], first['longitude'], first['speed']), ('-26.204100', '28.047300', None))
+        self.assertEqual((second['latitude'], second['longitude'], second['speed']), ('-26.204090', '28.047299', '42.35'))
+        csv_lines = self.route('csv').decode().splitlines()
+        self.assertEqual(csv_lines[2].split(',')[1:3], ['-26.204090', '28.047299'])
+        self.assertEqual(csv_lines[2].split(',')[-1], '42.35')
+
+    def test_route_errors_are_json(self):
+        for url, status in [('/api/trips/0/gps-route/?format=delta', 404),
+                            ('/api/trips/0/gps-route/?format=csv', 404),
+                            ('/api/trips/0/gps-route/?format=ndjson', 404),
+                            (f'/api/trips/{self.trip.id}/gps-route/?format=delta&zoom=x', 400)]:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status)
+            self.assertEqual(response['Content-Type'], 'application/json')
+            self.assertIn('detail' if status == 404 else 'zoom', response.json())
+
+    async def test_export_streamed_over_asgi(self):
+        self.addCleanup(setattr, routes, 'EXPORT_CHUNK_SIZE', routes.EXPORT_CHUNK_SIZE)
+        routes.EXPORT_CHUNK_SIZE = 64
+        for route_format in ['csv', 'ndjson']:
+            response = await self.async_client.get(f'/api/trips/{self.trip.id}/gps-route/?format={route_format}')
+            self.assertTrue(response.is_async)
+            chunks = [chunk async for chunk in response.streaming_content]
+            lines = b''.join(chunks).decode().splitlines()
+            self.assertEqual(len(lines), 200 + (route_format == 'csv'))
+            self.assertEqual(len(chunks), 4)
+            expected = await sync_to_async(self.route)(route_format)
+            self.assertEqual(b''.join(chunks), expected)
+
+    async def test_archived_export_streamed_over_asgi(self):
+        self.addCleanup(setattr, routes, 'EXPORT_CHUNK_SIZE', routes.EXPORT_CHUNK_SIZE)
+        routes.EXPORT_CHUNK_SIZE = 64
+        expected = await sync_to_async(self.route)('ndjson')
+        await sync_to_async(archive_route)(self.trip.id)
+        # A point stored as a row after archiving, between archived ones
+        await GPSRoutePoint.objects.acreate(trip=self.trip, latitude_e6=-26000000, longitude_e6=28000000,
+                                            timestamp=self.start + timedelta(seconds=7))
+        response = await self.async_client.get(f'/api/trips/{self.trip.id}/gps-route/?format=ndjson')
+        lines = b''.join([chunk async for chunk in response.streaming_content]).splitlines()
+        self.assertEqual(json.loads(lines[2])['latitude'], '-26.000000')
+        self.assertEqual(lines[:2] + lines[3:], expected.splitlines())
+
+    def test_archived_route_is_served_unchanged(self):
+        expected = self.routes()
+        self.trip.calculate_metrics()
+        gps_distance = self.trip.gps_distance
+        self.assertIsNotNone(gps_distance)
+
+        self.assertEqual(archive_route(self.trip.id), 200)
+        self.assertFalse(GPSRoutePoint.objects.exists())
+        self.assertEqual(ArchivedRoute.objects.get().point_count, 200)
+        cache.clear()
+        self.assertEqual(self.routes(), expected)
+        self.trip.calculate_metrics()
+        self.assertEqual(self.trip.gps_distance, gps_distance)
+
+    def test_points_uploaded_after_archiving(self):
+        self.csv_before_archiving = self.route('csv').decode().splitlines()
+        archive_route(self.trip.id)
+        response = self.client.post(f'/api/trips/{self.trip.id}/gps-points/', {'points': [
+            {'latitude': -26.1, 'longitude': 28.1, 'timestamp': (self.start - timedelta(minutes=1)).isoformat()},
+            {'latitude': -26.3, 'longitude': 28.3, 'device_seq': 5},
+        ]}, content_type='application/json', **TRACKER_AUTH)
+        self.assertEqual(response.json(), {'created': 1, 'duplicates': 1})
+
+        route = self.client.get(f'/api/trips/{self.trip.id}/gps-route/').json()
+        self.assertEqual((len(route), route[0]['latitude']), (201, '-26.100000'))
+        csv_lines = self.route('csv').decode().splitlines()
+        self.assertEqual((len(csv_lines), csv_lines[1].split(',')[1]), (202, '-26.100000'))
+        self.assertEqual(csv_lines[2:], self.csv_before_archiving[1:])
+        call_command('archive_trip_routes', stdout=io.StringIO())
+        self.assertFalse(GPSRoutePoint.objects.exists())
+        self.assertEqual(self.client.get(f'/api/trips/{self.trip.id}/gps-route/').json(), route)
+
+    @override_settings(ARCHIVE_COMPLETED_ROUTES=True)
+    def test_finalization_archives_the_route(self):
+        self.trip.save()
+        finalize_trip(self.trip.id)
+        self.assertEqual(Trip.objects.get().metrics_status, 'ready')
+        self.assertFalse(GPSRoutePoint.objects.exists())
+        self.assertEqual(ArchivedRoute.objects.get().point_count, 200)
+
+
+@override_settings(GPS_INGEST_TOKENS=[TRACKER_TOKEN])
+class SpatialIndexTests(TestCase):
+    def setUp(self):
+        self.driver = make_driver('john')
+        self.vehicle = make_vehicle('REG-1')
+        self.job = make_job('JOB-1', self.driver, self.vehicle)
+
+    def add_trip(self, latitude, longitude, count=20):
+        trip = make_trip(self.job)
+        GPSRoutePoint.objects.bulk_create([
+            GPSRoutePoint(trip=trip, latitude=Decimal(latitude) + Decimal(i) / 10000, longitude=Decimal(longitude),
+                          timestamp=timezone.now() + timedelta(seconds=i))
+            for i in range(count)
+        ])
+        return trip
+
+    def trip_ids(self, query):
+        response = self.client.get(f'/api/trips/?{query}')
+        self.assertEqual(response.status_code, 200)
+        return sorted(trip['id'] for trip in response.json()['results'])
+
+    def test_cells_cover_every_point_in_the_box(self):
+        for south, west, north, east in [(-26.3, 27.9, -26.0, 28.2), (-0.001, -0.001, 0.001, 0.001), (-90, -180, 90, 180)]:
+            ranges = cell_ranges(round(south * 1e6), round(west * 1e6), round(north * 1e6), round(east * 1e6))
+            self.assertLessEqual(len(ranges), 16)
+            for step in range(11):
+                lat = round((south + (north - south) * step / 10) * 1e6)
+                lng = round((west + (east - west) * (10 - step) / 10) * 1e6)
+                self.assertTrue(any(start <= cell_of(lat, lng) < end for start, end in ranges))
+
+    def test_trips_filtered_by_area(self):
+        sandton = self.add_trip('-26.1076', '28.0567')
+        soweto = self.add_trip('-26.2485', '27.8540')
+        archived = self.add_trip('-26.1100', '28.0600')
+        archive_route(archived.id)
+        self.assertEqual(GPSRoutePoint.objects.filter(cell__isnull=True).count(), 0)
+
+        self.assertEqual(self.trip_ids('bbox=-26.12,28.0,-26.09,28.1'), [sandton.id, archived.id])
+        self.assertEqual(self.trip_ids('near=-26.2485,27.8540&radius=1'), [soweto.id])
+        self.assertEqual(self.trip_ids('near=-26.1076,28.0567&radius=0.05'), [sandton.id])
+        self.assertEqual(self.trip_ids('near=-26.1076,28.0567&radius=30'), [sandton.id, soweto.id, archived.id])
+        self.assertEqual(self.trip_ids('bbox=-26.12,28.0,-26.09,28.1&status=started'), [])
+        summary = self.client.get('/api/analytics/summary/?near=-26.2485,27.8540&radius=1').json()
+        self.assertEqual(summary['trip_count'], 1)
+
+        for query in ['bbox=1,2,3', 'bbox=-26,28,-27,29', 'near=-26.1,28.0', 'near=-26.1,28.0&radius=900',
+                      'radius=5', 'bbox=-26.12,28.0,-26.09,28.1&near=-26.1,28.0&radius=1']:
+            self.assertEqual(self.client.get(f'/api/trips/?{query}').status_code, 400, query)
+
+    def test_circle_measures_points_outside_its_inscribed_box(self):
+        centre = self.add_trip('-26.3000', '28.2000', count=1)
+        ring = self.add_trip('-26.2920', '28.2000', count=1)
+        corner = self.add_trip('-26.2930', '28.2085', count=1)
+        self.assertIsNotNone(GPSRoutePoint.objects.get(trip=corner).cell)
+        self.assertEqual(self.trip_ids('near=-26.3,28.2&radius=1'), [centre.id, ring.id])
+        self.assertEqual(self.trip_ids('bbox=-26.31,28.19,-26.29,28.21'), [centre.id, ring.id, corner.id])
+        # Too near the pole for an inscribed box, so every point is measured
+        self.assertEqual(self.trip_ids('near=89.99,0&radius=5'), [])
+
+    def test_jobs_filtered_by_area(self):
+        far = make_job('JOB-2', self.driver, self.vehicle)
+        far.job_location_lat, far.job_location_lng = Decimal('-33.924900'), Decimal('18.424100')
+        far.save()
+        unplaced = make_job('JOB-3', self.driver, self.vehicle)
+        Job.objects.filter(id=unplaced.id).update(job_location_lat=None, job_location_lng=None, location_cell=None)
+
+        def job_numbers(query):
+            return sorted(job['job_number'] for job in self.client.get(f'/api/jobs/?{query}').json()['results'])
+
+        self.assertEqual(job_numbers('near=-33.92,18.42&radius=5'), ['JOB-2'])
+        self.assertEqual(job_numbers('bbox=-26.2,28.0,-26.0,28.1'), ['JOB-1'])
+        self.assertEqual(job_numbers(''), ['JOB-1', 'JOB-2', 'JOB-3'])
+
+    def test_nearest_live_positions(self):
+        trips = []
+        for n, (lat, lng) in enumerate([(-26.30, 28.00), (-26.11, 28.06), (-26.20, 28.04), (-33.90, 18.40)]):
+            driver, vehicle = make_driver(f'driver{n}'), make_vehicle(f'LIVE-{n}')
+            trip = make_trip(make_job(f'LIVE-JOB-{n}', driver, vehicle), status='started')
+            self.client.post(f'/api/trips/{trip.id}/gps-points/', {'points': [
+                {'latitude': lat, 'longitude': lng},
+            ]}, content_type='application/json', **TRACKER_AUTH)
+            trips.append(trip)
+        transitions.end_trip(trips[2].driver_id, trips[2].id, Decimal('1010.00'), Decimal('55.00'))
+
+        response = self.client.get('/api/live-positions/nearest/?latitude=-26.2041&longitude=28.0473&limit=2')
+        positions = response.json()['positions']
+        self.assertEqual([p['trip'] for p in positions], [trips[1].id, trips[0].id])
+        self.assertEqual(positions[0]['distance_km'], 10.54)
+        # The ended trip is left out, and Cape Town is beyond the search limit
+        everything = self.client.get('/api/live-positions/nearest/?latitude=-26.2041&longitude=28.0473').json()
+        self.assertEqual([p['trip'] for p in everything['positions']], [trips[1].id, trips[0].id])
+
+        for query in ['latitude=-26.2', 'latitude=95&longitude=28', 'latitude=-26.2&longitude=28&limit=0']:
+            self.assertEqual(self.client.get(f'/api/live-positions/nearest/?{query}').status_code, 400, query)
+
+
+@override_settings(GPS_INGEST_TOKENS=[TRACKER_TOKEN])
+class GeofenceTests(TestCase):
+    # The job is at -26.1076, 28.0567; 0.0009 degrees of latitude is 100 m
+    def setUp(self):
+        self.trip = make_trip(make_job('JOB-1', make_driver('john'), make_vehicle('REG-1')), status='started')
+        self.start = timezone.now().replace(microsecond=0) - timedelta(minutes=30)
+
+    def post(self, *offsets, first=0):
+        points = [
+            {'latitude': round(-26.1076 + offset, 6), 'longitude': 28.0567,
+             'timestamp': (self.start + timedelta(minutes=first + n)).isoformat()}
+            for n, offset in enumerate(offsets)
+        ]
+        response = self.client.post(f'/api/trips/{self.trip.id}/gps-points/', {'points': points},
+                                    content_type='application/json', **TRACKER_AUTH)
+        self.assertEqual(response.status_code, 201)
+
+    def events(self):
+        return [
+            (event_type, timestamp - self.start)
+            for event_type, timestamp in self.trip.events.values_list('event_type', 'timestamp')
+        ]
+
+    def test_grid_agrees_with_exact_distances(self):
+        grid = geofence_grid(-26107600, 28056700, 100, 200)
+        self.assertEqual(set(grid.values()), {NEAR, BETWEEN, EDGE})
+        for n in range(2000):
+            lat_e6 = -26107600 + (n * 7919) % 5000 - 2500
+            lng_e6 = 28056700 + (n * 104729) % 5000 - 2500
+            metres = haversine_km(-26.1076, 28.0567, lat_e6 / 1e6, lng_e6 / 1e6) * 1000
+            place = grid.get(cell_of(lat_e6, lng_e6) >> 12, FAR)
+            if place == NEAR:
+                self.assertLessEqual(metres, 100)
+            elif place == BETWEEN:
+                self.assertTrue(100 < metres <= 200)
+            elif place == FAR:
+                self.assertGreater(metres, 200)
+
+    def test_arrival_and_departure_are_detected(self):
+        # 1 km out, 150 m (not yet arrived), 50 m, then jitter at 150 m
+        self.post(0.009, 0.00135, 0.00045, 0.00135)
+        self.assertEqual(self.events(), [('arrival', timedelta(minutes=2))])
+        # Back to 60 m, then 500 m away, then far off
+        self.post(0.00054, 0.0045, 0.009, first=4)
+        self.assertEqual(self.events(), [('arrival', timedelta(minutes=2)), ('departure', timedelta(minutes=5))])
+        event = self.trip.events.get(event_type='departure')
+        self.assertEqual((event.location_lat, event.location_lng), (Decimal('-26.103100'), Decimal('28.056700')))
+
+    def test_logged_arrival_and_late_points(self):
+        TripEvent.objects.create(trip=self.trip, event_type='arrival', timestamp=self.start + timedelta(minutes=10),
+                                 description='Arrived')
+        # Still on site, and a late point from before the logged arrival
+        self.post(0.0001, first=11)
+        self.post(0.009, first=5)
+        self.assertEqual(self.events(), [('arrival', timedelta(minutes=10))])
+        self.post(0.0045, first=12)
+        self.assertEqual(self.events()[-1], ('departure', timedelta(minutes=12)))
+
+    @override_settings(GEOFENCE_EVENTS=False)
+    def test_detection_can_be_turned_off(self):
+        self.post(0.009, 0.0001)
+        self.assertEqual(self.events(), [])
+
+
+class DispatchTests(TestCase):
+    # Pending jobs are at -26.1076, 28.0567; 0.09 degrees of latitude is 10 km
+    def setUp(self):
+        self.job = make_job('PENDING-1', None, None, status='pending')
+
+    def position(self, driver, offset, vehicle=None, minutes_ago=0):
+        name = f'{driver.user.username}-{minutes_ago}'
+        vehicle = vehicle or make_vehicle(f'REG-{name}')
+        trip = make_trip(make_job(f'JOB-{name}', driver, vehicle, status='completed'))
+        return LivePosition.objects.create(
+            trip=trip, driver=driver, vehicle=vehicle, latitude_e6=-26107600 + round(offset * 1e6), longitude_e6=28056700,
+            timestamp=timezone.now() - timedelta(minutes=minutes_ago), is_active=False, revision=1,
+        )
+
+    def suggestions(self, query=''):
+        response = self.client.get(f'/api/jobs/dispatch-suggestions/?{query}')
+        self.assertEqual(response.status_code, 200)
+        return response.json()['jobs']
+
+    def test_drivers_ranked_by_distance_and_workload(self):
+        near, mid, far, idle = (make_driver(name) for name in ['near', 'mid', 'far', 'idle'])
+        self.position(near, 0.018)
+        make_job('QUEUED-1', near, None)
+        # Only the latest position counts
+        self.position(mid, 0, minutes_ago=60)
+        self.position(mid, 0.09)
+        self.position(far, 0.27)
+        idle.is_active = False
+        idle.save()
+        self.position(idle, 0)
+
+        jobs = self.suggestions('limit=5')
+        self.assertEqual([job['job'] for job in jobs], [self.job.id])
+        suggestions = jobs[0]['suggestions']
+        # 15 minutes' drive, 45 minutes' drive, and 3 minutes' drive after an hour's job
+        self.assertEqual([s['driver'] for s in suggestions], [mid.id, far.id, near.id])
+        self.assertEqual(
+            [(s['travel_minutes'], s['queued_jobs'], s['estimated_start_minutes'], s['estimated_finish_minutes'])
+             for s in suggestions],
+            [(15, 0, 15, 75), (45, 0, 45, 105), (3, 1, 63, 123)],
+        )
+        self.assertEqual(suggestions[0]['distance_km'], round(float(haversine_km(-26.1076, 28.0567, -26.0176, 28.0567)), 3))
+        self.assertEqual(suggestions[0]['vehicle_registration'], 'REG-mid-0')
+        self.assertEqual(suggestions[0]['driver_name'], 'Mid Driver')
+        self.assertEqual(len(self.suggestions()[0]['suggestions']), 3)
+        self.assertEqual(len(self.suggestions('limit=1')[0]['suggestions']), 1)
+
+    def test_unavailable_drivers_and_job_filters(self):
+        # Another driver has started a trip in the vehicle this one last used
+        driver, other = make_driver('driver'), make_driver('other')
+        position = self.position(driver, 0.009)
+        make_trip(make_job('TAKEN', other, position.vehicle), status='started')
+        self.assertEqual(self.suggestions()[0]['suggestions'], [])
+
+        self.position(other, 0.009)
+        cape_town = make_job('PENDING-2', None, None, status='pending')
+        cape_town.job_location_lat, cape_town.job_location_lng = Decimal('-33.924900'), Decimal('18.424100')
+        cape_town.save()
+        unplaced = make_job('PENDING-3', None, None, status='pending')
+        Job.objects.filter(id=unplaced.id).update(job_location_lat=None, job_location_lng=None, location_cell=None)
+
+        jobs = {job['job_number']: job['suggestions'] for job in self.suggestions()}
+        # Cape Town is beyond the distance limit; assigned and unplaced jobs are left out
+        self.assertEqual({number: [s['driver'] for s in found] for number, found in jobs.items()},
+                         {'PENDING-1': [other.id], 'PENDING-2': []})
+        self.assertEqual([job['job_number'] for job in self.suggestions('near=-33.92,18.42&radius=5')], ['PENDING-2'])
+
+        for query in ['limit=0', 'limit=21', 'limit=x', 'bbox=1,2,3']:
+            self.assertEqual(self.client.get(f'/api/jobs/dispatch-suggestions/?{query}').status_code, 400, query)
+
+
+    def test_only_drivers_within_reach_are_loaded(self):
+        near, far = make_driver('near'), make_driver('far')
+        self.position(near, 0.009)
+        # About 870 km south, beyond the distance limit
+        self.position(far, -7.8)
+        self.assertEqual(len(Candidates()), 2)
+        self.assertEqual([d['driver'] for d in Candidates(Area.around(-26.1076, 28.0567, 500)).drivers], [near.id])
+        self.assertEqual([s['driver'] for s in self.suggestions()[0]['suggestions']], [near.id])
+
+class DriverDashboardTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.driver = make_driver('john')
+        self.driver.user.set_password('secret')
+        self.driver.user.save()
+        self.vehicle = make_vehicle('REG-1')
+        self.job = make_job('JOB-1', self.driver, self.vehicle)
+        for i in range(3):
+            make_trip(make_job(f'JOB-DONE-{i}', self.driver, make_vehicle(f'REG-DONE-{i}'), status='completed'))
+        self.client.login(username='john', password='secret')
+
+    def test_warm_dashboard_only_loads_the_session_and_user(self):
+        with self.assertNumQueries(9):
+            # session, user, driver id, jobs, active trip, recent trips, and
+            # saving the driver id to the session inside a savepoint
+            self.client.get('/')
+        with self.assertNumQueries(2):
+            response = self.client.get('/')
+        self.assertEqual([job.job_number for job in response.context['assigned_jobs']], ['JOB-1'])
+        self.assertEqual(len(response.context['completed_trips']), 3)
+
+    def test_state_changes_refresh_the_dashboard(self):
+        self.client.get('/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/start-trip/{self.job.id}/', {'start_odometer': '1000', 'start_fuel_level': '60'})
+        response = self.client.get('/')
+        self.assertEqual(response.context['assigned_jobs'], [])
+        self.assertEqual(response.context['active_trip'].job_id, self.job.id)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/end-trip/{response.context["active_trip"].id}/', {'end_odometer': '1010', 'end_fuel_level': '55'})
+        response = self.client.get('/')
+        self.assertIsNone(response.context['active_trip'])
+        self.assertEqual(len(response.context['completed_trips']), 4)
+
+
+@override_settings(TRIP_NUMBER_BLOCK_SIZE=5)
+class TripNumberTests(TransactionTestCase):
+    def setUp(self):
+        trip_numbers.reset()
+        self.driver = make_driver('john')
+        self.vehicle = make_vehicle('REG-1')
+
+    def test_numbers_come_from_reserved_blocks(self):
+        trips = [make_trip(make_job(f'JOB-{i}', self.driver, self.vehicle)) for i in range(7)]
+        self.assertEqual([t.trip_number for t in trips], [f'TRIP-{i:05d}' for i in range(1, 8)])
+        self.assertEqual(Sequence.objects.get(name='trip_number').last_value, 10)
+
+    def test_rolled_back_reservation_is_not_reused(self):
+        try:
+            with transaction.atomic():
+                make_trip(make_job('JOB-0', self.driver, self.vehicle))
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        trips = [make_trip(make_job(f'JOB-{i}', self.driver, self.vehicle)) for i in range(1, 4)]
+        self.assertEqual([t.trip_number for t in trips], ['TRIP-00001', 'TRIP-00002', 'TRIP-00003'])
+
+    def test_concurrent_trip_starts_get_unique_numbers(self):
+        # One driver and vehicle per job: each may only have one started trip
+        jobs = [make_job(f'JOB-{i}', make_driver(f'driver{i}'), make_vehicle(f'REG-{i + 2}')) for i in range(80)]
+        errors = []
+
+        def start_trips(chunk):
+            try:
+                for job in chunk:
+                    while True:
+                        try:
+                            make_trip(job, status='started')
+                            break
+                        except OperationalError as exc:
+                            # SQLite's shared in-memory test database reports
+                            # lock contention instead of waiting for it.
+                            if 'locked' not in str(exc):
+                                raise
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=start_trips, args=(jobs[i::8],)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        numbers = list(Trip.objects.values_list('trip_number', flat=True))
+        self.assertEqual(len(numbers), 80)
+        self.assertEqual(len(set(numbers)), 80)
@@ -0,0 +1,87 @@
+import numpy as np
+from django.db import connections
+from django.db.models import FloatField, Func
+from .encoding import MICRODEGREES, unpack_route_archive
+from .geo import haversine_km
+
+# A fix that implies moving faster than this to reach it and to leave it again
+# is a receiver glitch, not driving, and is left out of the trail.
+MAX_SEGMENT_SPEED_KMH = 250
+
+
+class EpochSeconds(Func):
+    # Seconds since the epoch computed by the database, which is far cheaper
+    # than having Django build an aware datetime for every row.
+    template = 'EXTRACT(EPOCH FROM %(expressions)s)'
+    output_field = FloatField()
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, template='((julianday(%(expressions)s) - 2440587.5) * 86400.0)', **extra_context)
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, template='UNIX_TIMESTAMP(%(expressions)s)', **extra_context)
+
+
+def load_trails(points, archives=()):
+    # `archives` are (trip_id, data) pairs of archived routes to add to the
+    # points' trails
+    queryset = points.order_by('trip_id', 'timestamp', 'id').values_list(
+        'trip_id', 'latitude_e6', 'longitude_e6', EpochSeconds('timestamp'),
+    )
+    # Every column is already numeric, so skip Django's per-row conversion
+    # and hand the cursor's rows straight to NumPy.
+    sql, params = queryset.query.sql_with_params()
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+    parts = []
+    if rows:
+        columns = np.array(rows, dtype=np.float64)
+        parts.append((
+            columns[:, 0].astype(np.int64), columns[:, 1] / MICRODEGREES, columns[:, 2] / MICRODEGREES, columns[:, 3],
+        ))
+    for trip_id, data in archives:
+        _, lats, lngs, micros, _, _ = unpack_route_archive(data)
+        if len(lats):
+            parts.append((np.full(len(lats), trip_id, dtype=np.int64), lats / MICRODEGREES, lngs / MICRODEGREES, micros / 1e6))
+    if not parts:
+        return None
+    if len(parts) == 1:
+        return parts[0]
+    trip_ids, latitudes, longitudes, seconds = (np.concatenate(column) for column in zip(*parts))
+    order = np.lexsort((seconds, trip_ids))
+    return trip_ids[order], latitudes[order], longitudes[order], seconds[order]
+
+
+def _segments(trip_ids, latitudes, longitudes, seconds):
+    same_trip = trip_ids[1:] == trip_ids[:-1]
+    lengths = haversine_km(latitudes[:-1], longitudes[:-1], latitudes[1:], longitudes[1:])
+    hours = np.maximum(np.diff(seconds), 1.0) / 3600
+    implausible = same_trip & (lengths / hours > MAX_SEGMENT_SPEED_KMH)
+    return same_trip, lengths, implausible
+
+
+def trail_lengths(trip_ids, latitudes, longitudes, seconds):
+    # Path length per trip for points sorted by trip then time. Returns the
+    # distinct trip ids and the kilometres driven on each.
+    same_trip, lengths, implausible = _segments(trip_ids, latitudes, longitudes, seconds)
+    glitches = np.zeros(len(trip_ids), dtype=bool)
+    glitches[1:-1] = implausible[:-1] & implausible[1:]
+    if glitches.any():
+        keep = ~glitches
+        trip_ids, latitudes, longitudes, seconds = trip_ids[keep], latitudes[keep], longitudes[keep], seconds[keep]
+        same_trip, lengths, implausible = _segments(trip_ids, latitudes, longitudes, seconds)
+
+    starts = np.flatnonzero(np.r_[True, ~same_trip])
+    totals = np.add.reduceat(np.r_[np.where(same_trip, lengths, 0.0), 0.0], starts)
+    counts = np.diff(np.r_[starts, len(trip_ids)])
+    # A single fix has no path to measure
+    return trip_ids[starts][counts > 1], totals[counts > 1]
+
+
+def gps_trail_distance(points, archives=()):
+    trail = load_trails(points, archives)
+    if trail is None:
+        return None
+    _, totals = trail_lengths(*trail)
+    return float(totals[0]) if len(totals) else None
@@ -0,0 +1,99 @@
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from .caching import invalidate_api_cache
+from .live import end_position
+from .models import BackgroundTask, Driver, Job, Trip, Vehicle
+
+STARTABLE_JOB_STATUSES = ('pending', 'assigned')
+
+# Columns each transition writes; nothing else on the row is touched
+END_TRIP_FIELDS = [
+    'end_odometer', 'end_fuel_level', 'end_location_lat', 'end_location_lng',
+    'end_time', 'notes', 'status', 'metrics_status',
+]
+
+
+class TripTransitionError(Exception):
+    pass
+
+
+class TripNotFound(TripTransitionError):
+    pass
+
+
+def _start_conflict(driver_id, vehicle_id):
+    # Why another started trip stops this one starting, or None
+    if Trip.objects.filter(driver_id=driver_id, status='started').exists():
+        return "You already have an active trip. Please complete it first."
+    if Trip.objects.filter(vehicle_id=vehicle_id, status='started').exists():
+        return "This vehicle is already on another trip."
+    return None
+
+
+def start_trip(driver_id, job_id, start_odometer, start_fuel_level, start_lat=None, start_lng=None):
+    with transaction.atomic():
+        # Locking the driver serializes every start attempt for them, so a
+        # second tap waits for the first and then sees its trip.
+        Driver.objects.select_for_update().filter(id=driver_id).first()
+        job = Job.objects.select_for_update().filter(id=job_id, assigned_driver_id=driver_id).first()
+        if job is None:
+            raise TripNotFound("This job is no longer assigned to you.")
+
+        if job.status not in STARTABLE_JOB_STATUSES:
+            raise TripTransitionError(f"Job {job.job_number} is {job.get_status_display().lower()} and cannot be started.")
+        conflict = _start_conflict(driver_id, job.assigned_vehicle_id)
+        if conflict:
+            raise TripTransitionError(conflict)
+
+        try:
+            with transaction.atomic():
+                trip = Trip.objects.create(
+                    job=job,
+                    driver_id=driver_id,
+                    vehicle_id=job.assigned_vehicle_id,
+                    start_odometer=start_odometer,
+                    start_fuel_level=start_fuel_level,
+                    start_location_lat=start_lat,
+                    start_location_lng=start_lng,
+                )
+        except IntegrityError:
+            # The one-started-trip constraints caught a race the checks above
+            # could not see (e.g. on a database without row locks); the trip
+            # that won is visible now. Any other failure is not a conflict.
+            conflict = _start_conflict(driver_id, job.assigned_vehicle_id)
+            if conflict is None:
+                raise
+            raise TripTransitionError(conflict)
+
+        job.status = 'in_progress'
+        job.save(update_fields=['status'])
+    return trip
+
+
+def end_trip(driver_id, trip_id, end_odometer, end_fuel_level, end_lat=None, end_lng=None, notes=''):
+    with transaction.atomic():
+        trip = Trip.objects.select_for_update().filter(id=trip_id, driver_id=driver_id).first()
+        if trip is None:
+            raise TripNotFound("This trip is not one of yours.")
+        if trip.status != 'started':
+            raise TripTransitionError(f"Trip {trip.trip_number} has already ended.")
+
+        trip.end_odometer = end_odometer
+        trip.end_fuel_level = end_fuel_level
+        trip.end_location_lat = end_lat
+        trip.end_location_lng = end_lng
+        trip.end_time = timezone.now()
+        trip.notes = notes
+        trip.status = 'completed'
+        trip.metrics_status = 'pending'
+        trip.save(update_fields=END_TRIP_FIELDS)
+
+        # Metrics, rollups and the simplified route are finalized by the
+        # background worker once this commits.
+        Job.objects.filter(id=trip.job_id).update(status='completed')
+        Vehicle.objects.filter(id=trip.vehicle_id).update(current_odometer=end_odometer)
+        # update() sends no save signals, so clear the cached API responses here
+        invalidate_api_cache(Job, Vehicle)
+        end_position(trip.id)
+        BackgroundTask.objects.enqueue('finalize_trip', trip_id=trip.id)
+    return trip
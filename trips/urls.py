@@ -9,6 +9,7 @@ router.register(r'vehicles', views.VehicleViewSet)
 router.register(r'jobs', views.JobViewSet)
 router.register(r'trips', views.TripViewSet)
 router.register(r'trip-events', views.TripEventViewSet)
+router.register(r'analytics', views.AnalyticsViewSet, basename='analytics')
 
 urlpatterns = [
     path('', views.driver_dashboard, name='driver_dashboard'),
@@ -19,5 +20,11 @@ urlpatterns = [
     path('login/', auth_views.LoginView.as_view(), name='login'),
     path('logout/', auth_views.LogoutView.as_view(), name='logout'),
     
+    # Async views, ahead of the router so they take these paths
+    path('api/trips/gps-points/', views.fleet_gps_points, name='gps-points-batch'),
+    path('api/trips/<int:trip_id>/gps-points/', views.trip_gps_points, name='trip-gps-points'),
+    path('api/live-positions/', views.live_positions, name='live-positions'),
+    path('api/live-positions/nearest/', views.nearest_live_positions, name='nearest-live-positions'),
+    path('api/live-positions/stream/', views.live_position_stream, name='live-position-stream'),
     path('api/', include(router.urls)),
 ]
@@ -1,72 +1,150 @@
+import hmac
+import json
+from functools import wraps
 from django.shortcuts import render, redirect, get_object_or_404
-from django.contrib.auth.decorators import login_required
 from django.contrib.auth import login, authenticate
+from django.contrib.auth.models import User
 from django.contrib import messages
+from django.conf import settings
 from django.utils import timezone
-from rest_framework import viewsets
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
+from rest_framework import status, viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import (
+    APIException, AuthenticationFailed, NotAuthenticated, NotFound, ParseError, ValidationError,
+)
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
 from decimal import Decimal
 from .models import Driver, Vehicle, Job, Trip, TripEvent, GPSRoutePoint
 from .serializers import (
     DriverSerializer, VehicleSerializer, JobSerializer,
     TripSerializer, TripEventSerializer, GPSRoutePointSerializer
 )
+from .ingestion import ingest_trip_points, ingest_fleet_points
+from .encoding import encode_polyline, encode_route_delta
+from .renderers import PolylineRenderer, RouteDeltaRenderer, NDJSONRenderer, CSVRenderer
+from .route_archive import trip_points
+from .routes import astream_route, route_rows, simplified_route_rows, stream_route
+from .simplify import MIN_ZOOM, MAX_ZOOM
+from .pagination import TripCursorPagination
+from .filters import filter_jobs, filter_trips
+from . import analytics, dispatch, live, transitions
+from .drivers import dashboard_context, driver_required
+from .caching import CachedResponseMixin
 
 
-@login_required
-def driver_dashboard(request):
-    try:
-        driver = Driver.objects.get(user=request.user)
-    except Driver.DoesNotExist:
-        messages.error(request, "You are not registered as a driver.")
-        return redirect('/admin/')
+def _points_payload(data):
+    if isinstance(data, dict):
+        return data.get('points')
+    return data
+
+
+def _simplification_params(query_params):
+    zoom = query_params.get('zoom')
+    tolerance = query_params.get('tolerance')
     
-    assigned_jobs = Job.objects.filter(assigned_driver=driver, status='assigned')
-    active_trip = Trip.objects.filter(driver=driver, status='started').first()
-    completed_trips = Trip.objects.filter(driver=driver, status='completed')[:5]
+    if zoom is not None:
+        try:
+            zoom = int(zoom)
+        except ValueError:
+            zoom = None
+        if zoom is None or not MIN_ZOOM <= zoom <= MAX_ZOOM:
+            raise ValidationError({'zoom': [f'An integer between {MIN_ZOOM} and {MAX_ZOOM} is required.']})
+        return zoom, None
     
-    context = {
-        'driver': driver,
-        'assigned_jobs': assigned_jobs,
-        'active_trip': active_trip,
-        'completed_trips': completed_trips,
-    }
-    return render(request, 'trips/driver_dashboard.html', context)
+    if tolerance is not None:
+        try:
+            tolerance = float(tolerance)
+        except ValueError:
+            tolerance = None
+        if tolerance is None or not 0 < tolerance < float('inf'):
+            raise ValidationError({'tolerance': ['A positive number of metres is required.']})
+        return None, tolerance
+    
+    return None, None
 
 
-@login_required
-def start_trip(request, job_id):
+def _live_feed_params(query_params):
+    since = query_params.get('since')
+    wait = query_params.get('wait')
+    
+    if since is not None:
+        try:
+            since = int(since)
+        except ValueError:
+            since = None
+        if since is None or since < 0:
+            raise ValidationError({'since': ['A non-negative revision number is required.']})
+    
+    if wait is not None:
+        try:
+            wait = float(wait)
+        except ValueError:
+            wait = None
+        if wait is None or not 0 <= wait <= live.MAX_WAIT:
+            raise ValidationError({'wait': [f'A number of seconds between 0 and {live.MAX_WAIT} is required.']})
+    
+    return since, wait or 0
+
+
+def _limit_param(query_params, default, maximum, errors):
+    limit = query_params.get('limit')
+    if limit is None:
+        return default
+    if not limit.isdigit() or not 1 <= int(limit) <= maximum:
+        errors['limit'] = [f'An integer between 1 and {maximum} is required.']
+        return None
+    return int(limit)
+
+
+def _nearest_params(query_params):
+    errors = {}
     try:
-        driver = Driver.objects.get(user=request.user)
-    except Driver.DoesNotExist:
-        messages.error(request, "You are not registered as a driver.")
-        return redirect('/admin/')
+        point = [float(query_params[name]) for name in ('latitude', 'longitude')]
+    except (KeyError, ValueError):
+        point = None
+    if point is None or not -90 <= point[0] <= 90 or not -180 <= point[1] <= 180:
+        errors['latitude'] = ['A latitude and longitude are required.']
+    limit = _limit_param(query_params, live.NEAREST_LIMIT, 100, errors)
     
-    job = get_object_or_404(Job, id=job_id, assigned_driver=driver)
+    if errors:
+        raise ValidationError(errors)
+    return point, limit
+
+
+@driver_required
+def driver_dashboard(request, driver_id):
+    return render(request, 'trips/driver_dashboard.html', dashboard_context(driver_id))
+
+
+@driver_required
+def start_trip(request, driver_id, job_id):
+    job = get_object_or_404(Job.objects.select_related('assigned_vehicle'), id=job_id, assigned_driver_id=driver_id)
     
-    if Trip.objects.filter(driver=driver, status='started').exists():
+    if Trip.objects.filter(driver_id=driver_id, status='started').exists():
         messages.error(request, "You already have an active trip. Please complete it first.")
         return redirect('driver_dashboard')
     
     if request.method == 'POST':
-        start_odometer = request.POST.get('start_odometer')
-        start_fuel_level = request.POST.get('start_fuel_level')
         start_lat = request.POST.get('start_lat')
         start_lng = request.POST.get('start_lng')
         
-        trip = Trip.objects.create(
-            job=job,
-            driver=driver,
-            vehicle=job.assigned_vehicle,
-            start_odometer=Decimal(start_odometer),
-            start_fuel_level=Decimal(start_fuel_level),
-            start_location_lat=Decimal(start_lat) if start_lat else None,
-            start_location_lng=Decimal(start_lng) if start_lng else None,
-        )
-        
-        job.status = 'in_progress'
-        job.save()
+        try:
+            trip = transitions.start_trip(
+                driver_id,
+                job.id,
+                start_odometer=Decimal(request.POST.get('start_odometer')),
+                start_fuel_level=Decimal(request.POST.get('start_fuel_level')),
+                start_lat=Decimal(start_lat) if start_lat else None,
+                start_lng=Decimal(start_lng) if start_lng else None,
+            )
+        except transitions.TripTransitionError as exc:
+            messages.error(request, str(exc))
+            return redirect('driver_dashboard')
         
         messages.success(request, f"Trip {trip.trip_number} started successfully!")
         return redirect('active_trip', trip_id=trip.id)
@@ -78,15 +156,11 @@ def start_trip(request, job_id):
     return render(request, 'trips/start_trip.html', context)
 
 
-@login_required
-def active_trip(request, trip_id):
-    try:
-        driver = Driver.objects.get(user=request.user)
-    except Driver.DoesNotExist:
-        messages.error(request, "You are not registered as a driver.")
-        return redirect('/admin/')
-    
-    trip = get_object_or_404(Trip, id=trip_id, driver=driver, status='started')
+@driver_required
+def active_trip(request, driver_id, trip_id):
+    trip = get_object_or_404(
+        Trip.objects.select_related('job', 'vehicle'), id=trip_id, driver_id=driver_id, status='started'
+    )
     
     if request.method == 'POST':
         action_type = request.POST.get('action')
@@ -119,39 +193,29 @@ def active_trip(request, trip_id):
     return render(request, 'trips/active_trip.html', context)
 
 
-@login_required
-def end_trip(request, trip_id):
-    try:
-        driver = Driver.objects.get(user=request.user)
-    except Driver.DoesNotExist:
-        messages.error(request, "You are not registered as a driver.")
-        return redirect('/admin/')
-    
-    trip = get_object_or_404(Trip, id=trip_id, driver=driver, status='started')
+@driver_required
+def end_trip(request, driver_id, trip_id):
+    trip = get_object_or_404(
+        Trip.objects.select_related('job', 'vehicle'), id=trip_id, driver_id=driver_id, status='started'
+    )
     
     if request.method == 'POST':
-        end_odometer = request.POST.get('end_odometer')
-        end_fuel_level = request.POST.get('end_fuel_level')
         end_lat = request.POST.get('end_lat')
         end_lng = request.POST.get('end_lng')
-        notes = request.POST.get('notes', '')
-        
-        trip.end_odometer = Decimal(end_odometer)
-        trip.end_fuel_level = Decimal(end_fuel_level)
-        trip.end_location_lat = Decimal(end_lat) if end_lat else None
-        trip.end_location_lng = Decimal(end_lng) if end_lng else None
-        trip.end_time = timezone.now()
-        trip.notes = notes
-        trip.status = 'completed'
-        trip.save()
-        
-        trip.calculate_metrics()
-        
-        trip.job.status = 'completed'
-        trip.job.save()
         
-        trip.vehicle.current_odometer = trip.end_odometer
-        trip.vehicle.save()
+        try:
+            trip = transitions.end_trip(
+                driver_id,
+                trip.id,
+                end_odometer=Decimal(request.POST.get('end_odometer')),
+                end_fuel_level=Decimal(request.POST.get('end_fuel_level')),
+                end_lat=Decimal(end_lat) if end_lat else None,
+                end_lng=Decimal(end_lng) if end_lng else None,
+                notes=request.POST.get('notes', ''),
+            )
+        except transitions.TripTransitionError as exc:
+            messages.error(request, str(exc))
+            return redirect('driver_dashboard')
         
         messages.success(request, f"Trip {trip.trip_number} completed successfully!")
         return redirect('driver_dashboard')
@@ -162,33 +226,209 @@ def end_trip(request, trip_id):
     return render(request, 'trips/end_trip.html', context)
 
 
-class DriverViewSet(viewsets.ReadOnlyModelViewSet):
-    queryset = Driver.objects.all()
+class DriverViewSet(CachedResponseMixin, viewsets.ReadOnlyModelViewSet):
+    queryset = Driver.objects.select_related('user')
     serializer_class = DriverSerializer
+    cache_models = [Driver, User]
 
 
-class VehicleViewSet(viewsets.ReadOnlyModelViewSet):
+class VehicleViewSet(CachedResponseMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Vehicle.objects.all()
     serializer_class = VehicleSerializer
+    cache_models = [Vehicle]
 
 
-class JobViewSet(viewsets.ReadOnlyModelViewSet):
-    queryset = Job.objects.all()
+class JobViewSet(CachedResponseMixin, viewsets.ReadOnlyModelViewSet):
+    queryset = Job.objects.select_related('assigned_driver__user', 'assigned_vehicle')
     serializer_class = JobSerializer
+    cache_models = [Job, Driver, User, Vehicle]
+    
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action != 'list':
+            return queryset
+        return filter_jobs(queryset, self.request.query_params)
+    
+    @action(detail=False, methods=['get'], url_path='dispatch-suggestions')
+    def dispatch_suggestions(self, request):
+        # Not cached: the suggestions follow the drivers' live positions
+        errors = {}
+        limit = _limit_param(request.query_params, dispatch.SUGGESTION_LIMIT, dispatch.MAX_SUGGESTION_LIMIT, errors)
+        if errors:
+            raise ValidationError(errors)
+        jobs = filter_jobs(Job.objects.filter(status='pending'), request.query_params)
+        return Response({'jobs': dispatch.suggest_drivers(jobs, limit)})
 
 
 class TripViewSet(viewsets.ReadOnlyModelViewSet):
-    queryset = Trip.objects.all()
+    queryset = Trip.objects.select_related('driver__user', 'vehicle', 'job')
     serializer_class = TripSerializer
+    pagination_class = TripCursorPagination
     
-    @action(detail=True, methods=['get'])
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action != 'list':
+            return queryset
+        return filter_trips(queryset, self.request.query_params)
+    
+    @action(
+        detail=True, methods=['get'], url_path='gps-route',
+        renderer_classes=api_settings.DEFAULT_RENDERER_CLASSES + [
+            PolylineRenderer, RouteDeltaRenderer, NDJSONRenderer, CSVRenderer
+        ]
+    )
     def gps_route(self, request, pk=None):
         trip = self.get_object()
-        gps_points = trip.gps_points.all()
-        serializer = GPSRoutePointSerializer(gps_points, many=True)
-        return Response(serializer.data)
+        route_format = request.accepted_renderer.format
+        
+        if route_format in ('ndjson', 'csv'):
+            # As for the live stream, only an ASGI server can read an async iterator
+            if isinstance(request._request, ASGIRequest):
+                stream = astream_route(trip, route_format)
+            else:
+                stream = stream_route(trip, route_format)
+            response = StreamingHttpResponse(stream, content_type=request.accepted_renderer.media_type)
+            response['Content-Disposition'] = f'attachment; filename="{trip.trip_number}-gps.{route_format}"'
+            return response
+        zoom, tolerance = _simplification_params(request.query_params)
+        simplified = zoom is not None or tolerance is not None
+        
+        if simplified:
+            rows = simplified_route_rows(trip, zoom=zoom, tolerance=tolerance)
+        elif route_format in ('polyline', 'delta'):
+            rows = route_rows(trip)
+        else:
+            serializer = GPSRoutePointSerializer(trip_points(trip), many=True)
+            return Response(serializer.data)
+        
+        if route_format == 'polyline':
+            polyline = encode_polyline((lat, lng) for lat, lng, _, _ in rows)
+            return Response({'trip': trip.id, 'polyline': polyline})
+        
+        if route_format == 'delta':
+            return Response(encode_route_delta(rows))
+        
+        return Response([
+            {'latitude': lat, 'longitude': lng, 'timestamp': timezone.localtime(timestamp), 'speed': speed}
+            for lat, lng, timestamp, speed in rows
+        ])
 
 
 class TripEventViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = TripEvent.objects.all()
     serializer_class = TripEventSerializer
+
+
+class AnalyticsViewSet(viewsets.ViewSet):
+    @action(detail=False, methods=['get'])
+    def summary(self, request):
+        return Response(analytics.fleet_summary(request.query_params))
+    
+    @action(detail=False, methods=['get'])
+    def drivers(self, request):
+        return Response(analytics.driver_rollup(request.query_params))
+    
+    @action(detail=False, methods=['get'])
+    def vehicles(self, request):
+        return Response(analytics.vehicle_rollup(request.query_params))
+    
+    @action(detail=False, methods=['get'])
+    def daily(self, request):
+        return Response(analytics.daily_rollup(request.query_params))
+
+
+def _async_api_view(*methods):
+    # DRF views cannot be async, so these views answer with the same JSON
+    # errors DRF would. Trackers post without a CSRF token, as DRF allowed.
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in methods:
+                response = JsonResponse({'detail': f'Method "{request.method}" not allowed.'}, status=405)
+                response['Allow'] = ', '.join(methods)
+                return response
+            try:
+                return await view(request, *args, **kwargs)
+            except APIException as exc:
+                detail = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+                response = JsonResponse(detail, status=exc.status_code, safe=False)
+                if exc.status_code == status.HTTP_401_UNAUTHORIZED:
+                    response['WWW-Authenticate'] = 'Bearer'
+                return response
+        wrapper.csrf_exempt = True
+        return wrapper
+    return decorator
+
+
+def _check_tracker_token(request):
+    # Trackers have no session, so each request carries one of the
+    # GPS_INGEST_TOKENS; without one, anyone could move any trip's vehicle
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() != 'bearer' or not token:
+        raise NotAuthenticated()
+    if not any(hmac.compare_digest(token.encode(), known.encode()) for known in settings.GPS_INGEST_TOKENS):
+        raise AuthenticationFailed('Invalid token.')
+
+
+def _json_body(request):
+    # Read from the stream, as DRF's parser does: request.body would refuse
+    # batches larger than DATA_UPLOAD_MAX_MEMORY_SIZE.
+    try:
+        return json.load(request)
+    except ValueError as exc:
+        raise ParseError(f'JSON parse error - {exc}')
+
+
+def _ingest_body(ingest, request, *args):
+    # Decoding a large batch would stall the event loop as much as storing
+    # it, and the insert needs a transaction, which async code cannot open:
+    # both run in one thread.
+    return ingest(*args, _points_payload(_json_body(request)))
+
+
+@_async_api_view('POST')
+async def trip_gps_points(request, trip_id):
+    _check_tracker_token(request)
+    trip = await Trip.objects.only('id', 'status').filter(id=trip_id).afirst()
+    if trip is None:
+        raise NotFound()
+    summary = await sync_to_async(_ingest_body)(ingest_trip_points, request, trip)
+    return JsonResponse(summary, status=status.HTTP_201_CREATED)
+
+
+@_async_api_view('POST')
+async def fleet_gps_points(request):
+    _check_tracker_token(request)
+    summary = await sync_to_async(_ingest_body)(ingest_fleet_points, request)
+    return JsonResponse(summary, status=status.HTTP_201_CREATED)
+
+
+@_async_api_view('GET')
+async def live_positions(request):
+    since, wait = _live_feed_params(request.GET)
+    if since is None:
+        feed = await live.aposition_feed()
+    else:
+        feed = await live.apoll_positions(since, wait)
+    return JsonResponse(feed, encoder=JSONEncoder)
+
+
+@_async_api_view('GET')
+async def nearest_live_positions(request):
+    point, limit = _nearest_params(request.GET)
+    positions = await sync_to_async(live.nearest_positions)(*point, limit=limit)
+    return JsonResponse({'positions': positions}, encoder=JSONEncoder)
+
+
+@_async_api_view('GET')
+async def live_position_stream(request):
+    since = request.headers.get('Last-Event-ID') or request.GET.get('since')
+    since, _ = _live_feed_params({'since': since} if since else {})
+    # A WSGI server would read an async iterator to the end before sending
+    # anything, so it gets the blocking version of the stream.
+    events = live.aposition_events(since) if isinstance(request, ASGIRequest) else live.position_events(since)
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stops nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
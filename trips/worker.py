@@ -0,0 +1,84 @@
+import logging
+import os
+import socket
+import time
+import traceback
+from datetime import timedelta
+from django.db import close_old_connections
+from django.utils import timezone
+from .models import BackgroundTask
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 5
+RETRY_DELAY = timedelta(seconds=30)
+LOCK_TIMEOUT = timedelta(minutes=10)
+POLL_INTERVAL = 1.0
+
+_handlers = {}
+
+
+def task(name, on_failure=None):
+    # Registers a handler for BackgroundTask rows with this name. on_failure
+    # runs with the task payload once every attempt has failed.
+    def register(function):
+        _handlers[name] = (function, on_failure)
+        return function
+    return register
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def run_task(task):
+    function, on_failure = _handlers[task.name]
+    try:
+        function(**task.payload)
+    except Exception:
+        task.last_error = traceback.format_exc()
+        if task.attempts < MAX_ATTEMPTS:
+            # Back off exponentially: 30 s, 1 min, 2 min, ...
+            task.status = 'queued'
+            task.run_after = timezone.now() + RETRY_DELAY * 2 ** (task.attempts - 1)
+            logger.warning("Task %s failed (attempt %s), retrying at %s", task, task.attempts, task.run_after)
+        else:
+            task.status = 'failed'
+            task.finished_at = timezone.now()
+            logger.error("Task %s failed after %s attempts", task, task.attempts)
+            if on_failure:
+                on_failure(**task.payload)
+    else:
+        task.status = 'done'
+        task.last_error = ''
+        task.finished_at = timezone.now()
+    task.locked_by = ''
+    task.locked_at = None
+    task.save(update_fields=['status', 'run_after', 'last_error', 'finished_at', 'locked_by', 'locked_at'])
+    return task
+
+
+def run_pending(worker=None, limit=None):
+    # Runs claimable tasks until none are left (or limit is reached) and
+    # returns how many ran.
+    worker = worker or worker_name()
+    count = 0
+    while limit is None or count < limit:
+        task = BackgroundTask.objects.claim(worker, LOCK_TIMEOUT)
+        if task is None:
+            break
+        run_task(task)
+        count += 1
+    return count
+
+
+def run_worker(poll_interval=POLL_INTERVAL, burst=False):
+    worker = worker_name()
+    logger.info("Worker %s started", worker)
+    while True:
+        close_old_connections()
+        ran = run_pending(worker)
+        if burst and not ran:
+            return
+        if not ran:
+            time.sleep(poll_interval)